@@ -0,0 +1,353 @@
+"""
+Long-running local analysis service, so tools that want engine evaluations share one warm pool of engine
+processes instead of each starting their own.
+The server listens on a Unix socket or a localhost TCP port and speaks JSON lines. A request is one line,
+    {"id": 1, "positions": ["<fen>", ...], "depth": 6}
+with a "depth", "time" (seconds) and/or "nodes" budget for every position. Each position's result is sent
+back as its own line the moment it is ready, in whatever order they finish, and a final line says the
+request is done:
+    {"id": 1, "index": 0, "fen": "<fen>", "bestMove": "e2e4", "score": 25, "mate": null, "depth": 6, ..., "cached": false}
+    {"id": 1, "done": true, "positions": 1}
+A connection stays open for as many requests as the client likes, and requests on one connection may overlap
+(their lines carry their id). {"id": 2, "command": "stats"} answers with the cache and pool counters.
+Results of depth limited searches are kept in an LRU cache keyed by position and depth, and a position
+that is already being searched for one request is not searched a second time for another.
+
+Usage from the Chess folder:
+    python AnalysisServer.py serve --socket /tmp/chess-analysis.sock --workers 4
+    python AnalysisServer.py analyse --socket /tmp/chess-analysis.sock --depth 6 positions.epd
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Chess.Perft import BACKENDS
+from Chess.Search import Searcher, MAX_PLY
+
+DEFAULT_PORT = 8765
+CACHE_SIZE = 100000  # results kept by the LRU cache
+MAX_LINE = 1 << 24   # longest request line the server reads, a batch of about 200k FENs
+
+
+def positionKey(fen):
+    # the FEN without the fullmove number, which the search doesn't look at
+    return ' '.join(fen.split()[:5])
+
+
+def _initWorker(hashMB, backend):
+    global _searcher, _gameStateClass
+    _searcher = Searcher(hashMB)
+    _gameStateClass = BACKENDS[backend]
+
+
+def _ping():
+    # run once per worker when the server starts, so the first request doesn't wait for processes to start
+    return os.getpid()
+
+
+def analysePosition(fen, depth, timeLimit, nodeLimit):
+    # runs in a worker: the search result of one position as a JSON ready dict
+    gs = _gameStateClass.from_fen(fen)
+    result = _searcher.search(gs, maxDepth=depth or MAX_PLY, timeLimit=timeLimit, nodeLimit=nodeLimit)
+    return {'bestMove': result.bestMove.getChessNotation() if result.bestMove is not None else None,
+            'score': result.score, 'mate': result.mateIn(), 'depth': result.depth,
+            'pv': [move.getChessNotation() for move in result.pv], 'nodes': result.nodes,
+            'seconds': result.seconds}
+
+
+class ResultCache():
+    '''
+    Least recently used cache of search results keyed by (position, depth). Only searches with nothing but a
+    depth limit are stored and looked up.
+    '''
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+class AnalysisServer():
+    def __init__(self, workers=None, hashMB=16, backend='bitboard', cacheSize=CACHE_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_initWorker, initargs=(hashMB, backend))
+        self.cache = ResultCache(cacheSize)
+        self.pending = {}  # (position, depth) -> asyncio future of a search running for some request
+        self.searches = 0
+        self.connections = 0
+        self.server = None
+
+    async def start(self, socketPath=None, host='127.0.0.1', port=DEFAULT_PORT):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, _ping) for _ in range(self.workers)))
+        if socketPath is not None:
+            if os.path.exists(socketPath):
+                os.unlink(socketPath)  # left behind by a server that didn't shut down cleanly
+            self.server = await asyncio.start_unix_server(self.serveConnection, socketPath, limit=MAX_LINE)
+        else:
+            self.server = await asyncio.start_server(self.serveConnection, host, port, limit=MAX_LINE)
+        return self.server
+
+    async def serveForever(self, socketPath=None, host='127.0.0.1', port=DEFAULT_PORT):
+        server = await self.start(socketPath, host, port)
+        print(f"listening on {socketPath or f'{host}:{server.sockets[0].getsockname()[1]}'} "
+              f"with {self.workers} workers", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+            if socketPath is not None and os.path.exists(socketPath):
+                os.unlink(socketPath)
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.pool.shutdown(cancel_futures=True)
+
+    async def serveConnection(self, reader, writer):
+        # one client, any number of requests, each answered by a task of its own so they can overlap
+        self.connections += 1
+        tasks = set()
+
+        async def send(message):
+            if writer.is_closing():
+                return
+            writer.write(json.dumps(message).encode() + b'\n')
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass  # the client went away, the reader loop notices
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("a request is a JSON object")
+                except ValueError as e:
+                    await send({'error': f"bad request: {e}"})
+                    continue
+                task = asyncio.ensure_future(self.handleRequest(request, send))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass  # the client went away or sent a line past MAX_LINE
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def handleRequest(self, request, send):
+        requestId = request.get('id')
+        if request.get('command') == 'stats':
+            await send({'id': requestId, 'stats': self.stats()})
+            return
+        positions = request.get('positions')
+        if not isinstance(positions, list) or not all(isinstance(fen, str) for fen in positions):
+            await send({'id': requestId, 'error': "positions must be a list of FEN strings"})
+            return
+        try:
+            depth, timeLimit, nodeLimit = (None if request.get(name) is None else kind(request[name])
+                                           for name, kind in (('depth', int), ('time', float), ('nodes', int)))
+        except (TypeError, ValueError):
+            await send({'id': requestId, 'error': "depth, time and nodes must be numbers"})
+            return
+        if depth is None and timeLimit is None and nodeLimit is None:
+            await send({'id': requestId, 'error': "give a depth, time or nodes budget"})
+            return
+        if depth is not None:
+            depth = max(1, min(depth, MAX_PLY))
+
+        async def analyseOne(index, fen):
+            message = {'id': requestId, 'index': index, 'fen': fen}
+            try:
+                message.update(await self.analyse(fen, depth, timeLimit, nodeLimit))
+            except Exception as e:  # a bad FEN, or a worker that died, only fails its own position
+                message['error'] = str(e) or type(e).__name__
+            await send(message)
+        await asyncio.gather(*(analyseOne(index, fen) for index, fen in enumerate(positions)))
+        await send({'id': requestId, 'done': True, 'positions': len(positions)})
+
+    async def analyse(self, fen, depth, timeLimit, nodeLimit):
+        '''
+        The result dict of one position, from the cache, from a search another request already started,
+        or from a new search in the pool. Only a search with nothing but a depth limit is looked up, its
+        result doesn't depend on how busy the machine is.
+        '''
+        position = positionKey(fen)
+        if len(position.split()) < 4:
+            raise ValueError(f"FEN needs at least 4 fields: {fen!r}")
+        cacheable = timeLimit is None and nodeLimit is None
+        key = (position, depth)
+        if cacheable:
+            result = self.cache.get(key)
+            if result is not None:
+                return dict(result, cached=True)
+            if key in self.pending:
+                return dict(await asyncio.shield(self.pending[key]), cached=True)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.pool, analysePosition, fen, depth, timeLimit, nodeLimit)
+        if cacheable:
+            self.pending[key] = future
+        self.searches += 1
+        try:
+            result = await future
+        finally:
+            if cacheable:
+                del self.pending[key]
+        if cacheable:  # a time or node limited search stops wherever the machine got to, it isn't kept
+            self.cache.put(key, result)
+        return dict(result, cached=False)
+
+    def stats(self):
+        return {'workers': self.workers, 'connections': self.connections, 'searches': self.searches,
+                'running': len(self.pending), 'cacheEntries': len(self.cache.entries),
+                'cacheHits': self.cache.hits, 'cacheMisses': self.cache.misses}
+
+
+class AnalysisClient():
+    '''
+    Blocking client that keeps one connection open across requests.
+        with AnalysisClient(socketPath="/tmp/chess-analysis.sock") as client:
+            for result in client.analyse(fens, depth=6):
+                print(result['index'], result['bestMove'], result['score'])
+    '''
+    def __init__(self, socketPath=None, host='127.0.0.1', port=DEFAULT_PORT, timeout=None):
+        if socketPath is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(socketPath)
+        else:
+            self.socket = socket.create_connection((host, port), timeout)
+        self.file = self.socket.makefile('rwb')
+        self.nextId = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def request(self, message):
+        # sends one request and returns its id
+        self.nextId += 1
+        self.file.write(json.dumps(dict(message, id=self.nextId)).encode() + b'\n')
+        self.file.flush()
+        return self.nextId
+
+    def readLine(self):
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("the analysis server closed the connection")
+        return json.loads(line)
+
+    def analyse(self, fens, depth=None, timeLimit=None, nodes=None):
+        '''
+        Yields the result dict of every position as the server streams it back, in the order they finish
+        (each has the 'index' of its FEN). Positions the server couldn't analyse have an 'error' instead.
+        '''
+        requestId = self.request({'positions': list(fens), 'depth': depth, 'time': timeLimit, 'nodes': nodes})
+        while True:
+            message = self.readLine()
+            if message.get('id') != requestId:
+                continue
+            if 'positions' in message and message.get('done'):
+                return
+            if 'index' not in message:
+                raise ValueError(message.get('error', "unexpected reply from the analysis server"))
+            yield message
+
+    def stats(self):
+        requestId = self.request({'command': 'stats'})
+        while True:
+            message = self.readLine()
+            if message.get('id') == requestId:
+                return message['stats']
+
+
+def readPositions(path):
+    # FENs or EPD lines of a file ('-' for stdin), EPD operations after the 4th field are dropped
+    stream = sys.stdin if path == '-' else open(path)
+    with stream:
+        fens = []
+        for line in stream:
+            fields = line.split(';')[0].split()
+            if len(fields) >= 4:
+                # EPD has no clocks, a FEN's 5th and 6th fields are numbers
+                clocks = fields[4:6] if all(field.isdigit() for field in fields[4:6]) else []
+                fens.append(' '.join(fields[:4] + clocks))
+        return fens
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local batch analysis server and its client")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name in ('serve', 'analyse'):
+        sub = commands.add_parser(name)
+        sub.add_argument('--socket', help="Unix socket path (default a localhost TCP port)")
+        sub.add_argument('--host', default='127.0.0.1')
+        sub.add_argument('--port', type=int, default=DEFAULT_PORT)
+        if name == 'serve':
+            sub.add_argument('--workers', type=int, help="engine processes (default one per CPU)")
+            sub.add_argument('--hash', type=int, default=16, help="transposition table MB per worker")
+            sub.add_argument('--backend', choices=sorted(BACKENDS), default='bitboard')
+            sub.add_argument('--cache', type=int, default=CACHE_SIZE, help="results kept in the cache")
+        else:
+            sub.add_argument('positions', help="file of FEN or EPD lines, - for stdin")
+            sub.add_argument('--depth', type=int)
+            sub.add_argument('--time', type=float, help="seconds per position")
+            sub.add_argument('--nodes', type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        server = AnalysisServer(args.workers, args.hash, args.backend, args.cache)
+        try:
+            asyncio.run(server.serveForever(args.socket, args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if args.depth is None and args.time is None and args.nodes is None:
+        parser.error("give --depth, --time or --nodes")
+    fens = readPositions(args.positions)
+    start = time.perf_counter()
+    with AnalysisClient(args.socket, args.host, args.port) as client:
+        for result in client.analyse(fens, args.depth, args.time, args.nodes):
+            print(json.dumps(result), flush=True)
+    print(f"{len(fens)} positions in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
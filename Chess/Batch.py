@@ -0,0 +1,218 @@
+"""
+Vectorized evaluation and move counting over many positions at once with NumPy.
+A batch of N positions is an (N, 64) int8 array, square = row * 8 + col as in GameState.board, holding
+0 for an empty square and 1 to 6 for a white pawn, knight, bishop, rook, queen or king (negative for black).
+Per-piece-type bitboards are built from that with packbits, so attacks and moves are worked out with shifts
+on (N,) uint64 arrays, every position in the same operation. 100k+ positions per call take well under a second.
+Castling and en passant depend on state the array doesn't hold and aren't counted as moves.
+Bits are counted with np.bitwise_count on NumPy 2.0 and later, and with a 16-bit lookup table before that.
+"""
+import numpy as np
+from Chess.Bitboards import FULL_BOARD, ROW_MASKS, COL_MASKS, KNIGHT_OFFSETS, KING_OFFSETS
+from Chess.Evaluation import MIDDLEGAME_SCORES, ENDGAME_SCORES, PHASE_WEIGHTS, MAX_PHASE
+
+_POPCOUNT16 = np.array([bin(i).count('1') for i in range(1 << 16)], dtype=np.uint8)
+
+
+def _lookupPopcount(bits):
+    # set bits of every uint64 in bits, four 16-bit table lookups each
+    bits = np.asarray(bits, dtype=np.uint64)
+    return sum(_POPCOUNT16[(bits >> np.uint64(shift)) & np.uint64(0xFFFF)] for shift in (0, 16, 32, 48))
+
+
+_popcount = getattr(np, 'bitwise_count', _lookupPopcount)  # bitwise_count is new in NumPy 2.0
+
+PIECE_CODES = {'--': 0, 'wp': 1, 'wN': 2, 'wB': 3, 'wR': 4, 'wQ': 5, 'wK': 6,
+               'bp': -1, 'bN': -2, 'bB': -3, 'bR': -4, 'bQ': -5, 'bK': -6}
+CODE_PIECES = {code: piece for piece, code in PIECE_CODES.items()}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+
+# board strings are packed two ascii bytes per square, these turn each byte into a code or a sign
+_TYPE_CODES = np.zeros(256, dtype=np.int8)
+for _piece, _code in PIECE_CODES.items():
+    _TYPE_CODES[ord(_piece[1])] = abs(_code)
+_COLOR_SIGNS = np.zeros(256, dtype=np.int8)
+_COLOR_SIGNS[ord('w')] = 1
+_COLOR_SIGNS[ord('b')] = -1
+
+# the Evaluation piece-square scores as tables indexed by [code + 6, square], and the phase weights by [code + 6]
+MIDDLEGAME_TABLE = np.zeros((13, 64), dtype=np.int32)
+ENDGAME_TABLE = np.zeros((13, 64), dtype=np.int32)
+PHASE_TABLE = np.zeros(13, dtype=np.int32)
+for _piece, _code in PIECE_CODES.items():
+    if _code:
+        MIDDLEGAME_TABLE[_code + 6] = MIDDLEGAME_SCORES[_piece]
+        ENDGAME_TABLE[_code + 6] = ENDGAME_SCORES[_piece]
+        PHASE_TABLE[_code + 6] = PHASE_WEIGHTS[_piece[1]]
+
+_SQUARES = np.arange(64)
+_FULL = np.uint64(FULL_BOARD)
+_NOT_COL_A = np.uint64(FULL_BOARD ^ COL_MASKS[0])
+_NOT_COL_H = np.uint64(FULL_BOARD ^ COL_MASKS[7])
+_NOT_COLS_AB = np.uint64(FULL_BOARD ^ COL_MASKS[0] ^ COL_MASKS[1])
+_NOT_COLS_GH = np.uint64(FULL_BOARD ^ COL_MASKS[6] ^ COL_MASKS[7])
+# (square offset, mask of the squares a shift by it may land on without wrapping around the board)
+_COL_WRAP = {-2: _NOT_COLS_GH, -1: _NOT_COL_H, 0: _FULL, 1: _NOT_COL_A, 2: _NOT_COLS_AB}
+KNIGHT_SHIFTS = tuple((dr * 8 + dc, _COL_WRAP[dc]) for dr, dc in KNIGHT_OFFSETS)
+KING_SHIFTS = tuple((dr * 8 + dc, _COL_WRAP[dc]) for dr, dc in KING_OFFSETS)
+ROOK_SHIFTS = tuple((dr * 8 + dc, _COL_WRAP[dc]) for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)))
+BISHOP_SHIFTS = tuple((dr * 8 + dc, _COL_WRAP[dc]) for dr, dc in ((-1, -1), (-1, 1), (1, -1), (1, 1)))
+# per color: push offset, the row a single push has to reach for a double push, capture shifts, promotion row
+PAWN_SHIFTS = {'w': (-8, np.uint64(ROW_MASKS[5]), ((-9, _NOT_COL_H), (-7, _NOT_COL_A)), np.uint64(ROW_MASKS[0])),
+               'b': (8, np.uint64(ROW_MASKS[2]), ((7, _NOT_COL_H), (9, _NOT_COL_A)), np.uint64(ROW_MASKS[7]))}
+
+
+def packBoard(board):
+    # a single 8x8 GameState.board as a (64,) int8 array
+    return packBoards([board])[0]
+
+
+def packBoards(boards):
+    '''
+    Packs a list of GameState.board lists into an (N, 64) int8 array.
+    The board strings are joined and read back as bytes, so there is no Python work per square.
+    '''
+    text = ''.join([''.join([''.join(row) for row in board]) for board in boards]).encode('ascii')
+    chars = np.frombuffer(text, dtype=np.uint8).reshape(len(boards), 64, 2)
+    return _TYPE_CODES[chars[:, :, 1]] * _COLOR_SIGNS[chars[:, :, 0]]
+
+
+def packGameStates(gameStates):
+    # (boards, whiteToMove) for a list of GameStates, whiteToMove being an (N,) bool array
+    return packBoards([gs.board for gs in gameStates]), np.array([gs.whiteToMove for gs in gameStates], dtype=bool)
+
+
+def unpackBoard(codes):
+    # a (64,) array back into an 8x8 GameState.board
+    return [[CODE_PIECES[int(code)] for code in codes[r * 8:r * 8 + 8]] for r in range(8)]
+
+
+def toBitboards(mask):
+    # an (N, 64) bool array into an (N,) uint64 array of bitboards, bit row * 8 + col
+    return np.packbits(mask, axis=1, bitorder='little').view('<u8').ravel().astype(np.uint64)
+
+
+def fromBitboards(bitboards):
+    # an (N,) uint64 array of bitboards into an (N, 64) bool array
+    return np.unpackbits(bitboards.astype('<u8').view(np.uint8).reshape(-1, 8), axis=1,
+                         bitorder='little').astype(bool)
+
+
+def pieceBitboards(boards):
+    # {code: (N,) uint64 bitboard of the squares holding that piece} for every non-empty code
+    return {code: toBitboards(boards == code) for code in CODE_PIECES if code}
+
+
+def evaluate(boards, whiteToMove=None):
+    '''
+    Tapered material plus piece-square score of every position, the same numbers Evaluation.evaluate gives
+    without registered terms. Scores are from white's point of view, or from the side to move's if whiteToMove
+    is given.
+    '''
+    codes = boards.astype(np.intp) + 6
+    middlegame = MIDDLEGAME_TABLE[codes, _SQUARES].sum(axis=1, dtype=np.int64)
+    endgame = ENDGAME_TABLE[codes, _SQUARES].sum(axis=1, dtype=np.int64)
+    phase = np.minimum(PHASE_TABLE[codes].sum(axis=1, dtype=np.int64), MAX_PHASE)
+    scores = ((middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE).astype(np.int32)
+    if whiteToMove is None:
+        return scores
+    return np.where(whiteToMove, scores, -scores)
+
+
+def attackBitboards(boards, color, pieces=None):
+    # (N,) uint64 bitboards of the squares color attacks, pieces being pieceBitboards(boards) if already built
+    if pieces is None:
+        pieces = pieceBitboards(boards)
+    sign = 1 if color == 'w' else -1
+    empty = ~_occupancy(pieces)
+    attacks = np.zeros(len(boards), dtype=np.uint64)
+    for offset, wrap in PAWN_SHIFTS[color][2]:
+        attacks |= _shift(pieces[sign * PAWN], offset, wrap)
+    for offset, wrap in KNIGHT_SHIFTS:
+        attacks |= _shift(pieces[sign * KNIGHT], offset, wrap)
+    for offset, wrap in KING_SHIFTS:
+        attacks |= _shift(pieces[sign * KING], offset, wrap)
+    for shifts, sliders in ((ROOK_SHIFTS, pieces[sign * ROOK] | pieces[sign * QUEEN]),
+                            (BISHOP_SHIFTS, pieces[sign * BISHOP] | pieces[sign * QUEEN])):
+        for offset, wrap in shifts:
+            attacks |= _slide(sliders, empty, offset, wrap)
+    return attacks
+
+
+def attackMasks(boards, color):
+    # (N, 64) bool array of the squares color attacks, laid out like boards
+    return fromBitboards(attackBitboards(boards, color))
+
+
+def moveCounts(boards, whiteToMove):
+    '''
+    Number of pseudo-legal moves of the side to move in every position: moves that may leave the king in check
+    are counted, castling and en passant are not, and a promotion counts once per promotion piece like in
+    getValidMoves. Returns an (N,) int32 array.
+    '''
+    pieces = pieceBitboards(boards)
+    white = _colorMoveCounts(pieces, 'w')
+    black = _colorMoveCounts(pieces, 'b')
+    return np.where(whiteToMove, white, black).astype(np.int32)
+
+
+def _colorMoveCounts(pieces, color):
+    sign = 1 if color == 'w' else -1
+    own = _colorOccupancy(pieces, sign)
+    enemies = _colorOccupancy(pieces, -sign)
+    empty = ~(own | enemies)
+    notOwn = ~own
+    counts = np.zeros(len(own), dtype=np.int64)
+    # a leaper reaches a different square with each offset, so the per-offset counts add up to its moves
+    for code, shifts in ((KNIGHT, KNIGHT_SHIFTS), (KING, KING_SHIFTS)):
+        for offset, wrap in shifts:
+            counts += _popcount(_shift(pieces[sign * code], offset, wrap) & notOwn)
+    # rays in one direction from two sliders never overlap since the nearer one blocks the other,
+    # so the same holds for sliding pieces with one fill per direction
+    for shifts, sliders in ((ROOK_SHIFTS, pieces[sign * ROOK] | pieces[sign * QUEEN]),
+                            (BISHOP_SHIFTS, pieces[sign * BISHOP] | pieces[sign * QUEEN])):
+        for offset, wrap in shifts:
+            counts += _popcount(_slide(sliders, empty, offset, wrap) & notOwn)
+    push, doubleRow, captureShifts, promotionRow = PAWN_SHIFTS[color]
+    pawns = pieces[sign * PAWN]
+    single = _shift(pawns, push, _FULL) & empty
+    double = _shift(single & doubleRow, push, _FULL) & empty
+    targets = [single, double] + [_shift(pawns, offset, wrap) & enemies for offset, wrap in captureShifts]
+    for target in targets:
+        # promotions count four times, once more for the promotion row and three more on top
+        counts += _popcount(target) + 3 * _popcount(target & promotionRow)
+    return counts
+
+
+def _occupancy(pieces):
+    occupied = np.zeros_like(pieces[PAWN])
+    for bitboard in pieces.values():
+        occupied |= bitboard
+    return occupied
+
+
+def _colorOccupancy(pieces, sign):
+    occupied = np.zeros_like(pieces[PAWN])
+    for code in range(PAWN, KING + 1):
+        occupied |= pieces[sign * code]
+    return occupied
+
+
+def _shift(bitboards, offset, wrap):
+    # moves every bit offset squares along, dropping bits that fell off the board or wrapped to the other side
+    if offset > 0:
+        return (bitboards << np.uint64(offset)) & wrap
+    return (bitboards >> np.uint64(-offset)) & wrap
+
+
+def _slide(sliders, empty, offset, wrap):
+    # squares attacked in one direction by the sliders: flood through empty squares, then one more step
+    flood = sliders
+    propagate = empty & wrap
+    step = sliders
+    for _ in range(6):
+        step = _shift(step, offset, propagate)
+        if not step.any():
+            break
+        flood = flood | step
+    return _shift(flood, offset, wrap)
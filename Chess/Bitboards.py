@@ -0,0 +1,176 @@
+"""
+Precomputed bitboard tables used by the bitboard backend.
+A bitboard is a 64-bit integer with one bit per square. Square indexes follow GameState.board,
+so square = row * 8 + col, which puts a8 at bit 0 and h1 at bit 63.
+Everything in here is computed once at import time.
+"""
+FULL_BOARD = (1 << 64) - 1
+SQUARE_BITS = [1 << sq for sq in range(64)]
+SQUARE_COORDS = [(sq // 8, sq % 8) for sq in range(64)]  # square index -> (row, col)
+
+ROW_MASKS = [0xFF << (8 * r) for r in range(8)]
+COL_MASKS = [sum(1 << (8 * r + c) for r in range(8)) for c in range(8)]
+
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+def squareIndex(r, c):
+    return r * 8 + c
+
+
+def iterSquares(bb):
+    # yields the index of every set bit, lowest first
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+
+def _leaperAttacks(offsets):
+    table = []
+    for sq in range(64):
+        r, c = SQUARE_COORDS[sq]
+        bb = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                bb |= 1 << squareIndex(r + dr, c + dc)
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _leaperAttacks(KNIGHT_OFFSETS)
+KING_ATTACKS = _leaperAttacks(KING_OFFSETS)
+# squares attacked by a pawn of the given color standing on a square
+PAWN_ATTACKS = {'w': _leaperAttacks(((-1, -1), (-1, 1))),
+                'b': _leaperAttacks(((1, -1), (1, 1)))}
+
+
+def _ray(sq, d, occupied=0):
+    # walk from sq in direction d, stopping on (and including) the first occupied square
+    r, c = SQUARE_COORDS[sq]
+    bb = 0
+    for i in range(1, 8):
+        endRow = r + d[0] * i
+        endCol = c + d[1] * i
+        if not (0 <= endRow < 8 and 0 <= endCol < 8):
+            break
+        bit = 1 << squareIndex(endRow, endCol)
+        bb |= bit
+        if occupied & bit:
+            break
+    return bb
+
+
+# RAYS[d][sq] is the empty-board ray from sq in direction d, for every king direction
+RAYS = {d: [_ray(sq, d) for sq in range(64)] for d in KING_OFFSETS}
+
+
+def _subsets(mask):
+    # every subset of mask, using the carry-rippler trick
+    sub = 0
+    while True:
+        yield sub
+        sub = (sub - mask) & mask
+        if sub == 0:
+            break
+
+
+def _farSquare(sq, d):
+    # bit of the last on-board square reached from sq in direction d, 0 if there is none
+    r, c = SQUARE_COORDS[sq]
+    if not (0 <= r + d[0] < 8 and 0 <= c + d[1] < 8):
+        return 0
+    while 0 <= r + d[0] < 8 and 0 <= c + d[1] < 8:
+        r += d[0]
+        c += d[1]
+    return 1 << squareIndex(r, c)
+
+
+def _lineTables(lineDirections):
+    '''
+    For every square build the mask of squares whose occupancy matters to a slider moving along
+    one line (a pair of opposite directions), and a dict from each occupancy of that mask to
+    the squares attacked along the line. The last square of each ray is left out of the mask
+    since nothing lies behind it, so no line ever needs more than 64 entries.
+    '''
+    masks = []
+    tables = []
+    for sq in range(64):
+        mask = 0
+        for d in lineDirections:
+            mask |= RAYS[d][sq] & ~_farSquare(sq, d)
+        table = {}
+        for blockers in _subsets(mask):
+            attacks = 0
+            for d in lineDirections:
+                attacks |= _ray(sq, d, blockers)
+            table[blockers] = attacks
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+RANK_MASKS, RANK_ATTACKS = _lineTables(((0, -1), (0, 1)))
+FILE_MASKS, FILE_ATTACKS = _lineTables(((-1, 0), (1, 0)))
+DIAGONAL_MASKS, DIAGONAL_ATTACKS = _lineTables(((-1, -1), (1, 1)))
+ANTI_DIAGONAL_MASKS, ANTI_DIAGONAL_ATTACKS = _lineTables(((-1, 1), (1, -1)))
+
+
+def rookAttacks(sq, occupied):
+    return RANK_ATTACKS[sq][occupied & RANK_MASKS[sq]] | FILE_ATTACKS[sq][occupied & FILE_MASKS[sq]]
+
+
+def bishopAttacks(sq, occupied):
+    return DIAGONAL_ATTACKS[sq][occupied & DIAGONAL_MASKS[sq]] | \
+        ANTI_DIAGONAL_ATTACKS[sq][occupied & ANTI_DIAGONAL_MASKS[sq]]
+
+
+def queenAttacks(sq, occupied):
+    return rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+
+
+# every square a queen on sq could reach on an empty board, i.e. every square aligned with sq
+QUEEN_RAYS = [queenAttacks(sq, 0) for sq in range(64)]
+
+
+def _betweenAndLines():
+    # BETWEEN[a][b]: squares strictly between two aligned squares, 0 if they are not aligned
+    # LINE[a][b]: BETWEEN[a][b] plus b itself, the squares a pinned piece may still move to
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for a in range(64):
+        r, c = SQUARE_COORDS[a]
+        for d in KING_OFFSETS:
+            bb = 0
+            for i in range(1, 8):
+                endRow = r + d[0] * i
+                endCol = c + d[1] * i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8):
+                    break
+                b = squareIndex(endRow, endCol)
+                between[a][b] = bb
+                line[a][b] = bb | (1 << b)
+                bb |= 1 << b
+    return between, line
+
+
+BETWEEN, LINE = _betweenAndLines()
+
+
+def pieceAttacks(piece, sq, occupied):
+    # squares attacked by piece (e.g. 'wN') standing on sq
+    pieceType = piece[1]
+    if pieceType == 'p':
+        return PAWN_ATTACKS[piece[0]][sq]
+    if pieceType == 'N':
+        return KNIGHT_ATTACKS[sq]
+    if pieceType == 'B':
+        return bishopAttacks(sq, occupied)
+    if pieceType == 'R':
+        return rookAttacks(sq, occupied)
+    if pieceType == 'Q':
+        return rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+    return KING_ATTACKS[sq]
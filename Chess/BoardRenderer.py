@@ -0,0 +1,75 @@
+"""
+Draws a board onto a pygame surface, redrawing only the squares that changed since the last frame.
+The empty board, the selected square highlight and the move dot are rendered once into surfaces of their own.
+Each frame every square's look (piece, highlighted, dotted) is compared with what is on screen, and only the
+squares that differ are redrawn. draw() returns their rects for pygame.display.update, so a frame where nothing
+happened costs 64 tuple comparisons. Several renderers can share a window at different origins, e.g. a
+spectator grid of boards.
+"""
+import pygame as p
+
+LIGHT_COLOR = p.Color("#EEEED2")
+DARK_COLOR = p.Color("#769656")
+HIGHLIGHT_COLOR = p.Color('green')
+HIGHLIGHT_ALPHA = 100  # transparency value -> 0 transparent; 255 opaque
+DOT_COLOR = p.Color('darkgrey')
+DOT_RADIUS = 14
+
+
+def destinationIndex(validMoves):
+    # {(startRow, startCol): {(endRow, endCol), ...}} of the valid moves, so a selected square's dots are a lookup
+    index = {}
+    for move in validMoves:
+        index.setdefault((move.startRow, move.startCol), set()).add((move.endRow, move.endCol))
+    return index
+
+
+class BoardRenderer():
+    def __init__(self, surface, images, sqSize, origin=(0, 0)):
+        self.surface = surface
+        self.images = images  # piece name -> image already scaled to sqSize
+        self.sqSize = sqSize
+        self.origin = origin
+        self.rects = [p.Rect(origin[0] + (sq % 8) * sqSize, origin[1] + (sq // 8) * sqSize, sqSize, sqSize)
+                      for sq in range(64)]
+        self.background = p.Surface((8 * sqSize, 8 * sqSize))  # the top left square is always light
+        for sq in range(64):
+            color = (LIGHT_COLOR, DARK_COLOR)[(sq // 8 + sq % 8) % 2]
+            p.draw.rect(self.background, color, p.Rect((sq % 8) * sqSize, (sq // 8) * sqSize, sqSize, sqSize))
+        self.highlight = p.Surface((sqSize, sqSize))
+        self.highlight.set_alpha(HIGHLIGHT_ALPHA)
+        self.highlight.fill(HIGHLIGHT_COLOR)
+        self.dot = p.Surface((sqSize, sqSize), p.SRCALPHA)
+        p.draw.circle(self.dot, DOT_COLOR, (sqSize // 2, sqSize // 2), DOT_RADIUS)
+        self.invalidate()
+
+    def invalidate(self):
+        # forget what is on screen so the next draw repaints every square (after the window was covered or cleared)
+        self.shown = [None] * 64
+
+    def draw(self, board, sqSelected=(), moveIndex=None):
+        '''
+        Brings the screen up to date with board, the selected (row, col) square and the dots of its destinations
+        in moveIndex (see destinationIndex). Returns the rects that were redrawn.
+        '''
+        destinations = moveIndex.get(sqSelected, ()) if moveIndex and sqSelected else ()
+        dirty = []
+        for sq in range(64):
+            square = (sq >> 3, sq & 7)
+            look = (board[square[0]][square[1]], square == sqSelected, square in destinations)
+            if look != self.shown[sq]:
+                self.shown[sq] = look
+                self.drawSquare(sq, look)
+                dirty.append(self.rects[sq])
+        return dirty
+
+    def drawSquare(self, sq, look):
+        piece, highlighted, dotted = look
+        rect = self.rects[sq]
+        self.surface.blit(self.background, rect, rect.move(-self.origin[0], -self.origin[1]))
+        if highlighted:
+            self.surface.blit(self.highlight, rect)
+        if dotted:
+            self.surface.blit(self.dot, rect)
+        if piece != "--":
+            self.surface.blit(self.images[piece], rect)
@@ -3,7 +3,47 @@ This class is responsible for storing all the information about the current stat
 It will also be responsible for determining the valid moves at the current state.
 It will also keep a move log.
 """
+from functools import reduce
+from operator import or_
+from Chess import Evaluation, Zobrist
+from Chess.Bitboards import SQUARE_BITS, SQUARE_COORDS, BETWEEN, LINE, QUEEN_RAYS, iterSquares, pieceAttacks
+
+
+SLIDERS = ('B', 'R', 'Q')
+
+# FEN letter -> board piece and back
+FEN_PIECES = {'P': 'wp', 'N': 'wN', 'B': 'wB', 'R': 'wR', 'Q': 'wQ', 'K': 'wK',
+              'p': 'bp', 'n': 'bN', 'b': 'bB', 'r': 'bR', 'q': 'bQ', 'k': 'bK'}
+PIECE_FEN = {piece: letter for letter, piece in FEN_PIECES.items()}
+
+# move generation stages, see GameState.getValidMovesStaged
+CAPTURES = 1  # captures, en passant and promotions
+QUIETS = 2    # everything else, castling included
+ALL_MOVES = CAPTURES | QUIETS
+
+# MVV-LVA: most valuable victim first, then least valuable attacker
+ORDER_VALUES = {'p': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6}
+
+UNDO_STACK_SIZE = 256  # plies of undo records a GameState starts with, the stack doubles when a game outgrows it
+
+
+def isTactical(move):
+    return move.pieceCaptured != "--" or move.isPawnPromotion
+
+
+def captureOrder(move):
+    # sort key for captures and promotions, higher goes first
+    score = -ORDER_VALUES[move.pieceMoved[1]]
+    if move.pieceCaptured != "--":
+        score += 10 * ORDER_VALUES[move.pieceCaptured[1]]
+    if move.isPawnPromotion:
+        score += 10 * ORDER_VALUES[move.promotionChoice]
+    return score
+
+
 class GameState():
+    debugEvaluation = False  # check the incremental evaluation totals against a full recompute after every move
+
     def __init__(self):
         # Board is an 8x8 2d list, each element has 2 characters.
         # The first character represents the color of the piece, 'b' or 'w'.
@@ -28,9 +68,135 @@ class GameState():
         self.inCheck = False
         self.pin = []
         self.checks = []
+        self.checkmate = False
+        self.stalemate = False
+        self.enpassantPossible = () # coordinates of the square where an en passant capture is possible
+        self.currentCastlingRight = CastleRights(True, True, True, True)
+        self.halfmoveClock = 0 # plies since the last capture or pawn move, for the fifty move rule
+        self.fullmoveNumber = 1 # starts at 1 and goes up after every black move
+        # undoStack[i] holds what move i of moveLog overwrote, the records are reused so makeMove allocates none
+        self.undoStack = [UndoRecord() for _ in range(UNDO_STACK_SIZE)]
+        self.rebuildFromBoard()
+
+    @classmethod
+    def from_fen(cls, fen):
+        '''
+        Sets up a game from a FEN string. The clocks may be left off, as they are in EPD.
+        Raises ValueError if the string isn't a valid FEN.
+        '''
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError(f"FEN needs at least 4 fields: {fen!r}")
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError(f"FEN board needs 8 rows: {fen!r}")
+        board = []
+        for rowText in rows:
+            row = []
+            for ch in rowText:
+                if ch.isdigit():
+                    row.extend(["--"] * int(ch))
+                elif ch in FEN_PIECES:
+                    row.append(FEN_PIECES[ch])
+                else:
+                    raise ValueError(f"bad piece {ch!r} in FEN: {fen!r}")
+            if len(row) != 8:
+                raise ValueError(f"FEN row {rowText!r} isn't 8 squares long: {fen!r}")
+            board.append(row)
+        kings = [(r, c) for r in range(8) for c in range(8) if board[r][c][1] == 'K']
+        if sorted(board[r][c] for r, c in kings) != ['bK', 'wK']:
+            raise ValueError(f"FEN needs exactly one king of each color: {fen!r}")
+        if fields[1] not in ('w', 'b') or fields[2].strip('KQkq') not in ('', '-') or \
+                (fields[3] != '-' and (len(fields[3]) != 2 or fields[3][0] not in Move.filesToCols or
+                                       fields[3][1] not in ('3', '6'))):
+            raise ValueError(f"bad side to move, castling or en passant field in FEN: {fen!r}")
+        try:
+            halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+            fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError(f"bad move clocks in FEN: {fen!r}") from None
+        gs = cls()
+        gs.board = board
+        for r, c in kings:
+            if board[r][c] == 'wK':
+                gs.whiteKingLocation = (r, c)
+            else:
+                gs.blackKingLocation = (r, c)
+        gs.whiteToMove = fields[1] == 'w'
+        castling = fields[2]
+        gs.currentCastlingRight = CastleRights('K' in castling, 'k' in castling, 'Q' in castling, 'q' in castling)
+        if fields[3] != '-':
+            gs.enpassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        gs.halfmoveClock = halfmoveClock
+        gs.fullmoveNumber = fullmoveNumber
+        gs.rebuildFromBoard()
+        return gs
+
+    def to_fen(self):
+        # the current position as a FEN string
+        rows = []
+        for row in self.board:
+            text = ''
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += PIECE_FEN[piece]
+            rows.append(text + (str(empty) if empty else ''))
+        castling = ('K' if self.currentCastlingRight.wks else '') + ('Q' if self.currentCastlingRight.wqs else '') + \
+                   ('k' if self.currentCastlingRight.bks else '') + ('q' if self.currentCastlingRight.bqs else '')
+        if self.enpassantPossible:
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        else:
+            enpassant = '-'
+        return f"{'/'.join(rows)} {'w' if self.whiteToMove else 'b'} {castling or '-'} {enpassant} " \
+               f"{self.halfmoveClock} {self.fullmoveNumber}"
+
+    def rebuildFromBoard(self):
+        '''
+        Recomputes everything that is derived from the board, side to move, castling rights and en passant square.
+        makeMove and undoMove keep all of it up to date, so this is only needed after setting a position up by hand.
+        '''
+        self.zobristKey = Zobrist.computeKey(self) # 64-bit hash of the position, kept up to date by makeMove
+        self.loadAttackMaps()
+        self.loadEvaluation()
+
+    def loadEvaluation(self):
+        # material and piece-square totals for Evaluation.evaluate, kept up to date by makeMove
+        self.middlegameScore, self.endgameScore, self.phase, self.material = Evaluation.boardTotals(self.board)
+
+    def loadAttackMaps(self):
+        # attack maps are bitboards (bit row * 8 + col) of the squares attacked by one piece or one side
+        self.occupied = 0
+        self.sliderSquares = 0 # bishops, rooks and queens, the pieces whose attacks depend on other pieces
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    self.occupied |= SQUARE_BITS[r*8+c]
+                    if piece[1] in SLIDERS:
+                        self.sliderSquares |= SQUARE_BITS[r*8+c]
+        # squares attacked by the piece on each square, one list per side so each side's map is a single reduce
+        self.pieceAttacks = {'w': [0] * 64, 'b': [0] * 64}
+        for sq in iterSquares(self.occupied):
+            piece = self.board[sq >> 3][sq & 7]
+            self.pieceAttacks[piece[0]][sq] = pieceAttacks(piece, sq, self.occupied)
+        self.attackMaps = {} # per side map of attacked squares, filled in by getAttackMap
+        self.pinnedPieces = {} # per side pins, filled in by getPinnedPieces
 
 
     def makeMove(self, move):
+        ply = len(self.moveLog)
+        if ply == len(self.undoStack):
+            self.undoStack.extend(UndoRecord() for _ in range(ply))
+        record = self.undoStack[ply]
+        previousEnpassant = self.enpassantPossible
+        previousCastleIndex = Zobrist.castleIndex(self.currentCastlingRight)
+        record.save(self, previousCastleIndex)
         self.board[move.startRow][move.startCol] = "--"  # leave the start square empty
         self.board[move.endRow][move.endCol] = move.pieceMoved  # move the piece to the end square
         self.moveLog.append(move)  # log the move so we can undo it later
@@ -40,6 +206,57 @@ class GameState():
             self.whiteKingLocation = (move.endRow, move.endCol)
         elif move.pieceMoved == 'bK':
             self.blackKingLocation = (move.endRow, move.endCol)
+        flag = move.moveID >> 12 # 0 for everything but promotions, en passant and castling
+        # pawn promotion
+        if flag >= Move.PROMOTION_FLAG:
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionChoice
+        # en passant, the captured pawn is beside the start square not on the end square
+        elif flag == Move.ENPASSANT_FLAG:
+            self.board[move.startRow][move.endCol] = "--"
+        # a two square pawn advance makes en passant possible on the square it skipped
+        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
+            self.enpassantPossible = ((move.startRow + move.endRow) // 2, move.startCol)
+        else:
+            self.enpassantPossible = ()
+        # castling also moves the rook
+        if flag == Move.CASTLE_FLAG:
+            if move.endCol - move.startCol == 2: # king side
+                self.board[move.endRow][move.endCol-1] = self.board[move.endRow][move.endCol+1]
+                self.board[move.endRow][move.endCol+1] = "--"
+            else: # queen side
+                self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-2]
+                self.board[move.endRow][move.endCol-2] = "--"
+        self.updateAttackMaps(move, flag, record.attackChanges)
+        self.updateEvaluation(move, flag)
+        self.updateCastleRights(move)
+        self.halfmoveClock = 0 if move.pieceMoved[1] == 'p' or move.pieceCaptured != "--" else self.halfmoveClock + 1
+        if self.whiteToMove: # black just moved
+            self.fullmoveNumber += 1
+        self.updateZobristKey(move, previousEnpassant, previousCastleIndex)
+
+    def updateZobristKey(self, move, previousEnpassant, previousCastleIndex):
+        # xor out what the move took away and xor in what it added, the board is already updated
+        pieceKeys = Zobrist.PIECE_KEYS
+        endSq = move.endRow * 8 + move.endCol
+        key = self.zobristKey ^ Zobrist.SIDE_KEY
+        key ^= pieceKeys[move.pieceMoved][move.startRow * 8 + move.startCol]
+        key ^= pieceKeys[self.board[move.endRow][move.endCol]][endSq] # the promoted piece for a promotion
+        flag = move.moveID >> 12
+        if move.pieceCaptured != "--":
+            captureSq = move.startRow * 8 + move.endCol if flag == Move.ENPASSANT_FLAG else endSq
+            key ^= pieceKeys[move.pieceCaptured][captureSq]
+        if flag == Move.CASTLE_FLAG:
+            rookKeys = pieceKeys[move.pieceMoved[0] + 'R']
+            if move.endCol - move.startCol == 2: # king side
+                key ^= rookKeys[endSq + 1] ^ rookKeys[endSq - 1]
+            else: # queen side
+                key ^= rookKeys[endSq - 2] ^ rookKeys[endSq + 1]
+        if previousEnpassant:
+            key ^= Zobrist.ENPASSANT_KEYS[previousEnpassant[1]]
+        if self.enpassantPossible:
+            key ^= Zobrist.ENPASSANT_KEYS[self.enpassantPossible[1]]
+        key ^= Zobrist.CASTLE_KEYS[previousCastleIndex] ^ Zobrist.CASTLE_KEYS[Zobrist.castleIndex(self.currentCastlingRight)]
+        self.zobristKey = key
 
 
     def undoMove(self):
@@ -48,6 +265,222 @@ class GameState():
             self.board[move.startRow][move.startCol] = move.pieceMoved  # put the piece back to its original square
             self.board[move.endRow][move.endCol] = move.pieceCaptured  # put the captured piece back on the board
             self.whiteToMove = not self.whiteToMove  # switch turns back
+            # put the king's location back if it moved
+            if move.pieceMoved == 'wK':
+                self.whiteKingLocation = (move.startRow, move.startCol)
+            elif move.pieceMoved == 'bK':
+                self.blackKingLocation = (move.startRow, move.startCol)
+            flag = move.moveID >> 12
+            if flag == Move.ENPASSANT_FLAG:
+                self.board[move.endRow][move.endCol] = "--"  # the end square was empty
+                self.board[move.startRow][move.endCol] = move.pieceCaptured
+            if not self.whiteToMove: # undoing a black move
+                self.fullmoveNumber -= 1
+            record = self.undoStack[len(self.moveLog)]
+            record.restore(self)
+            self.undoAttackMaps(record.attackChanges)
+            if flag == Move.CASTLE_FLAG:
+                if move.endCol - move.startCol == 2: # king side
+                    self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-1]
+                    self.board[move.endRow][move.endCol-1] = "--"
+                else: # queen side
+                    self.board[move.endRow][move.endCol-2] = self.board[move.endRow][move.endCol+1]
+                    self.board[move.endRow][move.endCol+1] = "--"
+            self.checkmate = False
+            self.stalemate = False
+            if self.debugEvaluation:
+                self.checkEvaluation()
+
+    def updateEvaluation(self, move, flag):
+        '''
+        Moves the evaluation totals along with the move: the piece leaves its start square and lands (promoted)
+        on its end square, and a captured piece or the castling rook is accounted for. The board is already updated.
+        '''
+        middlegameScores = Evaluation.MIDDLEGAME_SCORES
+        endgameScores = Evaluation.ENDGAME_SCORES
+        startSq = move.startRow*8 + move.startCol
+        endSq = move.endRow*8 + move.endCol
+        moved = move.pieceMoved
+        placed = self.board[move.endRow][move.endCol] # the promoted piece for a promotion
+        middlegame = self.middlegameScore - middlegameScores[moved][startSq] + middlegameScores[placed][endSq]
+        endgame = self.endgameScore - endgameScores[moved][startSq] + endgameScores[placed][endSq]
+        if flag == Move.CASTLE_FLAG:
+            rook = moved[0] + 'R'
+            rookStart, rookEnd = (endSq + 1, endSq - 1) if move.endCol - move.startCol == 2 else (endSq - 2, endSq + 1)
+            middlegame += middlegameScores[rook][rookEnd] - middlegameScores[rook][rookStart]
+            endgame += endgameScores[rook][rookEnd] - endgameScores[rook][rookStart]
+        elif move.pieceCaptured != "--" or placed != moved:
+            white, black = self.material
+            if move.pieceCaptured != "--":
+                captured = move.pieceCaptured
+                captureSq = move.startRow*8 + move.endCol if flag == Move.ENPASSANT_FLAG else endSq
+                middlegame -= middlegameScores[captured][captureSq]
+                endgame -= endgameScores[captured][captureSq]
+                self.phase -= Evaluation.PHASE_WEIGHTS[captured[1]]
+                if captured[0] == 'w':
+                    white -= Evaluation.PIECE_VALUES[captured[1]]
+                else:
+                    black -= Evaluation.PIECE_VALUES[captured[1]]
+            if placed != moved: # promotion
+                self.phase += Evaluation.PHASE_WEIGHTS[placed[1]]
+                gain = Evaluation.PIECE_VALUES[placed[1]] - Evaluation.PIECE_VALUES['p']
+                if moved[0] == 'w':
+                    white += gain
+                else:
+                    black += gain
+            self.material = (white, black)
+        self.middlegameScore = middlegame
+        self.endgameScore = endgame
+        if self.debugEvaluation:
+            self.checkEvaluation()
+
+    def checkEvaluation(self):
+        # raises AssertionError if the incremental evaluation totals differ from a full recompute
+        expected = Evaluation.boardTotals(self.board)
+        actual = (self.middlegameScore, self.endgameScore, self.phase, self.material)
+        if actual != expected:
+            raise AssertionError(f"incremental evaluation {actual} != {expected} in {self.to_fen()}, "
+                                 f"moves {[move.getChessNotation() for move in self.moveLog]}")
+
+    def updateAttackMaps(self, move, flag, saved):
+        '''
+        Only the squares the move touched and the sliders looking at one of them can attack differently
+        afterwards, so only those pieces get their attacks recomputed. The board is already updated.
+        The (square, white attacks, black attacks) it overwrites go into saved for undoAttackMaps.
+        '''
+        board = self.board
+        endSq = move.endRow*8 + move.endCol
+        changed = SQUARE_BITS[move.startRow*8 + move.startCol] | SQUARE_BITS[endSq]
+        if flag == Move.ENPASSANT_FLAG:
+            changed |= SQUARE_BITS[move.startRow*8 + move.endCol]
+        elif flag == Move.CASTLE_FLAG:
+            if move.endCol - move.startCol == 2: # king side
+                changed |= SQUARE_BITS[endSq+1] | SQUARE_BITS[endSq-1]
+            else: # queen side
+                changed |= SQUARE_BITS[endSq-2] | SQUARE_BITS[endSq+1]
+        occupied = self.occupied & ~changed
+        sliders = self.sliderSquares & ~changed
+        white = self.pieceAttacks['w']
+        black = self.pieceAttacks['b']
+        affected = changed
+        # sliders looking at one of the changed squares
+        bits = sliders
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            sq = bit.bit_length() - 1
+            if (white[sq] | black[sq]) & changed:
+                affected |= bit
+        # occupancy and sliders on the changed squares
+        bits = changed
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            piece = board[(bit.bit_length() - 1) >> 3][(bit.bit_length() - 1) & 7]
+            if piece != "--":
+                occupied |= bit
+                if piece[1] in SLIDERS:
+                    sliders |= bit
+        saved.clear()
+        bits = affected
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            sq = bit.bit_length() - 1
+            saved.append((sq, white[sq], black[sq]))
+            white[sq] = black[sq] = 0
+            piece = board[sq >> 3][sq & 7]
+            if piece != "--":
+                self.pieceAttacks[piece[0]][sq] = pieceAttacks(piece, sq, occupied)
+        self.occupied = occupied
+        self.sliderSquares = sliders
+        # a position only ever asks for the enemy map and its own pins, so those are worked out when first asked for.
+        # undoMove brings back the previous position's dicts along with whatever they had cached
+        self.attackMaps = {}
+        self.pinnedPieces = {}
+
+    def undoAttackMaps(self, saved):
+        # the maps, occupancy and pins themselves were put back by UndoRecord.restore
+        white = self.pieceAttacks['w']
+        black = self.pieceAttacks['b']
+        for sq, whiteAttacks, blackAttacks in saved:
+            white[sq] = whiteAttacks
+            black[sq] = blackAttacks
+
+    def getAttackMap(self, color):
+        # bitboard of every square attacked by color
+        attackMap = self.attackMaps.get(color)
+        if attackMap is None:
+            attackMap = self.attackMaps[color] = reduce(or_, self.pieceAttacks[color])
+        return attackMap
+
+    def getPinnedPieces(self, color):
+        pins = self.pinnedPieces.get(color)
+        if pins is None:
+            pins = self.pinnedPieces[color] = self.findPins(color)
+        return pins
+
+    def findPins(self, allyColor):
+        '''
+        Returns a dict from each pinned piece of allyColor (as a square index) to the squares it may still move to,
+        the line from its king up to and including the pinning piece.
+        '''
+        kingRow, kingCol = self.whiteKingLocation if allyColor == 'w' else self.blackKingLocation
+        kingSq = kingRow*8 + kingCol
+        pins = {}
+        for sq in iterSquares(self.sliderSquares & QUEEN_RAYS[kingSq]):
+            piece = self.board[sq >> 3][sq & 7]
+            if piece[0] == allyColor:
+                continue
+            line = LINE[kingSq][sq]
+            diagonal = kingRow != sq >> 3 and kingCol != sq & 7
+            if (piece[1] == 'R' and diagonal) or (piece[1] == 'B' and not diagonal):
+                continue
+            blockers = BETWEEN[kingSq][sq] & self.occupied
+            if blockers and not blockers & (blockers - 1):
+                blockerSq = blockers.bit_length() - 1
+                if self.board[blockerSq >> 3][blockerSq & 7][0] == allyColor:
+                    pins[blockerSq] = line
+        return pins
+
+    def updateCastleRights(self, move):
+        # moving the king loses both rights, moving or losing a rook loses that side's right
+        if move.pieceMoved == 'wK':
+            self.currentCastlingRight.wks = False
+            self.currentCastlingRight.wqs = False
+        elif move.pieceMoved == 'bK':
+            self.currentCastlingRight.bks = False
+            self.currentCastlingRight.bqs = False
+        for r, c in ((move.startRow, move.startCol), (move.endRow, move.endCol)):
+            if (r, c) == (7, 0):
+                self.currentCastlingRight.wqs = False
+            elif (r, c) == (7, 7):
+                self.currentCastlingRight.wks = False
+            elif (r, c) == (0, 0):
+                self.currentCastlingRight.bqs = False
+            elif (r, c) == (0, 7):
+                self.currentCastlingRight.bks = False
+
+    def isRepetition(self, times=1):
+        '''
+        True if the current position occurred at least times times before (times=2 is a threefold repetition).
+        Only the positions since the last capture or pawn move can be the same, and only every other one has
+        the same side to move, so at most halfmoveClock / 2 keys are compared.
+        '''
+        undoStack = self.undoStack
+        key = self.zobristKey
+        ply = len(self.moveLog)
+        count = 0
+        for i in range(ply - 4, max(ply - self.halfmoveClock, 0) - 1, -2):
+            if undoStack[i].zobristKey == key:
+                count += 1
+                if count >= times:
+                    return True
+        return False
+
+    def isFiftyMoveDraw(self):
+        # checkmate on the move that reaches it still counts, so check for that first
+        return self.halfmoveClock >= 100
 
     # all moves with checks
     def getValidMoves(self):
@@ -77,18 +510,97 @@ class GameState():
                         validSquares.append(validSquare)
                         if validSquare[0] == checkRow and validSquare[1] == checkCol:
                             break
-                #get rid of any moves that don't block check or move king
-                for i in range(len(moves)-1,-1,-1):
-                    if moves[i].pieceMoved[1] != 'K': #move doesn't move king so it must block or capture
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
+                #keep only moves that block check or move king, in one pass rather than removing from the list
+                #en passant removes a checking pawn without landing on its square
+                moves = [move for move in moves if move.pieceMoved[1] == 'K'
+                         or (move.endRow, move.endCol) in validSquares
+                         or (move.isEnpassantMove and (move.startRow, move.endCol) == (checkRow, checkCol))]
             else: #double check, king has to move
                 self.getKingMoves(kingRow,kingCol,moves)
         else:
             moves = self.getAllPossibleMoves()
+            self.getCastleMoves(kingRow,kingCol,moves)
+        if len(moves) == 0:
+            if self.inCheck:
+                self.checkmate = True
+            else:
+                self.stalemate = True
+        else:
+            self.checkmate = False
+            self.stalemate = False
         return moves
-        
-    
+
+    def countValidMoves(self):
+        # number of valid moves, the bitboard backend counts them without building them
+        return len(self.getValidMoves())
+
+    def getValidMovesStaged(self, hashMove=None, killers=(), history=None, capturesOnly=False):
+        '''
+        Valid moves one at a time for the search, in the order they are most likely to cause a cutoff:
+        the hash move, captures and promotions (most valuable victim, least valuable attacker first),
+        the killer moves, then the remaining quiet moves by their history score ((pieceMoved, endSq) -> score).
+        A stage is only generated once the consumer has used up the one before it, so a cutoff on the
+        hash move or a capture skips generating the quiet moves. With capturesOnly the quiet stages are skipped,
+        unless the side to move is in check and needs every evasion.
+        Unlike getValidMoves, checkmate and stalemate are not set; self.inCheck is set before this returns.
+        '''
+        context = self.beginMoveGeneration()
+        return self.stagedMoves(context, hashMove, killers, history, capturesOnly and not self.inCheck)
+
+    def stagedMoves(self, context, hashMove, killers, history, capturesOnly):
+        # the position may be changed between yields as long as it's restored before the next one is asked for
+        if hashMove is not None:
+            hashMove = self.findStagedMove(hashMove, context)
+            if hashMove is not None and (not capturesOnly or isTactical(hashMove)):
+                yield hashMove
+        captures = self.generateStage(CAPTURES, context)
+        captures.sort(key=captureOrder, reverse=True)
+        for move in captures:
+            if move != hashMove:
+                yield move
+        if capturesOnly:
+            return
+        quiets = self.generateStage(QUIETS, context)
+        played = [hashMove]
+        for killer in killers:
+            if killer is not None and killer not in played:
+                killer = next((move for move in quiets if move == killer), None)
+                if killer is not None:
+                    played.append(killer)
+                    yield killer
+        if history:
+            quiets.sort(key=lambda move: history.get((move.pieceMoved, move.endRow * 8 + move.endCol), 0), reverse=True)
+        for move in quiets:
+            if move not in played:
+                yield move
+
+    def getValidMovesTo(self, row, col):
+        # valid moves ending on (row, col), checkmate and stalemate aren't set
+        return [move for move in self.getValidMoves() if move.endRow == row and move.endCol == col]
+
+    def beginMoveGeneration(self):
+        # the string backend can't generate by stage, so every valid move is generated once up front and split
+        return self.getValidMoves()
+
+    def generateStage(self, stage, moves):
+        if stage == CAPTURES:
+            return [move for move in moves if isTactical(move)]
+        return [move for move in moves if not isTactical(move)]
+
+    def findStagedMove(self, move, moves):
+        # the valid move equal to move (a hash move can come from another position), or None
+        return next((validMove for validMove in moves if validMove == move), None)
+
+    def probeTablebase(self, tablebases):
+        '''
+        (wdl, dtm) of this position from a Tablebase.Tablebases for the side to move, None if it has no table.
+        Positions with more pieces than the largest table are turned away without looking at the board.
+        '''
+        if self.occupied.bit_count() > tablebases.maxPieces:
+            return None
+        return tablebases.probe(self)
+
+
 
     
     '''genrating all possible moves for the current player'''
@@ -105,7 +617,6 @@ class GameState():
     def checkForPinsAndChecks(self):
         pins =[]
         checks =[]
-        inCheck = False
         if self.whiteToMove:
             enemyColor = "b"
             allyColor = "w"
@@ -116,59 +627,37 @@ class GameState():
             allyColor = "b"
             startRow = self.blackKingLocation[0]
             startCol = self.blackKingLocation[1]
-        #check outward from king for pins and checks, keep track of pins
-        directions = ((-1,0),(1,0),(0,-1),(0,1),(1,1),(1,-1),(-1,1),(-1,-1))
-        for j in range(len(directions)):
-            d = directions[j]
-            possiblePin = () #reset possible pins
-            for i in range(1,8):
-                endRow = startRow + d[0]*i
-                endCol = startCol + d[1]*i
-                if 0 <= endRow < 8 and 0 <= endCol < 8: #on board
-                    endPiece = self.board[endRow][endCol]
-                    endPiece = self.board[endRow][endCol]
-                    # empty square -> keep scanning
-                    if endPiece == "--":
-                        continue
-                    if endPiece[0] == allyColor and endPiece[1] != 'K':
-                        if possiblePin == (): #1st allied piece could be pinned
-                            possiblePin = (endRow,endCol,d[0],d[1])
-                        else: #2nd allied piece, no pin or check possible in this direction
-                            break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        #5 possibilities in this conditional
-                        #1.) orthogonally away from king and piece is rook
-                        #2.) diagonally away from king and piece is bishop
-                        #3.) 1 square away diagonally from king and piece is pawn
-                        #4.) any direction and piece is queen
-                        #5.) any direction 1 square away and piece is king (this is to prevent king to king moves)
-                        if (0 <= j <= 3 and type == 'R') or (4 <= j <= 7 and type == 'B') or \
-                           (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <=5))) or  \
-                           (type == 'Q') or (i == 1 and type == 'K'):
-                            if possiblePin == (): #no piece blocking, so check
-                                inCheck = True
-                                checks.append((endRow,endCol,d[0],d[1]))
-                                break
-                            else: #piece blocking so pin
-                                pins.append(possiblePin)
-                                break
-                        else:
-                            break
-                else: #off board
-                    break
-        #check for knight checks
-        knightMoves = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == 'N':
-                    inCheck = True
-                    checks.append((endRow,endCol,m[0],m[1]))
+        kingBit = SQUARE_BITS[startRow*8 + startCol]
+        inCheck = (self.getAttackMap(enemyColor) & kingBit) != 0
+        #pins come from the pin sets makeMove keeps, with the direction from the king towards the pinned piece
+        for sq in self.getPinnedPieces(allyColor):
+            endRow, endCol = SQUARE_COORDS[sq]
+            pins.append((endRow, endCol, (endRow > startRow) - (endRow < startRow), (endCol > startCol) - (endCol < startCol)))
+        #only when in check look for the pieces giving it
+        if inCheck:
+            enemyAttacks = self.pieceAttacks[enemyColor]
+            for sq in iterSquares(self.occupied):
+                if enemyAttacks[sq] & kingBit:
+                    endRow, endCol = SQUARE_COORDS[sq]
+                    if self.board[endRow][endCol][1] == 'N': #knight checks keep the knight offset
+                        checks.append((endRow, endCol, endRow - startRow, endCol - startCol))
+                    else:
+                        checks.append((endRow, endCol, (endRow > startRow) - (endRow < startRow), (endCol > startCol) - (endCol < startCol)))
         return inCheck, pins, checks
 
+    def kingDangerSquares(self, kingRow, kingCol, enemyColor):
+        '''
+        Squares the king at (kingRow, kingCol) must not move to. That is the enemy attack map plus, for sliders
+        giving check, the squares behind the king on their ray, which the map can't see because the king blocks them.
+        '''
+        kingBit = SQUARE_BITS[kingRow*8 + kingCol]
+        danger = self.getAttackMap(enemyColor)
+        if danger & kingBit:
+            enemyAttacks = self.pieceAttacks[enemyColor]
+            for sq in iterSquares(self.sliderSquares):
+                if enemyAttacks[sq] & kingBit:
+                    danger |= pieceAttacks(self.board[sq >> 3][sq & 7], sq, self.occupied ^ kingBit)
+        return danger
 
     def getPawnMoves(self,r,c,moves):
         piecePinned = False
@@ -180,37 +669,57 @@ class GameState():
                 self.pin.remove(self.pin[i])
                 break
         if self.whiteToMove:
-            if self.board[r-1][c] == "--": #1 square move
-                if not piecePinned or pinDirection == (-1,0):
-                    moves.append(Move((r,c),(r-1,c),self.board))
-                    if r == 6 and self.board[r-2][c] == "--": #2 square move
-                        moves.append(Move((r,c),(r-2,c),self.board))
-            # Capture moves
-            if c-1>=0 and r-1 >= 0:
-                # capture to the left
-                dr, dc = -1, -1
-                if self.board[r-1][c-1][0] == 'b':
-                    # allow capture only if not pinned or capture is along pin direction
-                    if not piecePinned or pinDirection == (dr, dc) or pinDirection == (-dr, -dc):
-                        moves.append(Move((r,c),(r-1,c-1),self.board))
-            if c+1<=7 and r-1 >= 0:
-                # capture to the right
-                dr, dc = -1, 1
-                if self.board[r-1][c+1][0] == 'b':
-                    if not piecePinned or pinDirection == (dr, dc) or pinDirection == (-dr, -dc):
-                        moves.append(Move((r,c),(r-1,c+1),self.board))
-        else: #black pawn moves
-            if self.board[r+1][c] == "--": #1 square move
-                moves.append(Move((r,c),(r+1,c),self.board))
-                if r == 1 and self.board[r+2][c] == "--": #2 square move
-                    moves.append(Move((r,c),(r+2,c),self.board))
-            # Capture moves
-            if c-1>=0 and r+1 <= 7:
-                if self.board[r+1][c-1][0] == 'w': #capture white piece to the left
-                    moves.append(Move((r,c),(r+1,c-1),self.board))
-            if c+1<=7 and r+1 <= 7:
-                if self.board[r+1][c+1][0] == 'w': #capture white piece to the right
-                    moves.append(Move((r,c),(r+1,c+1),self.board))
+            moveAmount = -1
+            startRow = 6
+            enemyColor = 'b'
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            moveAmount = 1
+            startRow = 1
+            enemyColor = 'w'
+            kingRow, kingCol = self.blackKingLocation
+        if self.board[r+moveAmount][c] == "--": #1 square move
+            if not piecePinned or pinDirection == (moveAmount,0) or pinDirection == (-moveAmount,0):
+                self.addPawnMove((r,c),(r+moveAmount,c),moves)
+                if r == startRow and self.board[r+2*moveAmount][c] == "--": #2 square move
+                    moves.append(Move((r,c),(r+2*moveAmount,c),self.board))
+        # Capture moves, to the left then to the right
+        for dc in (-1,1):
+            if 0 <= c+dc <= 7:
+                # allow capture only if not pinned or capture is along pin direction
+                if piecePinned and pinDirection != (moveAmount,dc) and pinDirection != (-moveAmount,-dc):
+                    continue
+                if self.board[r+moveAmount][c+dc][0] == enemyColor:
+                    self.addPawnMove((r,c),(r+moveAmount,c+dc),moves)
+                elif (r+moveAmount,c+dc) == self.enpassantPossible:
+                    if not self.enpassantExposesKing(r,c,c+dc,kingRow,kingCol,enemyColor):
+                        moves.append(Move((r,c),(r+moveAmount,c+dc),self.board))
+
+    def addPawnMove(self,startSq,endSq,moves):
+        # a pawn reaching the last row makes one move per piece it can promote to
+        if endSq[0] == 0 or endSq[0] == 7:
+            for choice in Move.promotionChoices:
+                moves.append(Move(startSq,endSq,self.board,promotionChoice=choice))
+        else:
+            moves.append(Move(startSq,endSq,self.board))
+
+    def enpassantExposesKing(self,r,c,captureCol,kingRow,kingCol,enemyColor):
+        '''
+        En passant takes two pawns off the same row at once, which the pin check can't see.
+        If the king is on that row, look along it with both pawns gone for an enemy rook or queen.
+        '''
+        if kingRow != r:
+            return False
+        step = 1 if captureCol > kingCol else -1
+        col = kingCol + step
+        while 0 <= col <= 7:
+            if col != c and col != captureCol:
+                piece = self.board[r][col]
+                if piece != "--":
+                    return piece[0] == enemyColor and piece[1] in ('R','Q')
+            col += step
+        return False
+
  #all possible move of Bishop
     def getBishopMoves(self,r,c,moves):
         piecePinned = False
@@ -249,7 +758,8 @@ class GameState():
             if self.pin[i][0] == r and self.pin[i][1] == c:
                 piecePinned = True
                 pinDirection = (self.pin[i][2],self.pin[i][3])
-                self.pin.remove(self.pin[i])
+                if self.board[r][c][1] != 'Q': #a queen keeps its pin for getBishopMoves
+                    self.pin.remove(self.pin[i])
                 break
         directions = ((-1,0),(0,-1),(1,0),(0,1)) #up , left , down , right
         enemyColor = "b" if self.whiteToMove else "w"
@@ -280,6 +790,7 @@ class GameState():
             directions = ((-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1))
             allyColor = "w" if self.whiteToMove else "b"
             enemyColor = "b" if self.whiteToMove else "w"
+            dangerSquares = self.kingDangerSquares(r, c, enemyColor)
             for i in range(8):
                 endRow = r+directions[i][0]
                 endCol = c+directions[i][1]
@@ -287,53 +798,25 @@ class GameState():
                     endPiece = self.board[endRow][endCol]
                     if endPiece[0] != allyColor:
                         # Check if the square is attacked
-                        if not self.squareUnderAttack(endRow, endCol, enemyColor):
+                        if not dangerSquares & SQUARE_BITS[endRow*8 + endCol]:
                             moves.append(Move((r,c),(endRow,endCol),self.board))
 
-        # Class-level method
+    #castling moves for the king at (r, c), only called when the king is not in check
+    def getCastleMoves(self,r,c,moves):
+        enemyColor = "b" if self.whiteToMove else "w"
+        if (self.whiteToMove and self.currentCastlingRight.wks) or (not self.whiteToMove and self.currentCastlingRight.bks):
+            if self.board[r][c+1] == "--" and self.board[r][c+2] == "--":
+                if not self.squareUnderAttack(r,c+1,enemyColor) and not self.squareUnderAttack(r,c+2,enemyColor):
+                    moves.append(Move((r,c),(r,c+2),self.board))
+        if (self.whiteToMove and self.currentCastlingRight.wqs) or (not self.whiteToMove and self.currentCastlingRight.bqs):
+            if self.board[r][c-1] == "--" and self.board[r][c-2] == "--" and self.board[r][c-3] == "--":
+                if not self.squareUnderAttack(r,c-1,enemyColor) and not self.squareUnderAttack(r,c-2,enemyColor):
+                    moves.append(Move((r,c),(r,c-2),self.board))
+
+    # is the square attacked by any enemy piece, answered from the attack maps
     def squareUnderAttack(self, row, col, enemyColor):
-            # Check if a square is attacked by any enemy piece
-            # This is a simplified version, you may want to optimize
-            directions = ((-1,0),(1,0),(0,-1),(0,1),(1,1),(1,-1),(-1,1),(-1,-1))
-            for d in directions:
-                for i in range(1,8):
-                    endRow = row + d[0]*i
-                    endCol = col + d[1]*i
-                    if 0 <= endRow < 8 and 0 <= endCol < 8:
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece[0] == enemyColor:
-                            type = endPiece[1]
-                            if (0 <= directions.index(d) <= 3 and type == 'R') or \
-                               (4 <= directions.index(d) <= 7 and type == 'B') or \
-                               (type == 'Q'):
-                                return True
-                            break
-                        elif endPiece != "--":
-                            break
-                    else:
-                        break
-            # Check for knight attacks
-            knightMoves = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
-            for m in knightMoves:
-                endRow = row + m[0]
-                endCol = col + m[1]
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == enemyColor and endPiece[1] == 'N':
-                        return True
-            # Check for pawn attacks
-            if enemyColor == 'b':
-                pawnMoves = ((1,-1),(1,1))
-            else:
-                pawnMoves = ((-1,-1),(-1,1))
-            for m in pawnMoves:
-                endRow = row + m[0]
-                endCol = col + m[1]
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == enemyColor and endPiece[1] == 'p':
-                        return True
-            return False
+        return (self.getAttackMap(enemyColor) & SQUARE_BITS[row*8 + col]) != 0
+
 #all possible move of Knight
     def getKnightMoves(self,r,c,moves):  # Fixed typo: maoves -> moves
         # Knights cannot move if pinned
@@ -357,6 +840,11 @@ class GameState():
                     moves.append(Move((r,c),(endRow,endCol),self.board))
 
 class Move():
+    # a move is packed into a 16-bit moveID: start square in bits 0-5, end square in bits 6-11
+    # (square = row * 8 + col) and a flag in bits 12-14, see the *_FLAG constants below.
+    # __slots__ keeps the millions of moves made during a search small and quick to create.
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'moveID')
+
     # maps keys to values
     # key : value
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
@@ -366,26 +854,137 @@ class Move():
                    "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
-        print(self.moveID)
+    promotionChoices = ('Q', 'R', 'B', 'N')
+
+    ENPASSANT_FLAG = 1
+    CASTLE_FLAG = 2
+    PROMOTION_FLAG = 4  # promotions use 4 + the index of the piece in promotionPieces
+    promotionPieces = ('N', 'B', 'R', 'Q')
+
+    def __init__(self, startSq, endSq, board, promotionChoice='Q'):
+        self.startRow = startRow = startSq[0]
+        self.startCol = startCol = startSq[1]
+        self.endRow = endRow = endSq[0]
+        self.endCol = endCol = endSq[1]
+        self.pieceMoved = pieceMoved = board[startRow][startCol]
+        self.pieceCaptured = board[endRow][endCol]
+        moveID = startRow * 8 + startCol | (endRow * 8 + endCol) << 6
+        # en passant, castling and promotion all follow from the board, so a move built from two clicks
+        # gets the same id as the generated one
+        if pieceMoved[1] == 'p':
+            if endRow == 0 or endRow == 7:
+                moveID |= (self.PROMOTION_FLAG + self.promotionPieces.index(promotionChoice)) << 12
+            elif startCol != endCol and self.pieceCaptured == "--":
+                moveID |= self.ENPASSANT_FLAG << 12
+                self.pieceCaptured = 'wp' if pieceMoved == 'bp' else 'bp'
+        elif pieceMoved[1] == 'K' and (endCol - startCol == 2 or startCol - endCol == 2):
+            moveID |= self.CASTLE_FLAG << 12
+        self.moveID = moveID
+
+    @classmethod
+    def fromID(cls, moveID, board):
+        # rebuild a move from its packed id, board must be the position the move is played from
+        startSq = moveID & 63
+        endSq = (moveID >> 6) & 63
+        flag = moveID >> 12
+        promotionChoice = cls.promotionPieces[flag - cls.PROMOTION_FLAG] if flag >= cls.PROMOTION_FLAG else 'Q'
+        return cls((startSq // 8, startSq % 8), (endSq // 8, endSq % 8), board, promotionChoice)
+
+    @property
+    def isPawnPromotion(self):
+        return self.moveID >> 12 >= self.PROMOTION_FLAG
+
+    @property
+    def promotionChoice(self):
+        flag = self.moveID >> 12
+        return self.promotionPieces[flag - self.PROMOTION_FLAG] if flag >= self.PROMOTION_FLAG else None
+
+    @property
+    def isEnpassantMove(self):
+        return self.moveID >> 12 == self.ENPASSANT_FLAG
 
+    @property
+    def isCastleMove(self):
+        return self.moveID >> 12 == self.CASTLE_FLAG
 
     #overriding the equals method
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.moveID == other.moveID
         return False
+
+    def __hash__(self):
+        return self.moveID
+
+    def __repr__(self):
+        return "Move(" + self.getChessNotation() + ")"
+
     def getChessNotation(self):
         # You can make this like real chess notation later
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionChoice.lower()
+        return notation
     
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
-        
\ No newline at end of file
+
+
+class CastleRights():
+    def __init__(self, wks, bks, wqs, bqs):
+        self.wks = wks # white king side
+        self.bks = bks # black king side
+        self.wqs = wqs # white queen side
+        self.bqs = bqs # black queen side
+
+    def copy(self):
+        return CastleRights(self.wks, self.bks, self.wqs, self.bqs)
+
+    def setIndex(self, index):
+        # sets the rights from their Zobrist.castleIndex bits
+        self.wks = bool(index & 1)
+        self.wqs = bool(index & 2)
+        self.bks = bool(index & 4)
+        self.bqs = bool(index & 8)
+
+
+class UndoRecord():
+    '''
+    Everything makeMove overwrites that can't be worked out from the move itself. GameState keeps a stack of
+    these, one per ply, filled in place so making and undoing a move allocates no state of its own.
+    zobristKey is the key of the position before the move, which is what GameState.isRepetition compares.
+    '''
+    __slots__ = ('enpassantPossible', 'castleIndex', 'halfmoveClock', 'zobristKey', 'middlegameScore',
+                 'endgameScore', 'phase', 'material', 'attackMaps', 'occupied', 'sliderSquares', 'pinnedPieces',
+                 'attackChanges')
+
+    def __init__(self):
+        self.attackChanges = [] # (square, white attacks, black attacks) overwritten by GameState.updateAttackMaps
+
+    def save(self, gs, castleIndex):
+        self.enpassantPossible = gs.enpassantPossible
+        self.castleIndex = castleIndex
+        self.halfmoveClock = gs.halfmoveClock
+        self.zobristKey = gs.zobristKey
+        self.middlegameScore = gs.middlegameScore
+        self.endgameScore = gs.endgameScore
+        self.phase = gs.phase
+        self.material = gs.material
+        self.attackMaps = gs.attackMaps
+        self.occupied = gs.occupied
+        self.sliderSquares = gs.sliderSquares
+        self.pinnedPieces = gs.pinnedPieces
+
+    def restore(self, gs):
+        gs.enpassantPossible = self.enpassantPossible
+        gs.currentCastlingRight.setIndex(self.castleIndex)
+        gs.halfmoveClock = self.halfmoveClock
+        gs.zobristKey = self.zobristKey
+        gs.middlegameScore = self.middlegameScore
+        gs.endgameScore = self.endgameScore
+        gs.phase = self.phase
+        gs.material = self.material
+        gs.attackMaps = self.attackMaps
+        gs.occupied = self.occupied
+        gs.sliderSquares = self.sliderSquares
+        gs.pinnedPieces = self.pinnedPieces
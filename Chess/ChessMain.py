@@ -7,12 +7,16 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from Chess import ChessEngine
+from Chess.BoardRenderer import BoardRenderer, destinationIndex
+from Chess.EngineWorker import EngineWorker, VALID_MOVES, ENGINE_MOVE, ENGINE_ERROR
 
 WIDTH = HEIGHT = 512  # 400 is another option
 DIMENSION = 8  # dimensions of a chess board are 8x8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15  # for animations later on
 IMAGES = {}
+ENGINE_EVENT = p.USEREVENT + 1  # the engine worker posts its results as this event
+AI_TIME_LIMIT = 1.0  # seconds the AI thinks per move
 
 ''' 
 Initialize a global dictionary of images. This will be called exactly once in the main.
@@ -32,18 +36,49 @@ def main():
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
     gs = ChessEngine.GameState()
-    validMoves = gs.getValidMoves()#very expensive to call it every time.
+    # valid moves and AI moves are worked out on a background thread so the window never freezes
+    worker = EngineWorker(post=lambda result: p.event.post(p.event.Event(ENGINE_EVENT, result=result)))
+    worker.requestValidMoves(gs)
+    validMoves = []  # filled in when the worker's answer arrives
+    moveIndex = {}  # the valid moves' destinations by start square, for drawing the dots
     moveMade = False  # flag variable for when a move is made
+    aiThinking = False
+    gameOver = False
+    playerOne = True  # True if a human is playing white, False if the AI is
+    playerTwo = True  # the same for black, set one of them to False to play the AI
 
     loadImages()  # only do this once, before the while loop
+    renderer = BoardRenderer(screen, IMAGES, SQ_SIZE)
     running = True
     sqSelected = ()  # no square is selected, keep track of the last click of the user (tuple: (row, col))
     playerClicks = []  # keep track of player clicks (two tuples: [(6,4), (4,4)])
     while running:
+        humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
-            elif e.type == p.MOUSEBUTTONDOWN:
+            elif e.type in (p.VIDEOEXPOSE, p.WINDOWEXPOSED):
+                renderer.invalidate()  # the window was drawn over, repaint all of it
+            elif e.type == ENGINE_EVENT:
+                result = e.result
+                if not worker.isCurrent(result):
+                    continue  # asked for before an undo
+                if result.kind == VALID_MOVES:
+                    validMoves = result.moves
+                    moveIndex = destinationIndex(validMoves)
+                    gameOver = len(validMoves) == 0
+                    if gameOver:
+                        print("Game over!")
+                elif result.kind == ENGINE_MOVE and result.move is not None:
+                    gs.makeMove(result.move)
+                    moveMade = True
+                    aiThinking = False
+                    print(f"AI move: {result.move.getChessNotation()}")
+                elif result.kind == ENGINE_ERROR:
+                    aiThinking = False
+                    gameOver = True  # don't ask again for this position, an undo clears it
+                    print(f"Engine error: {result.error!r}")
+            elif e.type == p.MOUSEBUTTONDOWN and humanTurn and not moveMade:
                 location = p.mouse.get_pos()  # (x,y) location of the mouse
                 col = location[0] // SQ_SIZE
                 row = location[1] // SQ_SIZE
@@ -60,7 +95,8 @@ def main():
                     move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
                     print(f"Attempting move: {move.getChessNotation()}")
                     if move in validMoves:
-                        gs.makeMove(move)
+                        # make the generated move, it knows about castling, en passant and promotion
+                        gs.makeMove(validMoves[validMoves.index(move)])
                         moveMade = True # we have made a move
                         sqSelected = ()  # reset user clicks
                         playerClicks = []
@@ -74,66 +110,38 @@ def main():
             #Key handler        
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:  # undo when 'z' is pressed
+                    worker.cancel()  # whatever the worker was doing is for a position that's gone
+                    aiThinking = False
                     gs.undoMove()
+                    if playerOne != playerTwo and len(gs.moveLog) > 0 and \
+                            gs.whiteToMove != playerOne:
+                        gs.undoMove()  # against the AI take back its reply too, so it's the human's turn again
                     moveMade = True
         # Call drawGameState to render the board and pieces
         if moveMade:
-            validMoves = gs.getValidMoves()#very expensive to call it every time.
+            validMoves = []
+            moveIndex = {}
+            gameOver = False
+            worker.requestValidMoves(gs)
             moveMade = False
-        drawGameState(screen, gs, sqSelected, validMoves)
+            sqSelected = ()
+            playerClicks = []
+        humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
+        if not humanTurn and not aiThinking and not gameOver:
+            worker.requestMove(gs, AI_TIME_LIMIT)
+            aiThinking = True
+        dirty = drawGameState(renderer, gs, sqSelected, moveIndex)
         
         clock.tick(MAX_FPS)
-        p.display.flip()
+        if dirty:
+            p.display.update(dirty)  # only the squares that changed
+    worker.close()
     
 '''
-Responsible for all the graphics within a current game state.
-'''
-def drawGameState(screen, gs, sqSelected, validMoves):
-    drawBoard(screen)  # draw squares on the board
-    highlightSquares(screen, gs, sqSelected, validMoves)  # highlight selected square and valid moves
-    drawPieces(screen, gs.board)  # draw pieces on top of those squares
-
-'''
-Draw the squares on the board. The top left square is always light.
-'''
-def drawBoard(screen):
-    colors = [p.Color("#EEEED2"), p.Color("#769656")]
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[((r + c) % 2)]
-            p.draw.rect(screen, color, p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-'''
-Highlight selected square and show valid moves
-'''
-def highlightSquares(screen, gs, sqSelected, validMoves):
-    if sqSelected != ():
-        r, c = sqSelected
-        # Highlight selected square with green overlay
-        s = p.Surface((SQ_SIZE, SQ_SIZE))
-        s.set_alpha(100)  # transparency value -> 0 transparent; 255 opaque
-        s.fill(p.Color('green'))
-        screen.blit(s, (c*SQ_SIZE, r*SQ_SIZE))
-        
-        # Draw small circles on all valid move positions for the selected piece
-        for move in validMoves:
-            if move.startRow == r and move.startCol == c:
-                # Calculate center of the destination square
-                centerX = move.endCol * SQ_SIZE + SQ_SIZE // 2
-                centerY = move.endRow * SQ_SIZE + SQ_SIZE // 2
-                # Draw a small circle
-                p.draw.circle(screen, p.Color('darkgrey'), (centerX, centerY), 14)
-
-'''
-Draw the pieces on the board using the current GameState.board
+Responsible for all the graphics within a current game state. Returns the rects that changed on screen.
 '''
-
-def drawPieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":  # not an empty square
-                screen.blit(IMAGES[piece], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+def drawGameState(renderer, gs, sqSelected, moveIndex):
+    return renderer.draw(gs.board, sqSelected, moveIndex)  # squares, highlight, move dots and pieces
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
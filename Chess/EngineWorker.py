@@ -0,0 +1,140 @@
+"""
+Runs move generation and engine searches on a background thread, for front ends that must stay responsive.
+Every request is a snapshot of the game (the FEN it started from and the ids of its moves), so the caller keeps
+playing and undoing moves on its own GameState while the worker thinks, and the worker's search still sees
+repetitions of earlier positions. Results are handed to a callback (ChessMain posts them as a pygame event) or
+collected in a queue for poll(). cancel() drops every pending request, stops a running search and makes any
+result still on its way stale, so a front end only has to check isCurrent(result). A request that raises comes
+back as an ENGINE_ERROR result instead of leaving the caller waiting.
+"""
+import queue
+import threading
+from Chess.BitboardEngine import BitboardGameState
+from Chess.ChessEngine import Move
+from Chess.Search import Searcher, MAX_PLY
+
+VALID_MOVES = 'validMoves'
+ENGINE_MOVE = 'engineMove'
+ENGINE_ERROR = 'engineError'
+
+
+class EngineResult():
+    def __init__(self, kind, requestId, generation, fen, moves=None, searchResult=None, error=None):
+        self.kind = kind              # VALID_MOVES, ENGINE_MOVE or ENGINE_ERROR
+        self.requestId = requestId
+        self.generation = generation  # the cancel() count when the request was made
+        self.fen = fen                # the position the result is for
+        self.moves = moves            # VALID_MOVES: every valid move of the position
+        self.searchResult = searchResult  # ENGINE_MOVE: the Search.SearchResult, its bestMove None if there's no move
+        self.error = error            # ENGINE_ERROR: the exception the request raised
+
+    @property
+    def move(self):
+        return self.searchResult.bestMove if self.searchResult is not None else None
+
+
+class EngineWorker():
+    def __init__(self, gameStateClass=BitboardGameState, searcher=None, post=None):
+        '''
+        post is called on the worker thread with every EngineResult that is still current, it must be thread safe
+        (pygame.event.post is). Without it results queue up for poll().
+        '''
+        self.gameStateClass = gameStateClass
+        self.searcher = searcher or Searcher()
+        self.post = post
+        self.results = queue.Queue()
+        self.jobs = queue.Queue()
+        self.generation = 0
+        self.nextRequestId = 0
+        self.lock = threading.Lock()  # requestId and generation are changed by the caller's thread only under it
+        self.thread = threading.Thread(target=self.run, name="EngineWorker", daemon=True)
+        self.thread.start()
+
+    def requestValidMoves(self, gs):
+        # asks for the valid moves of gs, returns the request id
+        return self.submit(VALID_MOVES, gs, None)
+
+    def requestMove(self, gs, timeLimit=1.0, maxDepth=MAX_PLY):
+        # asks the engine for a move in gs, returns the request id
+        return self.submit(ENGINE_MOVE, gs, (timeLimit, maxDepth))
+
+    def submit(self, kind, gs, limits):
+        # the game from its first position, which the worker replays onto a GameState of its own
+        moves = list(gs.moveLog)
+        fen = gs.to_fen()
+        for _ in moves:
+            gs.undoMove()
+        startFen = gs.to_fen()
+        for move in moves:
+            gs.makeMove(move)
+        moveIDs = [move.moveID for move in moves]
+        with self.lock:
+            self.nextRequestId += 1
+            self.jobs.put((kind, self.nextRequestId, self.generation, fen, startFen, moveIDs, limits))
+            return self.nextRequestId
+
+    def cancel(self):
+        # forgets every request made so far, a running search stops at its next node
+        with self.lock:
+            self.generation += 1
+            try:
+                while True:
+                    self.jobs.get_nowait()
+            except queue.Empty:
+                pass
+        self.searcher.stop()
+
+    def isCurrent(self, result):
+        # False for a result of a request made before the last cancel()
+        return result.generation == self.generation
+
+    def poll(self):
+        # the results that arrived since the last poll, oldest first (only without a post callback)
+        results = []
+        try:
+            while True:
+                result = self.results.get_nowait()
+                if self.isCurrent(result):
+                    results.append(result)
+        except queue.Empty:
+            pass
+        return results
+
+    def close(self):
+        self.cancel()
+        self.jobs.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            kind, requestId, generation, fen, startFen, moveIDs, limits = job
+            if generation != self.generation:
+                continue
+            try:
+                result = self.runJob(kind, requestId, generation, fen, startFen, moveIDs, limits)
+            except Exception as e:  # the caller is told rather than left waiting for a result that never comes
+                result = EngineResult(ENGINE_ERROR, requestId, generation, fen, error=e)
+            if generation != self.generation:
+                continue
+            if self.post is not None:
+                self.post(result)
+            else:
+                self.results.put(result)
+
+    def runJob(self, kind, requestId, generation, fen, startFen, moveIDs, limits):
+        gs = self.gameStateClass.from_fen(startFen)
+        for moveID in moveIDs:
+            gs.makeMove(Move.fromID(moveID, gs.board))
+        if kind == VALID_MOVES:
+            return EngineResult(kind, requestId, generation, fen, moves=gs.getValidMoves())
+        timeLimit, maxDepth = limits
+
+        def checkCancelled(_):
+            # a cancel() that came just before the search started was undone by it
+            if generation != self.generation:
+                self.searcher.stop()
+        searchResult = self.searcher.search(gs, maxDepth=maxDepth, timeLimit=timeLimit, infoCallback=checkCancelled)
+        return EngineResult(kind, requestId, generation, fen, searchResult=searchResult)
@@ -0,0 +1,90 @@
+"""
+Extended Position Description (EPD) reading and writing.
+An EPD line is the first four FEN fields followed by operations, each an opcode and its operands ended by ';':
+    r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - bm Qxf7#; id "mate.001";
+Operations come back as a dict from opcode to its list of operands. bm (best moves) and am (avoid moves)
+hold SAN moves, id a name; hmvc and fmvn set the FEN clocks.
+"""
+import shlex
+from Chess import Notation
+from Chess.ChessEngine import GameState
+
+MOVE_OPCODES = ('bm', 'am', 'pm', 'sm')  # operations whose operands are SAN moves
+
+
+def parseEpd(line):
+    '''
+    Splits an EPD line into (fen, operations). The fen has the clocks from hmvc/fmvn, or 0 1.
+    A full six field FEN before the operations is accepted too.
+    Raises ValueError for a malformed line.
+    '''
+    fields = line.strip().split(None, 4)
+    if len(fields) < 4:
+        raise ValueError(f"EPD needs at least 4 fields: {line!r}")
+    rest = fields[4] if len(fields) > 4 else ''
+    clocks = rest.split(None, 2)
+    fenClocks = None
+    if len(clocks) >= 2 and clocks[0].isdigit() and clocks[1].isdigit():
+        fenClocks = clocks[:2]
+        rest = clocks[2] if len(clocks) > 2 else ''
+    operations = {}
+    for operation in _splitOperations(rest):
+        try:
+            tokens = shlex.split(operation)
+        except ValueError as e:
+            raise ValueError(f"bad EPD operation {operation!r}: {e}") from None
+        if tokens:
+            operations[tokens[0]] = tokens[1:]
+    if fenClocks is None:
+        fenClocks = [operations.get('hmvc', ['0'])[0], operations.get('fmvn', ['1'])[0]]
+    return ' '.join(fields[:4] + fenClocks), operations
+
+
+def _splitOperations(text):
+    # splits on the ';' ending each operation, but not on one inside a quoted operand
+    operations = []
+    current = ''
+    quoted = False
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        if ch == ';' and not quoted:
+            operations.append(current.strip())
+            current = ''
+        else:
+            current += ch
+    if current.strip():
+        operations.append(current.strip())
+    return operations
+
+
+def readEpd(path):
+    # yields (lineNumber, line) for every line of an EPD file that isn't blank or a # comment
+    with open(path) as f:
+        for lineNumber, line in enumerate(f, 1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield lineNumber, line
+
+
+def toEpd(gs, operations=None):
+    # gs as an EPD line with the given {opcode: operands} operations, string operands are quoted
+    text = ' '.join(gs.to_fen().split()[:4])
+    for opcode, operands in (operations or {}).items():
+        quotedOperands = [operand if opcode in MOVE_OPCODES or operand.lstrip('-').isdigit() else f'"{operand}"'
+                          for operand in operands]
+        text += ' ' + ' '.join([opcode] + quotedOperands) + ';'
+    return text
+
+
+def loadEpd(line, gameStateClass=GameState):
+    '''
+    Sets up an EPD line as (gs, operations, bestMoves, avoidMoves), the bm and am moves resolved against
+    the position's valid moves. Raises ValueError for a bad line or a bm/am move that isn't valid.
+    '''
+    fen, operations = parseEpd(line)
+    gs = gameStateClass.from_fen(fen)
+    validMoves = gs.getValidMoves()
+    bestMoves = [Notation.parseSan(gs, san, validMoves) for san in operations.get('bm', [])]
+    avoidMoves = [Notation.parseSan(gs, san, validMoves) for san in operations.get('am', [])]
+    return gs, operations, bestMoves, avoidMoves
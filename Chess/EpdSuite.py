@@ -0,0 +1,118 @@
+"""
+Runs an EPD test suite through the search, spread over a pool of worker processes.
+Every position is searched for a fixed time or depth, and the move found is checked against its bm
+(best move) and am (avoid move) operations. The report lists each position's result, time and nodes,
+then the solve rate and the overall nodes per second.
+
+Usage from the Chess folder:
+    python EpdSuite.py suite.epd --time 1
+    python EpdSuite.py suite.epd --depth 4 --workers 8 --backend bitboard --json results.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Chess import Epd, Notation, Search
+from Chess.Perft import BACKENDS, runInfo
+
+_searcher = None  # one per worker process, so its transposition table is allocated once
+
+
+def _initWorker(ttSizeMB):
+    global _searcher
+    _searcher = Search.Searcher(ttSizeMB)
+
+
+def solvePosition(task):
+    '''
+    Searches one EPD line in a worker and returns its result as a dict.
+    A line that can't be read is returned with an 'error' instead of failing the whole run.
+    '''
+    index, lineNumber, line, backend, timeLimit, maxDepth = task
+    result = {'index': index, 'line': lineNumber, 'id': None, 'solved': False, 'error': None}
+    try:
+        gs, operations, bestMoves, avoidMoves = Epd.loadEpd(line, BACKENDS[backend])
+    except ValueError as e:
+        result['error'] = str(e)
+        return result
+    result['id'] = ' '.join(operations.get('id', [])) or None
+    result['fen'] = gs.to_fen()
+    result['bm'] = operations.get('bm', [])
+    result['am'] = operations.get('am', [])
+    if not bestMoves and not avoidMoves:
+        result['error'] = "no bm or am operation"
+        return result
+    _searcher.tt.clear()  # every position is searched from scratch, so results don't depend on the order
+    search = _searcher.search(gs, maxDepth=maxDepth or Search.MAX_PLY, timeLimit=timeLimit)
+    if search.bestMove is None:
+        result['error'] = "no legal moves"
+        return result
+    result.update({'move': Notation.toSan(gs, search.bestMove),
+                   'solved': (not bestMoves or search.bestMove in bestMoves) and search.bestMove not in avoidMoves,
+                   'score': search.score, 'depth': search.depth, 'nodes': search.nodes,
+                   'seconds': round(search.seconds, 4), 'nps': search.nps})
+    return result
+
+
+def runSuite(path, timeLimit=None, maxDepth=None, workers=None, backend='string', ttSizeMB=16):
+    # results of every position in file order, plus a summary dict
+    tasks = [(index, lineNumber, line, backend, timeLimit, maxDepth)
+             for index, (lineNumber, line) in enumerate(Epd.readEpd(path))]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(ttSizeMB,)) as pool:
+        results = list(pool.map(solvePosition, tasks, chunksize=1))
+    wallSeconds = time.perf_counter() - start
+    return results, summarize(results, wallSeconds, workers or os.cpu_count())
+
+
+def summarize(results, wallSeconds, workers):
+    searched = [r for r in results if r['error'] is None]
+    nodes = sum(r['nodes'] for r in searched)
+    searchSeconds = sum(r['seconds'] for r in searched)
+    solved = sum(r['solved'] for r in searched)
+    return {'positions': len(results), 'searched': len(searched), 'errors': len(results) - len(searched),
+            'solved': solved, 'solveRate': solved / len(searched) if searched else 0.0,
+            'nodes': nodes, 'searchSeconds': round(searchSeconds, 3), 'wallSeconds': round(wallSeconds, 3),
+            'nps': int(nodes / searchSeconds) if searchSeconds > 0 else 0,  # per worker
+            'totalNps': int(nodes / wallSeconds) if wallSeconds > 0 else 0,  # all workers together
+            'workers': workers}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an EPD test suite through the search")
+    parser.add_argument('epd', help="EPD file, one position per line")
+    parser.add_argument('--time', type=float, help="seconds per position")
+    parser.add_argument('--depth', type=int, help="depth per position")
+    parser.add_argument('--workers', type=int, help="worker processes (default one per CPU)")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='string')
+    parser.add_argument('--hash', type=int, default=16, help="transposition table MB per worker (default 16)")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args(argv)
+    if args.time is None and args.depth is None:
+        parser.error("give --time and/or --depth")
+
+    results, summary = runSuite(args.epd, args.time, args.depth, args.workers, args.backend, args.hash)
+    for result in results:
+        name = result['id'] or f"line {result['line']}"
+        if result['error'] is not None:
+            print(f"{name:<16} error: {result['error']}")
+            continue
+        expected = ' '.join(['bm'] + result['bm'] if result['bm'] else ['am'] + result['am'])
+        print(f"{name:<16} {'ok  ' if result['solved'] else 'FAIL'} {result['move']:<8} ({expected})  "
+              f"depth {result['depth']:>2}  nodes {result['nodes']:>9}  {result['seconds']:>7.3f}s  {result['nps']:>7} nps")
+    print(f"Solved {summary['solved']}/{summary['searched']} ({100 * summary['solveRate']:.1f}%)"
+          f"{'  errors ' + str(summary['errors']) if summary['errors'] else ''}")
+    print(f"{summary['nodes']} nodes, {summary['nps']} nps per worker, {summary['totalNps']} nps over "
+          f"{summary['workers']} workers, {summary['wallSeconds']:.3f}s wall")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'info': runInfo(args.backend), 'summary': summary, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
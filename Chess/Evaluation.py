@@ -0,0 +1,172 @@
+"""
+Static evaluation of a GameState, in centipawns from the side to move's point of view.
+It is material plus piece-square tables (the "simplified evaluation function" values), tapered between a
+middlegame and an endgame table by the remaining non-pawn material, plus any extra terms in the TERMS registry.
+The tables are written the way GameState.board is laid out, row 0 being black's back rank, from white's side
+of the board. Black pieces read the same tables mirrored vertically.
+GameState keeps the material, phase and both piece-square totals up to date in makeMove/undoMove, so evaluate
+only has to blend them; evaluateFull recomputes everything from the board and is the reference it is checked
+against (GameState.debugEvaluation).
+"""
+PIECE_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+
+PAWN_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [50, 50, 50, 50, 50, 50, 50, 50],
+    [10, 10, 20, 30, 30, 20, 10, 10],
+    [5, 5, 10, 25, 25, 10, 5, 5],
+    [0, 0, 0, 20, 20, 0, 0, 0],
+    [5, -5, -10, 0, 0, -10, -5, 5],
+    [5, 10, 10, -20, -20, 10, 10, 5],
+    [0, 0, 0, 0, 0, 0, 0, 0]]
+
+KNIGHT_TABLE = [
+    [-50, -40, -30, -30, -30, -30, -40, -50],
+    [-40, -20, 0, 0, 0, 0, -20, -40],
+    [-30, 0, 10, 15, 15, 10, 0, -30],
+    [-30, 5, 15, 20, 20, 15, 5, -30],
+    [-30, 0, 15, 20, 20, 15, 0, -30],
+    [-30, 5, 10, 15, 15, 10, 5, -30],
+    [-40, -20, 0, 5, 5, 0, -20, -40],
+    [-50, -40, -30, -30, -30, -30, -40, -50]]
+
+BISHOP_TABLE = [
+    [-20, -10, -10, -10, -10, -10, -10, -20],
+    [-10, 0, 0, 0, 0, 0, 0, -10],
+    [-10, 0, 5, 10, 10, 5, 0, -10],
+    [-10, 5, 5, 10, 10, 5, 5, -10],
+    [-10, 0, 10, 10, 10, 10, 0, -10],
+    [-10, 10, 10, 10, 10, 10, 10, -10],
+    [-10, 5, 0, 0, 0, 0, 5, -10],
+    [-20, -10, -10, -10, -10, -10, -10, -20]]
+
+ROOK_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [5, 10, 10, 10, 10, 10, 10, 5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [0, 0, 0, 5, 5, 0, 0, 0]]
+
+QUEEN_TABLE = [
+    [-20, -10, -10, -5, -5, -10, -10, -20],
+    [-10, 0, 0, 0, 0, 0, 0, -10],
+    [-10, 0, 5, 5, 5, 5, 0, -10],
+    [-5, 0, 5, 5, 5, 5, 0, -5],
+    [0, 0, 5, 5, 5, 5, 0, -5],
+    [-10, 5, 5, 5, 5, 5, 0, -10],
+    [-10, 0, 5, 0, 0, 0, 0, -10],
+    [-20, -10, -10, -5, -5, -10, -10, -20]]
+
+KING_TABLE = [
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-20, -30, -30, -40, -40, -30, -30, -20],
+    [-10, -20, -20, -20, -20, -20, -20, -10],
+    [20, 20, 0, 0, 0, 0, 20, 20],
+    [20, 30, 10, 0, 0, 10, 30, 20]]
+
+PIECE_TABLES = {'p': PAWN_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE, 'R': ROOK_TABLE, 'Q': QUEEN_TABLE,
+                'K': KING_TABLE}
+
+# in the endgame pawns are worth more the further they are and the king belongs in the centre
+PAWN_ENDGAME_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [80, 80, 80, 80, 80, 80, 80, 80],
+    [50, 50, 50, 50, 50, 50, 50, 50],
+    [30, 30, 30, 30, 30, 30, 30, 30],
+    [20, 20, 20, 20, 20, 20, 20, 20],
+    [10, 10, 10, 10, 10, 10, 10, 10],
+    [10, 10, 10, 10, 10, 10, 10, 10],
+    [0, 0, 0, 0, 0, 0, 0, 0]]
+
+KING_ENDGAME_TABLE = [
+    [-50, -40, -30, -20, -20, -30, -40, -50],
+    [-30, -20, -10, 0, 0, -10, -20, -30],
+    [-30, -10, 20, 30, 30, 20, -10, -30],
+    [-30, -10, 30, 40, 40, 30, -10, -30],
+    [-30, -10, 30, 40, 40, 30, -10, -30],
+    [-30, -10, 20, 30, 30, 20, -10, -30],
+    [-30, -30, 0, 0, 0, 0, -30, -30],
+    [-50, -30, -30, -30, -30, -30, -30, -50]]
+
+ENDGAME_TABLES = dict(PIECE_TABLES, p=PAWN_ENDGAME_TABLE, K=KING_ENDGAME_TABLE)
+
+# game phase: 24 with all the minor and major pieces on the board, 0 with only kings and pawns left
+PHASE_WEIGHTS = {'p': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+MAX_PHASE = 24
+
+
+def _squareScores(tables):
+    # value plus table bonus of every piece on every square, seen from white's side
+    scores = {}
+    for pieceType, table in tables.items():
+        scores['w' + pieceType] = [PIECE_VALUES[pieceType] + table[r][c] for r in range(8) for c in range(8)]
+        scores['b' + pieceType] = [-(PIECE_VALUES[pieceType] + table[7 - r][c]) for r in range(8) for c in range(8)]
+    return scores
+
+
+MIDDLEGAME_SCORES = _squareScores(PIECE_TABLES)  # [piece][row * 8 + col]
+ENDGAME_SCORES = _squareScores(ENDGAME_TABLES)
+
+# extra evaluation terms: name -> function(gs) returning centipawns from white's point of view.
+# They run at every evaluation, so they should use what GameState keeps up to date rather than scan the board.
+TERMS = {}
+
+
+def registerTerm(name, term):
+    TERMS[name] = term
+
+
+def unregisterTerm(name):
+    TERMS.pop(name, None)
+
+
+def boardTotals(board):
+    '''
+    (middlegame, endgame, phase, (white material, black material)) of a board from a full scan, what
+    GameState keeps incrementally. Material leaves out the kings.
+    '''
+    middlegame = endgame = phase = white = black = 0
+    for r in range(8):
+        row = board[r]
+        for c in range(8):
+            piece = row[c]
+            if piece != "--":
+                middlegame += MIDDLEGAME_SCORES[piece][r * 8 + c]
+                endgame += ENDGAME_SCORES[piece][r * 8 + c]
+                phase += PHASE_WEIGHTS[piece[1]]
+                if piece[0] == 'w':
+                    white += PIECE_VALUES[piece[1]]
+                else:
+                    black += PIECE_VALUES[piece[1]]
+    return middlegame, endgame, phase, (white, black)
+
+
+def taper(middlegame, endgame, phase):
+    # blend of the two scores by game phase (promotions can push it past MAX_PHASE)
+    phase = min(phase, MAX_PHASE)
+    return (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+
+
+def evaluate(gs):
+    '''
+    O(1) from the totals GameState keeps, plus the registered terms. Positive is good for the side to move.
+    '''
+    score = taper(gs.middlegameScore, gs.endgameScore, gs.phase)
+    for term in TERMS.values():
+        score += term(gs)
+    return score if gs.whiteToMove else -score
+
+
+def evaluateFull(gs):
+    # the same score as evaluate, with the totals recomputed from the board
+    middlegame, endgame, phase, _ = boardTotals(gs.board)
+    score = taper(middlegame, endgame, phase)
+    for term in TERMS.values():
+        score += term(gs)
+    return score if gs.whiteToMove else -score
@@ -0,0 +1,181 @@
+"""
+Optional counters, timers and call tracing for the engine's hot paths.
+Nothing is instrumented until a Profiler is enabled: enable() swaps the listed GameState, BitboardGameState
+and Searcher methods for timing wrappers and disable() puts the originals back, so a disabled profiler costs
+nothing at all. The piece move functions (getPawnMoves and the others) are reached through each GameState's
+moveFunctions dict, which is filled in by __init__, so they are only counted for game states made while
+the profiler is enabled.
+
+Every wrapped function gets a call count, total and slowest time, and the key and FEN of the position of its
+slowest call (as the call left it) so a latency spike can be tied to a position. Searches add their nodes and
+beta cutoffs. snapshot() returns all of it as a dict, toJson() and toPrometheus() format it, and with a trace
+path every call is also written as a Chrome trace event (chrome://tracing, Perfetto or speedscope draw it as a
+flame graph).
+
+    with Instrumentation.Profiler(tracePath="trace.json") as profiler:
+        Search.Searcher().search(gs, maxDepth=4)
+    print(profiler.toPrometheus())
+"""
+import functools
+import json
+import os
+import threading
+import time
+from Chess.BitboardEngine import BitboardGameState
+from Chess.ChessEngine import GameState
+from Chess.Search import Searcher
+
+# the methods wrapped on each class, a method is only wrapped on the class that defines it, and an override's
+# super() call is timed as part of the override rather than counted a second time
+INSTRUMENTED = {
+    GameState: ('getValidMoves', 'checkForPinsAndChecks', 'getPawnMoves', 'getRookMoves', 'getKnightMoves',
+                'getBishopMoves', 'getQueenMoves', 'getKingMoves', 'getCastleMoves', 'squareUnderAttack',
+                'makeMove', 'undoMove'),
+    BitboardGameState: ('getValidMoves', 'beginMoveGeneration', 'generateStage', 'findStagedMove', 'getCastleMoves',
+                        'attacksOf', 'findPins', 'undoMove'),
+    Searcher: ('search',),
+}
+PROMETHEUS_PREFIX = 'chess_engine'
+
+
+class CallStats():
+    __slots__ = ('calls', 'nanoseconds', 'slowest', 'slowestKey', 'slowestFen')
+
+    def __init__(self):
+        self.calls = 0
+        self.nanoseconds = 0
+        self.slowest = 0
+        self.slowestKey = None
+        self.slowestFen = None
+
+
+class Profiler():
+    def __init__(self, tracePath=None):
+        self.tracePath = tracePath
+        self.trace = None
+        self.originals = []  # (class, name, function) of every wrapped method
+        self.lock = threading.Lock()
+        self.stats = {}  # function name -> CallStats, shared with its wrapper
+        self.running = threading.local()  # .calls: (method name, id of the object) -> the wrapper that is timing it
+        self.reset()
+
+    def reset(self):
+        # zeroes every counter, the wrappers of an enabled profiler keep counting into the same CallStats
+        for stats in self.stats.values():
+            stats.__init__()
+        self.searches = 0
+        self.nodes = 0
+        self.cutoffs = 0
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    @property
+    def enabled(self):
+        return bool(self.originals)
+
+    def enable(self):
+        if self.enabled:
+            return
+        if self.tracePath is not None:
+            # a JSON array of Chrome trace events, written as they happen (viewers accept it without its closing ']'
+            # if the process dies before disable())
+            self.trace = open(self.tracePath, 'w')
+            self.trace.write('[')
+            self.traceSeparator = '\n'
+            self.traceStart = time.perf_counter_ns()
+        for cls, names in INSTRUMENTED.items():
+            for name in names:
+                function = cls.__dict__.get(name)
+                if function is not None:
+                    self.originals.append((cls, name, function))
+                    setattr(cls, name, self.wrap(f"{cls.__name__}.{name}", function))
+
+    def disable(self):
+        for cls, name, function in reversed(self.originals):
+            setattr(cls, name, function)
+        self.originals = []
+        if self.trace is not None:
+            self.trace.write('\n]\n')
+            self.trace.close()
+            self.trace = None
+
+    def wrap(self, name, function):
+        stats = self.stats.setdefault(name, CallStats())
+        profiler = self
+        pid = os.getpid()
+        isSearch = name == 'Searcher.search'
+        running = self.running
+
+        @functools.wraps(function)
+        def wrapper(owner, *args, **kwargs):
+            calls = running.__dict__.setdefault('calls', {})
+            key = (function.__name__, id(owner))
+            outer = calls.get(key)
+            if outer is not None and outer != name:
+                return function(owner, *args, **kwargs)  # the super() call of an override that is being timed
+            calls[key] = name
+            start = time.perf_counter_ns()
+            try:
+                return function(owner, *args, **kwargs)
+            finally:
+                if outer is None:
+                    del calls[key]
+                elapsed = time.perf_counter_ns() - start
+                stats.calls += 1
+                stats.nanoseconds += elapsed
+                if elapsed > stats.slowest:
+                    stats.slowest = elapsed
+                    gs = owner if isinstance(owner, GameState) else (args[0] if args else None)
+                    if isinstance(gs, GameState):
+                        stats.slowestKey = gs.zobristKey
+                        stats.slowestFen = gs.to_fen()
+                if isSearch:
+                    profiler.searches += 1
+                    profiler.nodes += owner.nodes
+                    profiler.cutoffs += owner.cutoffs
+                if profiler.trace is not None:
+                    profiler.writeEvent(name, start, elapsed, pid)
+        return wrapper
+
+    def writeEvent(self, name, start, elapsed, pid):
+        event = {'name': name, 'ph': 'X', 'ts': (start - self.traceStart) / 1000, 'dur': elapsed / 1000,
+                 'pid': pid, 'tid': threading.get_ident()}
+        with self.lock:
+            self.trace.write(self.traceSeparator + json.dumps(event))
+            self.traceSeparator = ',\n'
+
+    def snapshot(self):
+        # every counter as a dict that json.dump takes
+        functions = {}
+        for name, stats in sorted(self.stats.items()):
+            if stats.calls:
+                functions[name] = {'calls': stats.calls, 'seconds': stats.nanoseconds / 1e9,
+                                   'meanMicroseconds': stats.nanoseconds / stats.calls / 1000,
+                                   'slowestSeconds': stats.slowest / 1e9,
+                                   'slowestKey': f"{stats.slowestKey:016x}" if stats.slowestKey is not None else None,
+                                   'slowestFen': stats.slowestFen}
+        return {'functions': functions,
+                'search': {'searches': self.searches, 'nodes': self.nodes, 'cutoffs': self.cutoffs}}
+
+    def toJson(self, indent=2):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def toPrometheus(self):
+        # the snapshot in the Prometheus text exposition format
+        snapshot = self.snapshot()
+        lines = []
+        metrics = (('calls_total', 'counter', 'calls'), ('seconds_total', 'counter', 'seconds'),
+                   ('slowest_seconds', 'gauge', 'slowestSeconds'))
+        for metric, kind, field in metrics:
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{metric} {kind}")
+            for name, values in snapshot['functions'].items():
+                lines.append(f'{PROMETHEUS_PREFIX}_{metric}{{function="{name}"}} {values[field]}')
+        for name, value in snapshot['search'].items():
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_search_{name}_total counter")
+            lines.append(f"{PROMETHEUS_PREFIX}_search_{name}_total {value}")
+        return '\n'.join(lines) + '\n'
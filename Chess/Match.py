@@ -0,0 +1,366 @@
+"""
+Headless self-play matches between two engine configurations, spread over a pool of worker processes.
+Every opening of the suite is played twice with the colors swapped. Games end on mate, stalemate, threefold
+repetition, the fifty move rule or insufficient material, or are adjudicated: a win once both engines agree on
+a decisive score for a few moves, a draw once the score has stayed near zero for long enough, and anything a
+tablebase knows. Finished games are appended to a PGN file as they come in, and the first engine's score, Elo
+difference and an SPRT (sequential probability ratio test) of elo0 against elo1 are printed after each game.
+A run stops early once the SPRT accepts either hypothesis. Games don't share anything, so the run scales with the
+number of workers; fixed node limits keep results independent of machine load.
+
+Usage from the Chess folder:
+    python Match.py --engine name=new,nodes=20000 --engine name=old,nodes=10000 --openings openings.epd --games 200
+    python Match.py --engine depth=3 --engine depth=2 --sprt 0 20 --pgn games.pgn --workers 8
+Engine options: name, time (seconds per move), depth, nodes, hash (MB), backend, book (Polyglot file),
+tablebases (directory).
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import sys
+import time
+from multiprocessing import Pool
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Chess import Epd, Notation, Pgn, Search
+from Chess.Perft import BACKENDS
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+ENGINE_DEFAULTS = {'name': None, 'time': None, 'depth': None, 'nodes': None, 'hash': 16, 'backend': 'bitboard',
+                   'book': None, 'tablebases': None}
+ENGINE_TYPES = {'time': float, 'depth': int, 'nodes': int, 'hash': int}
+MAX_PLIES = 400  # a game this long is a draw
+# adjudication: a win once both engines have scored the position past WIN_SCORE for WIN_MOVES moves each,
+# a draw once after DRAW_AFTER plies every score of the last DRAW_MOVES moves each is within DRAW_SCORE of zero
+WIN_SCORE = 1000
+WIN_MOVES = 4
+DRAW_SCORE = 10
+DRAW_MOVES = 8
+DRAW_AFTER = 80
+# SPRT error rates
+ALPHA = 0.05
+BETA = 0.05
+
+
+def parseEngine(text):
+    # "name=new,nodes=20000" as an engine configuration, the missing options at their defaults
+    config = dict(ENGINE_DEFAULTS)
+    for item in filter(None, text.split(',')):
+        key, _, value = item.partition('=')
+        key = key.strip()
+        if key not in config:
+            raise ValueError(f"unknown engine option {key!r}")
+        config[key] = ENGINE_TYPES.get(key, str)(value.strip())
+    if config['backend'] not in BACKENDS:
+        raise ValueError(f"unknown backend {config['backend']!r}")
+    if config['time'] is None and config['depth'] is None and config['nodes'] is None:
+        raise ValueError(f"engine {text!r} needs a time, depth or nodes limit")
+    return config
+
+
+def loadOpenings(path=None, plies=8):
+    '''
+    Start positions as FENs: the lines of an EPD file, or the position after the first plies of every game
+    of a PGN file (games with an illegal move are left out). Without a file only the standard start position
+    is played.
+    '''
+    if path is None:
+        return [START_FEN]
+    if path.lower().endswith('.pgn'):
+        openings = []
+        for _, text in Pgn.readGames(path):
+            try:
+                tags, sanMoves, _ = Pgn.parseGame(text)
+                fen = tags.get('FEN', START_FEN)
+                for gs, _, _ in Pgn.replayGame(tags, sanMoves[:plies], BACKENDS['bitboard']):
+                    fen = gs.to_fen()
+            except ValueError:
+                continue  # a game with an illegal move gives no opening
+            openings.append(fen)
+        return openings
+    return [Epd.parseEpd(line)[0] for _, line in Epd.readEpd(path)]
+
+
+_engines = None  # (config, Searcher) of both engines, made once per worker process
+
+
+def _initWorker(configs):
+    global _engines
+    _engines = []
+    for config in configs:
+        book = tablebases = None
+        if config['book']:
+            from Chess.Polyglot import PolyglotBook
+            book = PolyglotBook(config['book'])
+        if config['tablebases']:
+            from Chess.Tablebase import Tablebases
+            tablebases = Tablebases(config['tablebases'])
+        _engines.append((config, Search.Searcher(config['hash'], book=book, tablebases=tablebases)))
+
+
+def insufficientMaterial(gs):
+    # no side can mate: bare kings, or a lone knight or bishop against a bare king
+    pieces = [piece for row in gs.board for piece in row if piece != "--" and piece[1] != 'K']
+    return len(pieces) == 0 or (len(pieces) == 1 and pieces[0][1] in 'NB')
+
+
+def playGame(task):
+    '''
+    Plays one game in a worker and returns it as a dict: the opening, the engine index playing white,
+    the result ('1-0', '0-1' or '1/2-1/2'), why the game ended and the SAN moves.
+    '''
+    index, fen, firstIsWhite = task
+    engines = _engines if firstIsWhite else _engines[::-1]
+    # each engine plays on a GameState of its own backend, both get every move
+    states = [BACKENDS[config['backend']].from_fen(fen) for config, _ in engines]
+    for _, searcher in engines:
+        searcher.tt.clear()  # a game doesn't depend on the ones the worker played before
+    referee = states[0]
+    moves = []
+    scores = []  # every engine score, from white's point of view
+    tablebases = next((searcher.tablebases for _, searcher in engines if searcher.tablebases is not None), None)
+    result = termination = None
+    while result is None:
+        side = 0 if referee.whiteToMove else 1
+        validMoves = referee.getValidMoves()
+        if not validMoves:
+            result, termination = (('0-1' if side == 0 else '1-0'), "checkmate") if referee.inCheck else \
+                ('1/2-1/2', "stalemate")
+            break
+        if referee.isFiftyMoveDraw():
+            result, termination = '1/2-1/2', "fifty move rule"
+            break
+        if referee.isRepetition(2):
+            result, termination = '1/2-1/2', "threefold repetition"
+            break
+        if insufficientMaterial(referee):
+            result, termination = '1/2-1/2', "insufficient material"
+            break
+        if len(moves) >= MAX_PLIES:
+            result, termination = '1/2-1/2', "move limit"
+            break
+        if tablebases is not None:
+            found = referee.probeTablebase(tablebases)
+            if found is not None:
+                wdl = found[0] if side == 0 else -found[0]
+                result = {1: '1-0', 0: '1/2-1/2', -1: '0-1'}[wdl]
+                termination = "adjudication: tablebase"
+                break
+        config, searcher = engines[side]
+        search = searcher.search(states[side], maxDepth=config['depth'] or Search.MAX_PLY,
+                                 timeLimit=config['time'], nodeLimit=config['nodes'])
+        move = search.bestMove
+        scores.append(search.score if side == 0 else -search.score)
+        moves.append(Notation.toSan(referee, move, validMoves))
+        for gs in states:
+            gs.makeMove(move)
+        result, termination = adjudicate(scores)
+    return {'index': index, 'fen': fen, 'firstIsWhite': firstIsWhite, 'result': result,
+            'termination': termination, 'moves': moves}
+
+
+def adjudicate(scores):
+    # (result, termination) if the scores so far decide the game, else (None, None)
+    recent = scores[-2 * WIN_MOVES:]
+    if len(recent) == 2 * WIN_MOVES:
+        if all(score >= WIN_SCORE for score in recent):
+            return '1-0', "adjudication: win"
+        if all(score <= -WIN_SCORE for score in recent):
+            return '0-1', "adjudication: win"
+    recent = scores[-2 * DRAW_MOVES:]
+    if len(scores) >= DRAW_AFTER and all(abs(score) <= DRAW_SCORE for score in recent):
+        return '1/2-1/2', "adjudication: draw"
+    return None, None
+
+
+def toPgn(game, names, round_):
+    # a finished game as PGN text
+    white, black = names if game['firstIsWhite'] else names[::-1]
+    tags = [('Event', "Self-play match"), ('Site', "?"), ('Date', datetime.date.today().strftime('%Y.%m.%d')),
+            ('Round', str(round_)), ('White', white), ('Black', black), ('Result', game['result'])]
+    if game['fen'] != START_FEN:
+        tags += [('SetUp', '1'), ('FEN', game['fen'])]
+    tags += [('Termination', game['termination']), ('PlyCount', str(len(game['moves'])))]
+    lines = [f'[{name} "{value}"]' for name, value in tags]
+    fenFields = game['fen'].split()
+    moveNumber = int(fenFields[5])
+    whiteToMove = fenFields[1] == 'w'
+    tokens = []
+    for ply, san in enumerate(game['moves']):
+        if whiteToMove:
+            tokens.append(f"{moveNumber}.")
+        elif ply == 0:
+            tokens.append(f"{moveNumber}...")
+        tokens.append(san)
+        if not whiteToMove:
+            moveNumber += 1
+        whiteToMove = not whiteToMove
+    tokens.append(game['result'])
+    movetext = []
+    line = ''
+    for token in tokens:  # lines of at most 80 characters
+        if line and len(line) + 1 + len(token) > 80:
+            movetext.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    movetext.append(line)
+    return '\n'.join(lines) + '\n\n' + '\n'.join(movetext) + '\n\n'
+
+
+class MatchStats():
+    # wins, draws and losses of the first engine, with its Elo difference and the SPRT state
+    def __init__(self, elo0=0.0, elo1=5.0, alpha=ALPHA, beta=BETA):
+        self.wins = self.draws = self.losses = 0
+        self.elo0, self.elo1 = elo0, elo1
+        self.lowerBound = math.log(beta / (1 - alpha))
+        self.upperBound = math.log((1 - beta) / alpha)
+
+    def add(self, game):
+        points = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}[game['result']]
+        points = points if game['firstIsWhite'] else 1.0 - points
+        if points == 1.0:
+            self.wins += 1
+        elif points == 0.0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def score(self):
+        return (self.wins + 0.5 * self.draws) / self.games if self.games else 0.5
+
+    def variance(self):
+        # per game variance of the first engine's points
+        s = self.score()
+        return (self.wins * (1 - s) ** 2 + self.draws * (0.5 - s) ** 2 + self.losses * s ** 2) / self.games \
+            if self.games else 0.0
+
+    def elo(self):
+        '''
+        (Elo difference, half width of its 95% interval). The difference is infinite while one side has every
+        point, and the width is None (unknown) while either end of the interval is.
+        '''
+        s = self.score()
+        margin = 1.96 * math.sqrt(self.variance() / self.games) if self.games else 0.0
+        low, high = scoreToElo(max(s - margin, 0.0)), scoreToElo(min(s + margin, 1.0))
+        return scoreToElo(s), (high - low) / 2 if math.isfinite(low) and math.isfinite(high) else None
+
+    def llr(self):
+        '''
+        Log likelihood ratio of elo1 against elo0, from the normal approximation of the trinomial
+        (win/draw/loss) score distribution. 0 until the games differ in outcome.
+        '''
+        variance = self.variance()
+        if variance == 0:
+            return 0.0
+        s0, s1 = eloToScore(self.elo0), eloToScore(self.elo1)
+        return self.games * (s1 - s0) * (2 * self.score() - s0 - s1) / (2 * variance)
+
+    def sprt(self):
+        # 'H1' (elo1 accepted), 'H0' (elo0 accepted) or None while the test goes on
+        llr = self.llr()
+        if llr >= self.upperBound:
+            return 'H1'
+        if llr <= self.lowerBound:
+            return 'H0'
+        return None
+
+
+def scoreToElo(score):
+    if score <= 0.0:
+        return -math.inf
+    if score >= 1.0:
+        return math.inf
+    return -400 * math.log10(1 / score - 1)
+
+
+def eloToScore(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def formatElo(elo, margin):
+    return f"elo {elo:+.1f} +/- " + (f"{margin:.1f}" if margin is not None else "?")
+
+
+def runMatch(configs, openings, games, workers=None, pgnPath=None, sprt=None, log=print):
+    '''
+    Plays up to games games (each opening with both colors, cycling through the openings) and returns the
+    MatchStats and a list of the finished game dicts. With sprt=(elo0, elo1) the match stops as soon as the
+    test accepts a hypothesis.
+    '''
+    names = [config['name'] or f"engine{i + 1}" for i, config in enumerate(configs)]
+    tasks = [(index, openings[(index // 2) % len(openings)], index % 2 == 0) for index in range(games)]
+    stats = MatchStats(*(sprt or (0.0, 5.0)))
+    finished = []
+    start = time.perf_counter()
+    pgnFile = open(pgnPath, 'a') if pgnPath else None
+    pool = Pool(workers, initializer=_initWorker, initargs=(configs,))
+    try:
+        for game in pool.imap_unordered(playGame, tasks):
+            finished.append(game)
+            stats.add(game)
+            if pgnFile is not None:
+                pgnFile.write(toPgn(game, names, game['index'] + 1))
+                pgnFile.flush()
+            elo, margin = stats.elo()
+            line = f"{stats.games}/{games}  {names[0]} +{stats.wins} ={stats.draws} -{stats.losses}  " \
+                   f"score {100 * stats.score():.1f}%  {formatElo(elo, margin)}"
+            if sprt:
+                line += f"  LLR {stats.llr():.2f} ({stats.lowerBound:.2f}, {stats.upperBound:.2f})"
+            log(f"{line}  {time.perf_counter() - start:.1f}s")
+            if sprt and stats.sprt() is not None:
+                log(f"SPRT accepted {stats.sprt()} (elo0 {stats.elo0}, elo1 {stats.elo1})")
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+        if pgnFile is not None:
+            pgnFile.close()
+    return stats, finished
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play a self-play match between two engine configurations")
+    parser.add_argument('--engine', action='append', required=True,
+                        help="engine options such as name=new,nodes=20000, given twice (the first is being tested)")
+    parser.add_argument('--openings', help="EPD file of start positions, or a PGN file (see --opening-plies)")
+    parser.add_argument('--opening-plies', type=int, default=8, help="plies of each PGN game used as opening")
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--workers', type=int, help="worker processes (default one per CPU)")
+    parser.add_argument('--pgn', help="append the finished games to this PGN file")
+    parser.add_argument('--sprt', type=float, nargs=2, metavar=('ELO0', 'ELO1'),
+                        help="stop once an SPRT of elo0 against elo1 is decided")
+    parser.add_argument('--json', help="write the summary to this file")
+    args = parser.parse_args(argv)
+    if len(args.engine) != 2:
+        parser.error("give --engine twice")
+    try:
+        configs = [parseEngine(text) for text in args.engine]
+    except ValueError as e:
+        parser.error(str(e))
+
+    openings = loadOpenings(args.openings, args.opening_plies)
+    stats, finished = runMatch(configs, openings, args.games, args.workers, args.pgn, args.sprt)
+    elo, margin = stats.elo()
+    terminations = {}
+    for game in finished:
+        terminations[game['termination']] = terminations.get(game['termination'], 0) + 1
+    print(f"Finished {stats.games} games: +{stats.wins} ={stats.draws} -{stats.losses}, "
+          f"{formatElo(elo, margin)}")
+    print(', '.join(f"{reason} {count}" for reason, count in sorted(terminations.items())))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'engines': configs, 'games': stats.games, 'wins': stats.wins, 'draws': stats.draws,
+                       'losses': stats.losses, 'elo': elo if math.isfinite(elo) else None, 'margin': margin,
+                       'llr': stats.llr(), 'sprt': stats.sprt(), 'terminations': terminations},
+                      f, indent=2, allow_nan=False)  # an infinite elo is written as null, JSON has no Infinity
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
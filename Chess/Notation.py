@@ -0,0 +1,89 @@
+"""
+Standard algebraic notation (SAN), the move text used by PGN and EPD files.
+Both directions are worked out against GameState.getValidMoves, so a SAN string always maps to a move that can
+be passed straight to makeMove, and only as much disambiguation as the position needs is written.
+"""
+import re
+from Chess.ChessEngine import Move
+
+SAN_PATTERN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+CASTLE_SAN = {'O-O': 2, 'O-O-O': -2, '0-0': 2, '0-0-0': -2}  # -> column change of the king
+
+
+def toSan(gs, move, validMoves=None):
+    '''
+    SAN for a valid move in gs, check and mate marks included. validMoves (all of them, or at least those
+    going to the move's end square) may be passed in when the caller already has them.
+    gs is left as it was, the check/mate flags included.
+    '''
+    if validMoves is None:
+        validMoves = gs.getValidMovesTo(move.endRow, move.endCol)
+    if move.isCastleMove:
+        san = 'O-O' if move.endCol > move.startCol else 'O-O-O'
+    else:
+        pieceType = move.pieceMoved[1]
+        destination = Move.colsToFiles[move.endCol] + Move.rowsToRanks[move.endRow]
+        capture = 'x' if move.pieceCaptured != "--" else ''
+        if pieceType == 'p':
+            san = (Move.colsToFiles[move.startCol] + capture if capture else '') + destination
+            if move.isPawnPromotion:
+                san += '=' + move.promotionChoice
+        else:
+            # other pieces of the same type that could also go there
+            rivals = [m for m in validMoves if m.pieceMoved == move.pieceMoved and m.endRow == move.endRow and
+                      m.endCol == move.endCol and (m.startRow, m.startCol) != (move.startRow, move.startCol)]
+            disambiguation = ''
+            if rivals:
+                if all(m.startCol != move.startCol for m in rivals):
+                    disambiguation = Move.colsToFiles[move.startCol]
+                elif all(m.startRow != move.startRow for m in rivals):
+                    disambiguation = Move.rowsToRanks[move.startRow]
+                else:
+                    disambiguation = Move.colsToFiles[move.startCol] + Move.rowsToRanks[move.startRow]
+            san = pieceType + disambiguation + capture + destination
+    return san + checkSuffix(gs, move)
+
+
+def checkSuffix(gs, move):
+    # '#' if move mates, '+' if it checks, '' otherwise
+    saved = (gs.inCheck, gs.pin, gs.checks, gs.checkmate, gs.stalemate)
+    gs.makeMove(move)
+    replies = gs.getValidMoves()
+    suffix = ('#' if len(replies) == 0 else '+') if gs.inCheck else ''
+    gs.undoMove()
+    gs.inCheck, gs.pin, gs.checks, gs.checkmate, gs.stalemate = saved
+    return suffix
+
+
+def parseSan(gs, san, validMoves=None):
+    '''
+    The valid move in gs written as san. Check marks and annotations (+, #, !, ?) are ignored, castling may be
+    written with zeros and the '=' of a promotion may be left out.
+    Raises ValueError if san doesn't match exactly one valid move.
+    Without validMoves only the moves to the destination square are generated.
+    '''
+    text = san.rstrip('+#!?')
+    if text in CASTLE_SAN:
+        if validMoves is None:
+            kingRow, kingCol = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+            endCol = kingCol + CASTLE_SAN[text]
+            validMoves = gs.getValidMovesTo(kingRow, endCol) if 0 <= endCol <= 7 else []
+        matches = [m for m in validMoves if m.isCastleMove and m.endCol - m.startCol == CASTLE_SAN[text]]
+    else:
+        match = SAN_PATTERN.match(text)
+        if match is None:
+            raise ValueError(f"not a SAN move: {san!r}")
+        pieceType, fromFile, fromRank, destination, promotion = match.groups()
+        pieceType = pieceType or 'p'
+        endRow = Move.ranksToRows[destination[1]]
+        endCol = Move.filesToCols[destination[0]]
+        if validMoves is None:
+            validMoves = gs.getValidMovesTo(endRow, endCol)
+        matches = [m for m in validMoves
+                   if m.pieceMoved[1] == pieceType and m.endRow == endRow and m.endCol == endCol and
+                   (fromFile is None or m.startCol == Move.filesToCols[fromFile]) and
+                   (fromRank is None or m.startRow == Move.ranksToRows[fromRank]) and
+                   m.promotionChoice == promotion]
+    if len(matches) != 1:
+        raise ValueError(f"{'ambiguous' if matches else 'illegal'} move {san!r} in {gs.to_fen()}")
+    return matches[0]
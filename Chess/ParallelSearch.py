@@ -0,0 +1,178 @@
+"""
+Lazy SMP: one search spread over several processes, since the GIL keeps threads from searching any faster.
+The main searcher runs in the calling process as usual. Once its first iteration is done every helper process
+starts searching its own copy of the position too, half of them a ply deeper than the others so they don't all
+walk the same tree in step. They share nothing but the transposition table, a SharedTranspositionTable every
+process reads and writes without locks, so what one helper finds orders the moves and cuts the trees of the
+others. When the main search ends the helpers are stopped, and the deepest completed iteration of any of them
+is played (the main search's on equal depth).
+The helper processes are started once and kept waiting between searches. ParallelSearcher can stand in for a
+Searcher: it has the same search, stop and setTimeLimit methods and tt, book and tablebases attributes.
+Limits apply to the main search, whose node limit doesn't count the helpers' nodes.
+
+Usage from the Chess folder, to see how the time to reach a depth goes down with the number of processes:
+    python ParallelSearch.py --processes 1 2 4 8 --depth 7 "<fen>"
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Chess import Evaluation
+from Chess.ChessEngine import Move
+from Chess.Perft import BACKENDS
+from Chess.Search import Searcher, SearchResult, MAX_PLY
+from Chess.TranspositionTable import SharedTranspositionTable
+
+
+def _helperMain(ttName, evaluate, tasks, results, stopEvent):
+    '''
+    A helper process: searches every task it is sent until the main search sets stopEvent, and sends back
+    (depth, score, pv move ids, nodes) of its deepest completed iteration. None ends the process.
+    '''
+    tt = SharedTranspositionTable(name=ttName)
+    searcher = Searcher(evaluate=evaluate, tt=tt, stopEvent=stopEvent)
+    tablebasePath = None
+    for task in iter(tasks.get, None):
+        gameStateClass, fen, moveIDs, path, startDepth, maxDepth = task
+        if path != tablebasePath:
+            if searcher.tablebases is not None:
+                searcher.tablebases.close()
+            from Chess.Tablebase import Tablebases  # numpy is only loaded when asked for
+            searcher.tablebases = Tablebases(path) if path is not None else None
+            tablebasePath = path
+        gs = gameStateClass.from_fen(fen)
+        for moveID in moveIDs:  # the moves of the game, so repetitions are seen as in the main search
+            gs.makeMove(Move.fromID(moveID, gs.board))
+        result = searcher.search(gs, maxDepth, startDepth=startDepth)
+        results.put((result.depth, result.score, [move.moveID for move in result.pv], result.nodes))
+    if searcher.tablebases is not None:
+        searcher.tablebases.close()
+    tt.close()
+
+
+class ParallelSearcher():
+    def __init__(self, processes=None, ttSizeMB=16, evaluate=Evaluation.evaluate, book=None, tablebases=None):
+        '''
+        processes counts the calling process, so processes - 1 helpers are started, one per core by default.
+        tablebases are opened again by every helper from their directory.
+        '''
+        processes = processes or os.cpu_count() or 1
+        self.tt = SharedTranspositionTable(ttSizeMB)
+        self.main = Searcher(evaluate=evaluate, book=book, tablebases=tablebases, tt=self.tt)
+        self.stopEvent = multiprocessing.Event()
+        self.results = multiprocessing.Queue()
+        self.helpers = []
+        for _ in range(processes - 1):
+            tasks = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_helperMain, daemon=True,
+                                              args=(self.tt.name, evaluate, tasks, self.results, self.stopEvent))
+            process.start()
+            self.helpers.append((process, tasks))
+
+    @property
+    def processes(self):
+        return len(self.helpers) + 1
+
+    # the main searcher's settings, so ParallelSearcher is used like a Searcher
+    book = property(lambda self: self.main.book, lambda self, book: setattr(self.main, 'book', book))
+    tablebases = property(lambda self: self.main.tablebases,
+                          lambda self, tablebases: setattr(self.main, 'tablebases', tablebases))
+    deadline = property(lambda self: self.main.deadline)
+    nodes = property(lambda self: self.main.nodes)
+
+    def close(self):
+        for _, tasks in self.helpers:
+            tasks.put(None)
+        for process, _ in self.helpers:
+            process.join()
+        self.helpers = []
+        self.tt.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stop(self):
+        # safe to call from another thread, like Searcher.stop
+        self.main.stop()
+        self.stopEvent.set()
+
+    def setTimeLimit(self, timeLimit):
+        self.main.setTimeLimit(timeLimit)
+
+    def search(self, gs, maxDepth=MAX_PLY, timeLimit=None, nodeLimit=None, infoCallback=None):
+        '''
+        Searches gs like Searcher.search, with the helpers joining in after the first iteration.
+        infoCallback only sees the main search's iterations. gs is left exactly as it was passed in.
+        '''
+        # the game from its first position, which is what the helpers rebuild gs from
+        moves = list(gs.moveLog)
+        for _ in moves:
+            gs.undoMove()
+        fen = gs.to_fen()
+        for move in moves:
+            gs.makeMove(move)
+        moveIDs = [move.moveID for move in moves]
+        tablebasePath = getattr(self.main.tablebases, 'directory', None)
+        self.stopEvent.clear()
+        started = []
+
+        def startHelpers(result):  # called after every iteration of the main search
+            if not started:
+                for index, (_, tasks) in enumerate(self.helpers):
+                    startDepth = min(result.depth + 1 + index % 2, maxDepth)
+                    tasks.put((type(gs), fen, moveIDs, tablebasePath, startDepth, maxDepth))
+                started.append(len(self.helpers))
+            if infoCallback is not None:
+                infoCallback(result)
+        result = self.main.search(gs, maxDepth, timeLimit, nodeLimit, infoCallback=startHelpers)
+        self.stopEvent.set()
+        if not started:
+            return result  # a book move, a finished game, or a search stopped before its first iteration
+        nodes = result.nodes
+        best = None
+        for _ in range(started[0]):
+            depth, score, pvIDs, helperNodes = self.results.get()
+            nodes += helperNodes
+            if pvIDs and depth > result.depth and (best is None or depth > best[0]):
+                best = (depth, score, pvIDs)
+        if best is not None:
+            depth, score, pvIDs = best
+            pv = []
+            for moveID in pvIDs:
+                pv.append(Move.fromID(moveID, gs.board))
+                gs.makeMove(pv[-1])
+            for _ in pv:
+                gs.undoMove()
+            result = SearchResult(pv[0], score, pv, depth, nodes, result.seconds)
+        result.nodes = nodes
+        result.seconds = time.perf_counter() - self.main.startTime
+        result.nps = int(result.nodes / result.seconds) if result.seconds > 0 else 0
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="time to depth of the parallel search")
+    parser.add_argument('fen', nargs='?', default="rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--hash', type=int, default=64, help="transposition table size in MB")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='bitboard')
+    args = parser.parse_args(argv)
+    baseline = None
+    for processes in args.processes:
+        with ParallelSearcher(processes, args.hash) as searcher:
+            result = searcher.search(BACKENDS[args.backend].from_fen(args.fen), maxDepth=args.depth)
+        baseline = baseline or result.seconds
+        print(f"{processes:3d} processes: depth {result.depth} in {result.seconds:.2f}s "
+              f"({baseline / result.seconds:.2f}x), {result.nodes} nodes, {result.nps} nps, "
+              f"best {result.bestMove.getChessNotation() if result.bestMove else '-'} score {result.score}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Perft (performance test) for the move generator.
+Perft walks the whole game tree to a fixed depth with getValidMoves/makeMove/undoMove and counts the leaf nodes,
+which for the standard positions below are known exactly, so a wrong count means a move generation bug.
+It also reports nodes per second and can write the results as JSON to compare runs across commits.
+
+Usage from the Chess folder:
+    python Perft.py                          run every reference position
+    python Perft.py --depth 3 --backend bitboard --json results.json
+    python Perft.py --fen "<fen>" --depth 2 --divide
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Chess import ChessEngine
+from Chess.BitboardEngine import BitboardGameState
+
+BACKENDS = {'string': ChessEngine.GameState, 'bitboard': BitboardGameState}
+
+# node counts from https://www.chessprogramming.org/Perft_Results
+REFERENCE_POSITIONS = [
+    {'name': 'start', 'fen': 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+     'nodes': [20, 400, 8902, 197281, 4865609]},
+    {'name': 'kiwipete', 'fen': 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     'nodes': [48, 2039, 97862, 4085603]},
+    {'name': 'position3', 'fen': '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     'nodes': [14, 191, 2812, 43238, 674624]},
+    {'name': 'position4', 'fen': 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     'nodes': [6, 264, 9467, 422333]},
+    {'name': 'position5', 'fen': 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     'nodes': [44, 1486, 62379, 2103487]},
+    {'name': 'position6', 'fen': 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     'nodes': [46, 2079, 89890, 3894594]},
+]
+
+def loadPosition(fen, backend='string'):
+    # a game state of the given backend set up from a FEN string
+    return BACKENDS[backend].from_fen(fen)
+
+
+def perft(gs, depth):
+    # number of leaf nodes of the game tree below gs, the last ply is counted without being played (or built,
+    # on the bitboard backend)
+    if depth <= 1:
+        return gs.countValidMoves() if depth == 1 else 1
+    moves = gs.getValidMoves()
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+def divide(gs, depth):
+    '''
+    Perft split by root move, as a dict from move notation to its node count.
+    Comparing this against another engine is the quickest way to find which move is generated wrong.
+    '''
+    counts = {}
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts[move.getChessNotation()] = perft(gs, depth - 1)
+        gs.undoMove()
+    return counts
+
+
+def runPosition(name, fen, depth, backend='string', expected=None):
+    gs = loadPosition(fen, backend)
+    start = time.perf_counter()
+    nodes = perft(gs, depth)
+    seconds = time.perf_counter() - start
+    return {'name': name, 'fen': fen, 'backend': backend, 'depth': depth, 'nodes': nodes,
+            'expected': expected, 'passed': expected is None or nodes == expected,
+            'seconds': round(seconds, 4), 'nps': int(nodes / seconds) if seconds > 0 else 0}
+
+
+def runSuite(maxDepth, backend='string', positions=REFERENCE_POSITIONS):
+    # every reference position at every known depth up to maxDepth
+    results = []
+    for position in positions:
+        for depth in range(1, min(maxDepth, len(position['nodes'])) + 1):
+            results.append(runPosition(position['name'], position['fen'], depth, backend, position['nodes'][depth - 1]))
+    return results
+
+
+def runInfo(backend):
+    # context stored next to the results so runs from different commits and machines can be told apart
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'backend': backend, 'python': platform.python_version(),
+            'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft move generation test and benchmark")
+    parser.add_argument('--depth', type=int, default=3, help="deepest ply to search (default 3)")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='string')
+    parser.add_argument('--position', help="only run the named reference position")
+    parser.add_argument('--fen', help="run a custom position instead of the reference suite")
+    parser.add_argument('--divide', action='store_true', help="print node counts per root move")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.divide:
+        fen = args.fen or next(p['fen'] for p in REFERENCE_POSITIONS if p['name'] == (args.position or 'start'))
+        counts = divide(loadPosition(fen, args.backend), args.depth)
+        for notation in sorted(counts):
+            print(f"{notation}: {counts[notation]}")
+        print(f"Moves: {len(counts)}  Nodes: {sum(counts.values())}")
+        return 0
+
+    if args.fen:
+        results = [runPosition('custom', args.fen, args.depth, args.backend)]
+    else:
+        positions = [p for p in REFERENCE_POSITIONS if args.position in (None, p['name'])]
+        if not positions:
+            parser.error(f"unknown position {args.position}")
+        results = runSuite(args.depth, args.backend, positions)
+
+    for result in results:
+        status = "" if result['expected'] is None else ("ok" if result['passed'] else f"FAIL (expected {result['expected']})")
+        print(f"{result['name']:<10} depth {result['depth']}  nodes {result['nodes']:>9}  "
+              f"{result['seconds']:>8.3f}s  {result['nps']:>8} nps  {status}")
+    totalNodes = sum(r['nodes'] for r in results)
+    totalSeconds = sum(r['seconds'] for r in results)
+    print(f"Total: {totalNodes} nodes in {totalSeconds:.3f}s ({int(totalNodes / totalSeconds) if totalSeconds else 0} nps)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'info': runInfo(args.backend), 'results': results}, f, indent=2)
+    return 0 if all(r['passed'] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
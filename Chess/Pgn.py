@@ -0,0 +1,236 @@
+"""
+Streaming PGN reader and bulk legality checker.
+The file is memory-mapped and read one game at a time, so memory use doesn't grow with the file. Every game's
+SAN moves are resolved against GameState.getValidMoves and played with makeMove; a game with a move that isn't
+legal comes out as an error naming the ply. Big files are cut into byte ranges that worker processes read
+independently. A game belongs to the range its first tag line starts in, so every game is read exactly once.
+
+Usage from the Chess folder:
+    python Pgn.py games.pgn                        check every game, print the errors and a summary
+    python Pgn.py games.pgn --workers 8 --positions positions.fen
+"""
+import argparse
+import mmap
+import os
+import re
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Chess import Notation
+from Chess.Perft import BACKENDS
+
+SHARD_BYTES = 4 << 20  # the size of the byte ranges handed to workers
+SHARDS_PER_WORKER = 2  # shards queued or in flight per worker, so results can't pile up ahead of the reader
+TAG_PATTERN = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# comments, variation brackets, NAGs, move numbers, results, and everything else is a move
+TOKEN_PATTERN = re.compile(r'\{[^}]*\}|;[^\n]*|%[^\n]*|\(|\)|\$\d+|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s(){};$]+')
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+
+def readGames(path, start=0, end=None):
+    '''
+    Yields (offset, text) for every game whose first tag line starts in the byte range [start, end).
+    A game that starts in the range is read to its end even if that is past end.
+    '''
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        end = size if end is None else min(end, size)
+        gameStart = None
+        for offset, isTag in _lines(mm, start, size):
+            if not isTag:
+                continue
+            if gameStart is not None:
+                yield gameStart, mm[gameStart:offset].decode('utf-8', errors='replace')
+                gameStart = None
+            if offset >= end:
+                return
+            gameStart = offset
+        if gameStart is not None:
+            yield gameStart, mm[gameStart:size].decode('utf-8', errors='replace')
+
+
+def _lines(mm, start, size):
+    '''
+    Yields (offset, startsGame) for the lines from the first line starting at or after start.
+    Only a tag line after something other than a tag line starts a game, blank lines don't count.
+    '''
+    pos = start
+    if pos > 0 and mm[pos - 1:pos] != b'\n':
+        pos = mm.find(b'\n', pos) + 1 or size
+    previousIsTag = _previousLineIsTag(mm, pos)
+    while pos < size:
+        lineEnd = mm.find(b'\n', pos)
+        if lineEnd == -1:
+            lineEnd = size
+        line = mm[pos:lineEnd].strip()
+        if line:
+            isTag = line.startswith(b'[')
+            yield pos, isTag and not previousIsTag
+            previousIsTag = isTag
+        pos = lineEnd + 1
+
+
+def _previousLineIsTag(mm, pos):
+    # whether the last non-blank line before pos is a tag line
+    end = pos
+    while end > 0:
+        lineStart = mm.rfind(b'\n', 0, end - 1) + 1
+        line = mm[lineStart:end].strip()
+        if line:
+            return line.startswith(b'[')
+        end = lineStart
+    return False
+
+
+def parseGame(text):
+    '''
+    Splits a game's text into (tags, sanMoves, result). Comments, NAGs, move numbers and variations are dropped.
+    Raises ValueError if brackets of a variation don't match.
+    '''
+    tags = {}
+    body = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith('[') and not body:
+            match = TAG_PATTERN.match(stripped)
+            if match:
+                tags[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+            continue
+        body.append(line)
+    sanMoves = []
+    result = None
+    depth = 0
+    for token in TOKEN_PATTERN.findall('\n'.join(body)):
+        first = token[0]
+        if first in '{;%$' or token[-1] == '.':
+            continue
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if depth < 0:
+                raise ValueError("unmatched ')' in movetext")
+        elif depth == 0:
+            if token in RESULTS:
+                result = token
+            else:
+                sanMoves.append(token)
+    if depth != 0:
+        raise ValueError("unclosed variation in movetext")
+    return tags, sanMoves, result
+
+
+def replayGame(tags, sanMoves, gameStateClass):
+    '''
+    Plays the moves from the game's start position (its FEN tag, or the standard one), yielding
+    (gs, move, san) after every move. Raises ValueError naming the ply of the first move that isn't legal.
+    '''
+    gs = gameStateClass.from_fen(tags['FEN']) if 'FEN' in tags else gameStateClass()
+    for ply, san in enumerate(sanMoves, 1):
+        try:
+            move = Notation.parseSan(gs, san)
+        except ValueError as e:
+            raise ValueError(f"ply {ply}: {e}") from None
+        gs.makeMove(move)
+        yield gs, move, san
+
+
+def checkGames(path, start=0, end=None, positions=False, backend='bitboard'):
+    '''
+    Replays every game in the byte range and yields one dict per game: its offset, tags, number of plies,
+    result and an error message or None. With positions the FEN after every move is included too.
+    '''
+    gameStateClass = BACKENDS[backend]
+    for offset, text in readGames(path, start, end):
+        record = {'offset': offset, 'tags': {}, 'plies': 0, 'result': None, 'error': None}
+        if positions:
+            record['fens'] = []
+        try:
+            tags, sanMoves, result = parseGame(text)
+            record['tags'] = tags
+            record['result'] = result
+            for gs, move, san in replayGame(tags, sanMoves, gameStateClass):
+                record['plies'] += 1
+                if positions:
+                    record['fens'].append(gs.to_fen())
+        except ValueError as e:
+            record['error'] = str(e)
+        yield record
+
+
+def shards(path, shardBytes=SHARD_BYTES):
+    # (start, end) byte ranges covering the file
+    size = os.path.getsize(path)
+    return [(start, min(start + shardBytes, size)) for start in range(0, size, shardBytes)] or [(0, 0)]
+
+
+def _checkShard(task):
+    path, start, end, positions, backend = task
+    return list(checkGames(path, start, end, positions, backend))
+
+
+def checkFile(path, workers=None, positions=False, backend='bitboard', shardBytes=SHARD_BYTES):
+    '''
+    checkGames over the whole file with the shards spread over a pool of worker processes.
+    Games are yielded in file order. A new shard is only handed out when the oldest one has been yielded,
+    so at most SHARDS_PER_WORKER shards per worker are held in memory however slowly the caller reads.
+    '''
+    tasks = [(path, start, end, positions, backend) for start, end in shards(path, shardBytes)]
+    if workers == 1:
+        for task in tasks:
+            yield from checkGames(*task)
+        return
+    workers = workers or os.cpu_count() or 1
+    with Pool(workers) as pool:
+        pending = deque()
+        tasks = iter(tasks)
+        for task in tasks:
+            pending.append(pool.apply_async(_checkShard, (task,)))
+            if len(pending) >= workers * SHARDS_PER_WORKER:
+                break
+        while pending:
+            records = pending.popleft().get()
+            task = next(tasks, None)
+            if task is not None:
+                pending.append(pool.apply_async(_checkShard, (task,)))
+            yield from records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay every game of a PGN file and report the illegal ones")
+    parser.add_argument('pgn', help="PGN file")
+    parser.add_argument('--workers', type=int, help="worker processes (default one per CPU, 1 for no pool)")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='bitboard')
+    parser.add_argument('--positions', help="write the FEN after every move of the legal games to this file")
+    parser.add_argument('--quiet', action='store_true', help="only print the summary")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    games = errors = plies = 0
+    positionsFile = open(args.positions, 'w') if args.positions else None
+    try:
+        for record in checkFile(args.pgn, args.workers, positionsFile is not None, args.backend):
+            games += 1
+            plies += record['plies']
+            if record['error'] is not None:
+                errors += 1
+                if not args.quiet:
+                    names = f"{record['tags'].get('White', '?')} - {record['tags'].get('Black', '?')}"
+                    print(f"offset {record['offset']} ({names}): {record['error']}")
+            elif positionsFile is not None:
+                positionsFile.writelines(fen + '\n' for fen in record['fens'])
+    finally:
+        if positionsFile is not None:
+            positionsFile.close()
+    seconds = time.perf_counter() - start
+    print(f"{games} games, {errors} with errors, {plies} plies in {seconds:.3f}s "
+          f"({int(games / seconds) if seconds > 0 else 0} games/s, {int(plies / seconds) if seconds > 0 else 0} plies/s)")
+    return 0 if errors == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
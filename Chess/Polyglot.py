@@ -0,0 +1,222 @@
+"""
+Polyglot (.bin) opening books.
+A book is a file of 16 byte big-endian entries (key, move, weight, learn) sorted by key, the key being the
+Polyglot hash of the position. PolyglotBook memory-maps the file and binary searches it, so opening a book of
+any size takes no time and processes using the same book share its pages through the OS page cache.
+buildBook makes a book from PGN files, weighting each move by the points its side scored with it.
+
+Usage from the Chess folder:
+    python Polyglot.py build games.pgn --output book.bin --max-ply 20
+    python Polyglot.py probe book.bin --fen "<fen>"
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+from multiprocessing import Pool
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Chess import Notation, Pgn
+from Chess.ChessEngine import GameState
+from Chess.PolyglotRandom import RANDOM64
+
+ENTRY = struct.Struct('>QHHI')  # key, move, weight, learn
+KEY = struct.Struct('>Q')
+PIECE_KINDS = {'bp': 0, 'wp': 1, 'bN': 2, 'wN': 3, 'bB': 4, 'wB': 5,
+               'bR': 6, 'wR': 7, 'bQ': 8, 'wQ': 9, 'bK': 10, 'wK': 11}
+CASTLE_OFFSET = 768
+ENPASSANT_OFFSET = 772
+TURN_OFFSET = 780
+PROMOTION_PIECES = (None, 'N', 'B', 'R', 'Q')  # promotion field of a book move
+RESULT_POINTS = {'1-0': (2, 0), '0-1': (0, 2), '1/2-1/2': (1, 1)}  # (white, black) weight for a game's moves
+
+
+def polyglotKey(gs):
+    '''
+    The Polyglot hash of gs. It differs from GameState.zobristKey (other random numbers, and the en passant
+    file only counts when a pawn can actually take en passant), so it's computed from scratch.
+    '''
+    key = 0
+    for r in range(8):
+        row = gs.board[r]
+        for c in range(8):
+            if row[c] != "--":
+                key ^= RANDOM64[64 * PIECE_KINDS[row[c]] + 8 * (7 - r) + c]
+    rights = gs.currentCastlingRight
+    for offset, right in enumerate((rights.wks, rights.wqs, rights.bks, rights.bqs)):
+        if right:
+            key ^= RANDOM64[CASTLE_OFFSET + offset]
+    if gs.enpassantPossible:
+        epRow, epCol = gs.enpassantPossible
+        pawnRow = epRow + 1 if gs.whiteToMove else epRow - 1
+        pawn = 'wp' if gs.whiteToMove else 'bp'
+        if any(0 <= c < 8 and gs.board[pawnRow][c] == pawn for c in (epCol - 1, epCol + 1)):
+            key ^= RANDOM64[ENPASSANT_OFFSET + epCol]
+    if gs.whiteToMove:
+        key ^= RANDOM64[TURN_OFFSET]
+    return key
+
+
+def encodeMove(move):
+    # a Move as a book move: to file, to rank, from file, from rank and promotion piece, 3 bits each
+    endCol = move.endCol
+    if move.isCastleMove:  # written as the king taking its own rook
+        endCol = 7 if move.endCol == 6 else 0
+    promotion = PROMOTION_PIECES.index(move.promotionChoice) if move.isPawnPromotion else 0
+    return endCol | (7 - move.endRow) << 3 | move.startCol << 6 | (7 - move.startRow) << 9 | promotion << 12
+
+
+class PolyglotBook():
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        # an empty file can't be mapped, it's just a book without entries
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.count = size // ENTRY.size
+
+    def close(self):
+        if self.data:
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def entries(self, key):
+        # (move, weight, learn) of every entry for key, in file order
+        low, high = 0, self.count
+        while low < high:  # first entry with a key >= key
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        for index in range(low, self.count):
+            entryKey, move, weight, learn = ENTRY.unpack_from(self.data, index * ENTRY.size)
+            if entryKey != key:
+                break
+            found.append((move, weight, learn))
+        return found
+
+    def getMoves(self, gs):
+        '''
+        The book moves for gs as (move, weight) pairs, heaviest first. Entries that aren't a valid move
+        in gs (a key collision or a broken book) are left out.
+        '''
+        found = self.entries(polyglotKey(gs))
+        if not found:
+            return []
+        validMoves = {encodeMove(move): move for move in gs.getValidMoves()}
+        moves = [(validMoves[raw], weight) for raw, weight, _ in found if raw in validMoves]
+        moves.sort(key=lambda entry: entry[1], reverse=True)
+        return moves
+
+    def chooseMove(self, gs, weighted=True, rng=random):
+        '''
+        A book move for gs or None. weighted picks at random in proportion to the weights,
+        otherwise the heaviest move is played. Moves with weight 0 are never played.
+        '''
+        moves = [(move, weight) for move, weight in self.getMoves(gs) if weight > 0]
+        if not moves:
+            return None
+        if not weighted:
+            return moves[0][0]
+        return rng.choices([move for move, _ in moves], weights=[weight for _, weight in moves])[0]
+
+
+def countMoves(path, start=0, end=None, maxPly=20, gameStateClass=GameState):
+    '''
+    Book statistics of the games in a byte range of a PGN file: {(key, bookMove): [points, games]} over the
+    first maxPly plies of every finished game, plus the number of games used and skipped.
+    A game with an illegal move is skipped from that move on.
+    '''
+    counts = {}
+    used = skipped = 0
+    for offset, text in Pgn.readGames(path, start, end):
+        try:
+            tags, sanMoves, result = Pgn.parseGame(text)
+            if result not in RESULT_POINTS:
+                skipped += 1
+                continue
+            gs = gameStateClass.from_fen(tags['FEN']) if 'FEN' in tags else gameStateClass()
+            used += 1
+            for san in sanMoves[:maxPly]:
+                move = Notation.parseSan(gs, san)
+                entry = counts.setdefault((polyglotKey(gs), encodeMove(move)), [0, 0])
+                entry[0] += RESULT_POINTS[result][0 if gs.whiteToMove else 1]
+                entry[1] += 1
+                gs.makeMove(move)
+        except ValueError:
+            skipped += 1
+    return counts, used, skipped
+
+
+def _countShard(task):
+    return countMoves(*task)
+
+
+def buildBook(pgnPaths, outputPath, maxPly=20, minGames=1, workers=None):
+    '''
+    Writes a book of every move played at least minGames times in the first maxPly plies of the games.
+    Weights are the points scored with the move (2 a win, 1 a draw), scaled down to fit 16 bits.
+    The PGN files are counted in shards over a pool of worker processes. Returns (entries, games, skipped).
+    '''
+    tasks = [(path, start, end, maxPly) for path in pgnPaths for start, end in Pgn.shards(path)]
+    counts = {}
+    games = skipped = 0
+    with Pool(workers) as pool:
+        for shardCounts, used, shardSkipped in pool.imap_unordered(_countShard, tasks):
+            games += used
+            skipped += shardSkipped
+            for bookKey, (points, played) in shardCounts.items():
+                entry = counts.setdefault(bookKey, [0, 0])
+                entry[0] += points
+                entry[1] += played
+    entries = [(key, move, points) for (key, move), (points, played) in counts.items()
+               if played >= minGames and points > 0]
+    scale = max([points for _, _, points in entries], default=0) / 0xFFFF
+    # sorted by key, heaviest move first within a key
+    entries.sort(key=lambda entry: (entry[0], -entry[2]))
+    with open(outputPath, 'wb') as f:
+        for key, move, points in entries:
+            weight = max(1, int(points / scale)) if scale > 1 else points
+            f.write(ENTRY.pack(key, move, weight, 0))
+    return len(entries), games, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or look into Polyglot opening books")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="build a book from PGN files")
+    build.add_argument('pgn', nargs='+')
+    build.add_argument('--output', '-o', required=True)
+    build.add_argument('--max-ply', type=int, default=20, help="only the first plies of each game (default 20)")
+    build.add_argument('--min-games', type=int, default=1, help="leave out moves played fewer times than this")
+    build.add_argument('--workers', type=int, help="worker processes (default one per CPU)")
+    probe = commands.add_parser('probe', help="list the book moves of a position")
+    probe.add_argument('book')
+    probe.add_argument('--fen', help="position to look up (default the start position)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        entries, games, skipped = buildBook(args.pgn, args.output, args.max_ply, args.min_games, args.workers)
+        print(f"{entries} entries from {games} games ({skipped} skipped) written to {args.output}")
+        return 0
+    gs = GameState.from_fen(args.fen) if args.fen else GameState()
+    with PolyglotBook(args.book) as book:
+        moves = book.getMoves(gs)
+        total = sum(weight for _, weight in moves)
+        print(f"key {polyglotKey(gs):016x}, {len(moves)} book moves")
+        for move, weight in moves:
+            print(f"{Notation.toSan(gs, move):<8} {weight:>6}  {100 * weight / total if total else 0:5.1f}%")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
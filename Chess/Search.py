@@ -0,0 +1,302 @@
+"""
+Picks a move for a GameState.
+Negamax alpha-beta with quiescence search, iterative deepening and aspiration windows, backed by the
+transposition table. Moves come from GameState.getValidMovesStaged: hash move first, then captures by MVV-LVA,
+then killer moves, then quiet moves by their history score, so a node that cuts off early never generates
+its quiet moves. With tablebases, positions they cover are scored from the table instead of being searched.
+A position repeated since the last capture or pawn move, or one past the fifty move rule, scores as a draw.
+The search runs under a hard wall clock and/or node budget. When the budget runs out the current iteration
+is abandoned and the result of the last completed one is returned, so a search never runs past its limit.
+"""
+import time
+from Chess import Evaluation
+from Chess.TranspositionTable import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+
+MATE_SCORE = 100000
+MATE_THRESHOLD = MATE_SCORE - 1000  # any score past this is a forced mate
+INFINITY = MATE_SCORE + 1
+MAX_PLY = 64
+ASPIRATION_WINDOW = 50  # centipawns either side of the previous iteration's score
+TIME_MARGIN = 0.03      # seconds kept back from the deadline, enough for one clock poll and the unwinding
+STOP_POLL_MASK = 255    # the clock and an external stop event are looked at every 256 nodes
+
+
+class SearchTimeout(Exception):
+    # raised inside the search when the budget runs out, caught by Searcher.search
+    pass
+
+
+class SearchResult():
+    def __init__(self, bestMove, score, pv, depth, nodes, seconds):
+        self.bestMove = bestMove
+        self.score = score  # centipawns from the side to move's point of view
+        self.pv = pv        # principal variation, a list of moves starting with bestMove
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+        self.nps = int(nodes / seconds) if seconds > 0 else 0
+
+    def isMate(self):
+        return abs(self.score) >= MATE_THRESHOLD
+
+    def mateIn(self):
+        # moves until mate, negative if the side to move is getting mated, None if it isn't a mate score
+        if not self.isMate():
+            return None
+        plies = MATE_SCORE - abs(self.score)
+        return (plies + 1) // 2 if self.score > 0 else -(plies // 2)
+
+
+class Searcher():
+    def __init__(self, ttSizeMB=16, evaluate=Evaluation.evaluate, book=None, tablebases=None, tt=None, stopEvent=None):
+        self.tt = tt if tt is not None else TranspositionTable(ttSizeMB)  # tt lets searches share a table
+        self.evaluate = evaluate
+        self.book = book  # a Polyglot.PolyglotBook whose moves are played without searching
+        self.tablebases = tablebases  # a Tablebase.Tablebases whose positions are scored without searching
+        self.stopped = False
+        self.stopEvent = stopEvent  # a threading or multiprocessing Event that stops every search while it is set
+        self.nodes = 0
+        self.cutoffs = 0  # beta cutoffs of the last search, for the instrumentation
+
+    def stop(self):
+        # safe to call from another thread, the search notices at its next node
+        self.stopped = True
+
+    def setTimeLimit(self, timeLimit):
+        # gives a running search (one started without a time limit, e.g. pondering) timeLimit seconds from now
+        self.deadline = time.perf_counter() + max(0.0, timeLimit - TIME_MARGIN)
+
+    def search(self, gs, maxDepth=MAX_PLY, timeLimit=None, nodeLimit=None, infoCallback=None, startDepth=1):
+        '''
+        Searches gs with iterative deepening until maxDepth, timeLimit (seconds) or nodeLimit is reached,
+        or stop() is called, and returns the SearchResult of the deepest completed iteration.
+        Iterations start at startDepth, which parallel helper searches use to stagger their depths.
+        infoCallback, if given, is called with the SearchResult of every completed iteration.
+        A position in the book is answered with a book move straight away, as a depth 0 result.
+        gs is left exactly as it was passed in.
+        '''
+        self.startTime = time.perf_counter()
+        if self.book is not None:
+            bookMove = self.book.chooseMove(gs)
+            if bookMove is not None:
+                return SearchResult(bookMove, 0, [bookMove], 0, 0, time.perf_counter() - self.startTime)
+        self.deadline = None if timeLimit is None else self.startTime + max(0.0, timeLimit - TIME_MARGIN)
+        self.nodeLimit = nodeLimit
+        self.nodes = 0
+        self.cutoffs = 0
+        self.stopped = False
+        self.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        self.history = {}
+        self.pvTable = [[] for _ in range(MAX_PLY + 2)]
+        self.tt.newSearch()
+
+        rootMoves = gs.getValidMoves()
+        if len(rootMoves) == 0:
+            return SearchResult(None, -MATE_SCORE if gs.inCheck else 0, [], 0, 0, 0.0)
+        # something to play even if the first iteration can't finish
+        result = SearchResult(next(gs.getValidMovesStaged()), 0, [], 0, 0, 0.0)
+        rootLogLength = len(gs.moveLog)
+        score = 0
+        for depth in range(min(startDepth, maxDepth), maxDepth + 1):
+            try:
+                score = self.aspirationSearch(gs, depth, score)
+            except SearchTimeout:
+                while len(gs.moveLog) > rootLogLength:  # unwind the moves the abandoned iteration made
+                    gs.undoMove()
+                break
+            seconds = time.perf_counter() - self.startTime
+            pv = self.tablePV(gs, self.pvTable[0])
+            result = SearchResult(pv[0], score, pv, depth, self.nodes, seconds)
+            if infoCallback is not None:
+                infoCallback(result)
+            if result.isMate() and MATE_SCORE - abs(score) <= depth:
+                break  # the mate is fully inside the searched depth, deeper searches won't change it
+            if self.deadline is not None and time.perf_counter() - self.startTime > (self.deadline - self.startTime) / 2:
+                break  # the next iteration takes longer than all of these together, it would not finish
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - self.startTime
+        result.nps = int(result.nodes / result.seconds) if result.seconds > 0 else 0
+        return result
+
+    def checkLimits(self):
+        if self.stopped or (self.nodeLimit is not None and self.nodes >= self.nodeLimit):
+            raise SearchTimeout()
+        # the clock and the stop event are polled from the first node on, so a stop set before the search started
+        # still stops it
+        if self.nodes & STOP_POLL_MASK == 1 and ((self.deadline is not None and time.perf_counter() >= self.deadline) or
+                                                  (self.stopEvent is not None and self.stopEvent.is_set())):
+            raise SearchTimeout()
+
+    def aspirationSearch(self, gs, depth, previousScore):
+        # search a narrow window around the last score first, widening it on whichever side fails
+        if depth < 3 or abs(previousScore) >= MATE_THRESHOLD:
+            return self.negamax(gs, depth, -INFINITY, INFINITY, 0)
+        delta = ASPIRATION_WINDOW
+        alpha = previousScore - delta
+        beta = previousScore + delta
+        while True:
+            score = self.negamax(gs, depth, alpha, beta, 0)
+            if score <= alpha:
+                alpha = max(score - delta, -INFINITY)
+            elif score >= beta:
+                beta = min(score + delta, INFINITY)
+            else:
+                return score
+            delta *= 2
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        if depth <= 0:
+            return self.quiescence(gs, alpha, beta, ply)
+        self.nodes += 1
+        self.checkLimits()
+        self.pvTable[ply] = []
+        if ply > 0 and (gs.isRepetition() or gs.isFiftyMoveDraw()):
+            return 0  # repeating a position can't get more than it did the first time round, so it scores as a draw
+        originalAlpha = alpha
+
+        key = gs.zobristKey
+        entry = self.tt.probe(key, gs.board)
+        hashMove = None
+        if entry is not None:
+            hashMove, bound, entryDepth, entryScore = entry
+            if ply > 0 and entryDepth >= depth:
+                score = scoreFromTable(entryScore, ply)
+                if bound == EXACT or (bound == LOWER_BOUND and score >= beta) or (bound == UPPER_BOUND and score <= alpha):
+                    return score  # the line ends here, tablePV completes it from the table
+
+        if self.tablebases is not None and ply > 0:
+            found = gs.probeTablebase(self.tablebases)
+            if found is not None:
+                wdl, dtm = found  # a mate dtm plies from here scores like one found by the search
+                return wdl * (MATE_SCORE - ply - dtm)
+
+        if ply >= MAX_PLY:
+            return self.evaluate(gs)
+        moves = gs.getValidMovesStaged(hashMove, self.killers[ply], self.history)
+        inCheck = gs.inCheck  # searching the moves below overwrites gs.inCheck
+        if inCheck:
+            depth += 1  # check extension
+
+        bestScore = -INFINITY
+        bestMove = None
+        for move in moves:
+            gs.makeMove(move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+                    if alpha >= beta:
+                        self.cutoffs += 1
+                        if move.pieceCaptured == "--" and not move.isPawnPromotion:
+                            self.storeKiller(move, ply)
+                            historyKey = (move.pieceMoved, move.endRow * 8 + move.endCol)
+                            self.history[historyKey] = self.history.get(historyKey, 0) + depth * depth
+                        break
+        if bestMove is None:
+            return -MATE_SCORE + ply if inCheck else 0
+
+        if bestScore <= originalAlpha:
+            bound = UPPER_BOUND
+        elif bestScore >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.tt.store(key, bestMove, bound, depth, scoreToTable(bestScore, ply))
+        return bestScore
+
+    def quiescence(self, gs, alpha, beta, ply):
+        '''
+        Only captures and promotions are searched, so the static evaluation is never taken in the middle of
+        an exchange. The side to move may always "stand pat" on the evaluation instead, unless it is in check,
+        where every evasion is searched. Quiet moves are never generated, so stalemates aren't seen here.
+        '''
+        self.nodes += 1
+        self.checkLimits()
+        self.pvTable[ply] = []
+        if self.tablebases is not None and ply > 0:
+            found = gs.probeTablebase(self.tablebases)
+            if found is not None:
+                wdl, dtm = found  # a mate dtm plies from here scores like one found by the search
+                return wdl * (MATE_SCORE - ply - dtm)
+
+        if ply >= MAX_PLY:
+            return self.evaluate(gs)
+        moves = gs.getValidMovesStaged(capturesOnly=True)
+        inCheck = gs.inCheck
+        if not inCheck:
+            standPat = self.evaluate(gs)
+            if standPat >= beta:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+        bestScore = -INFINITY if inCheck else alpha
+        for move in moves:
+            gs.makeMove(move)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                if score > alpha:
+                    alpha = score
+                    self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+                    if alpha >= beta:
+                        self.cutoffs += 1
+                        break
+        if inCheck and bestScore == -INFINITY:
+            return -MATE_SCORE + ply
+        return bestScore
+
+    def tablePV(self, gs, pv):
+        '''
+        The root's principal variation, pv, extended with the exact entries the transposition table holds
+        after its last move, as far as they go. Lines cut off by the table are completed this way.
+        A table move is only played if it is one of the legal moves of the position, since a shared table
+        may hold a move stored for another position with the same key.
+        '''
+        pv = list(pv)
+        for move in pv:
+            gs.makeMove(move)
+        while len(pv) < MAX_PLY and not gs.isRepetition():
+            entry = self.tt.probe(gs.zobristKey, gs.board)
+            if entry is None or entry[1] != EXACT or entry[0] is None:
+                break
+            move = next((move for move in gs.getValidMoves() if move == entry[0]), None)
+            if move is None:
+                break
+            pv.append(move)
+            gs.makeMove(move)
+        for _ in pv:
+            gs.undoMove()
+        return pv
+
+    def storeKiller(self, move, ply):
+        killers = self.killers[ply]
+        if move != killers[0]:
+            killers[1] = killers[0]
+            killers[0] = move
+
+
+def scoreToTable(score, ply):
+    # mate scores are stored relative to the position, not to the root
+    if score >= MATE_THRESHOLD:
+        return score + ply
+    if score <= -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score - ply
+    if score <= -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+def findBestMove(gs, timeLimit=1.0, maxDepth=MAX_PLY, book=None, tablebases=None):
+    # one-off search for callers that don't keep a Searcher around
+    return Searcher(book=book, tablebases=tablebases).search(gs, maxDepth=maxDepth, timeLimit=timeLimit).bestMove
@@ -0,0 +1,513 @@
+"""
+Endgame tablebases for KQK, KRK, KPK and KBNK made by retrograde analysis.
+A table holds, for every placement of the pieces and either side to move, whether the side to move wins, draws
+or loses and in how many plies the mate comes. Generation works on NumPy arrays with one axis per piece
+(white king, black king, then the white pieces) so a move of one piece is a slice along its axis.
+Starting from the mates, a white position is won in p plies if some move reaches a black position lost
+in p - 1, and a black position is lost in p plies if every move reaches a white win. The moves come from the
+attack tables in Bitboards. Each ply is split by white king square over a pool of worker processes sharing
+the arrays.
+
+On disk a table is a small header and one byte per position, white to move first. Only white king squares in
+the a1-d1-d4 triangle (files a-d with a pawn) are stored, the rest is found by mirroring the board. The bytes are
+read straight from a memory map, so loading a table costs nothing. Positions with black as the strong side
+are probed with the colors swapped.
+
+Usage from the Chess folder:
+    python Tablebase.py generate --output tablebases
+    python Tablebase.py probe tablebases --fen "8/8/8/4k3/8/8/8/KQ6 w - - 0 1"
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from functools import lru_cache
+from multiprocessing import Pool, shared_memory
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Chess.Bitboards import (SQUARE_BITS, KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, BETWEEN, rookAttacks,
+                             bishopAttacks, iterSquares)
+from Chess.ChessEngine import GameState
+
+# the white pieces next to the two kings, in axis order
+ENDGAMES = {'KQK': ('Q',), 'KRK': ('R',), 'KPK': ('p',), 'KBNK': ('B', 'N')}
+PROMOTIONS = {'KPK': ('KQK', 'KRK')}  # tables a pawn promotes into, knight and bishop promotions only draw
+GENERATION_ORDER = ('KQK', 'KRK', 'KBNK', 'KPK')
+# position values: 0 draw, p > 0 side to move mates in p plies, -(p + 1) side to move is mated in p plies
+DRAW = 0
+ILLEGAL = 127
+WIN, LOSS = 1, -1
+
+HEADER = struct.Struct('<4sBB8s')  # magic, version, number of pieces, name
+MAGIC = b'CETB'
+VERSION = 1
+EXTENSION = '.cetb'
+
+
+def _canonicalTransforms(pawns):
+    '''
+    For every white king square, a 64 entry square map that moves it into the stored region, and the region's
+    white king squares in order. Without pawns the board can be mirrored and flipped (8 ways) and the region
+    is the a1-d1-d4 triangle, with pawns only a left-right mirror is allowed and the region is files a-d.
+    '''
+    transforms = []
+    for flipFiles in (False, True):
+        for flipRanks in ((False,) if pawns else (False, True)):
+            for swap in ((False,) if pawns else (False, True)):
+                square = []
+                for sq in range(64):
+                    rank, file = 7 - sq // 8, sq % 8
+                    if flipFiles:
+                        file = 7 - file
+                    if flipRanks:
+                        rank = 7 - rank
+                    if swap:
+                        rank, file = file, rank
+                    square.append((7 - rank) * 8 + file)
+                transforms.append(square)
+
+    def stored(sq):
+        rank, file = 7 - sq // 8, sq % 8
+        return file <= 3 if pawns else file <= 3 and rank <= file
+    region = [sq for sq in range(64) if stored(sq)]
+    kingTransforms = [next(square for square in transforms if stored(square[sq])) for sq in range(64)]
+    return region, kingTransforms
+
+
+def _moveTargets(piece, sq):
+    # (target, squares in between) of every move a white piece on sq has on an otherwise empty board
+    if piece == 'K':
+        return [(t, 0) for t in iterSquares(KING_ATTACKS[sq])]
+    if piece == 'N':
+        return [(t, 0) for t in iterSquares(KNIGHT_ATTACKS[sq])]
+    if piece == 'p':
+        if sq < 8 or sq >= 56:
+            return []
+        targets = [(sq - 8, 0)]
+        if sq >= 48:  # first move, two squares
+            targets.append((sq - 16, SQUARE_BITS[sq - 8]))
+        return targets
+    attacks = (rookAttacks(sq, 0) if piece in 'RQ' else 0) | (bishopAttacks(sq, 0) if piece in 'BQ' else 0)
+    return [(t, BETWEEN[sq][t]) for t in iterSquares(attacks)]
+
+
+def _attackTargets(piece, sq):
+    if piece == 'p':
+        return [(t, 0) for t in iterSquares(PAWN_ATTACKS['w'][sq])]
+    return _moveTargets(piece, sq)
+
+
+@lru_cache(maxsize=None)
+def _emptyOf(bits):
+    # bool per square, True where the square isn't one of bits
+    return np.array([not SQUARE_BITS[sq] & bits for sq in range(64)])
+
+
+def _at(n, fixed):
+    # index of the sub-array with the axes in fixed ({axis: square}) fixed
+    return tuple(fixed.get(axis, slice(None)) for axis in range(n))
+
+
+def _freeMask(n, fixed, bits, chunk=None):
+    '''
+    Mask over the axes not in fixed, in their order, True where none of those pieces is on bits.
+    chunk limits axis 0 when it isn't fixed.
+    '''
+    free = [axis for axis in range(n) if axis not in fixed]
+    mask = np.ones((1,) * len(free), dtype=bool)
+    for i, axis in enumerate(free):
+        empty = _emptyOf(bits)
+        if axis == 0 and chunk is not None:
+            empty = empty[chunk]
+        shape = [1] * len(free)
+        shape[i] = len(empty)
+        mask = mask & empty.reshape(shape)
+    return mask
+
+
+def _squareGrid(n, axis):
+    # the square of the piece on axis, broadcast over n axes
+    shape = [1] * n
+    shape[axis] = 64
+    return np.arange(64).reshape(shape)
+
+
+def _legality(pieces):
+    '''
+    (legalWhite, legalBlack, attacked) for a set of white pieces: positions that are legal with white
+    or black to move, and positions where the black king is attacked.
+    '''
+    pieces = ('K', 'K') + pieces
+    n = len(pieces)
+    shape = (64,) * n
+    valid = np.ones(shape, dtype=bool)
+    for i in range(n):
+        for j in range(i + 1, n):
+            valid &= _squareGrid(n, i) != _squareGrid(n, j)
+        if pieces[i] == 'p':
+            valid &= (_squareGrid(n, i) >= 8) & (_squareGrid(n, i) < 56)
+    attacked = np.zeros(shape, dtype=bool)
+    for axis, piece in enumerate(pieces):
+        if axis == 1:
+            continue
+        for sq in range(64):
+            for t, between in _attackTargets(piece, sq):
+                fixed = {axis: sq, 1: t}
+                attacked[_at(n, fixed)] |= _freeMask(n, fixed, between)
+    kingsApart = np.ones(shape, dtype=bool)
+    for sq in range(64):
+        for t in iterSquares(KING_ATTACKS[sq]):
+            kingsApart[_at(n, {0: sq, 1: t})] = False
+    return valid & ~attacked, valid & kingsApart, attacked
+
+
+class _Arrays():
+    # the generation arrays of one table, in shared memory so every worker can use them
+    NAMES = (('white', np.int8), ('black', np.int8), ('legalWhite', bool), ('legalBlack', bool),
+             ('canMove', bool), ('captureEscape', bool))
+
+    def __init__(self, n, blocks=None):
+        self.shape = (64,) * n
+        size = 64 ** n
+        self.blocks = blocks or {name: shared_memory.SharedMemory(create=True, size=size) for name, _ in self.NAMES}
+        for name, dtype in self.NAMES:
+            setattr(self, name, np.ndarray(self.shape, dtype=dtype, buffer=self.blocks[name].buf))
+
+    def blockNames(self):
+        return {name: block.name for name, block in self.blocks.items()}
+
+    @classmethod
+    def attach(cls, n, blockNames):
+        return cls(n, {name: shared_memory.SharedMemory(name=blockName) for name, blockName in blockNames.items()})
+
+    def close(self, unlink=False):
+        for name, _ in self.NAMES:
+            setattr(self, name, None)
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+
+
+_worker = {}  # the generation state of a worker process
+
+
+def _initWorker(pieces, blockNames, promotionTables):
+    _worker['pieces'] = ('K', 'K') + pieces
+    _worker['arrays'] = _Arrays.attach(len(pieces) + 2, blockNames)
+    _worker['promotions'] = promotionTables
+
+
+def _runStep(task):
+    step, ply, lo, hi = task
+    return step(_worker['pieces'], _worker['arrays'], _worker['promotions'], ply, slice(lo, hi))
+
+
+def _whiteStep(pieces, arrays, promotions, ply, chunk):
+    '''
+    Marks the white to move positions (white king in chunk) with a move to a black position lost
+    in ply - 1 as won in ply plies. Returns how many were found.
+    '''
+    n = len(pieces)
+    lost = -ply  # a loss in ply - 1 plies
+    black = arrays.black
+    blackChunk = black[chunk]
+    found = np.zeros(blackChunk.shape, dtype=bool)
+    for axis, piece in enumerate(pieces):
+        if axis == 1:
+            continue
+        sources = range(chunk.start, chunk.stop) if axis == 0 else range(64)
+        for sq in sources:
+            target = found[_at(n, {axis: sq - chunk.start if axis == 0 else sq})]
+            for t, between in _moveTargets(piece, sq):
+                mask = _freeMask(n, {axis: sq}, between | SQUARE_BITS[t], None if axis == 0 else chunk)
+                if piece == 'p' and t < 8:
+                    # the pawn promotes into a table with the new piece on the same axis
+                    hit = np.zeros(mask.shape, dtype=bool)
+                    for table in promotions:
+                        hit = hit | (table[_at(n, {axis: t})][chunk] == lost)
+                elif axis == 0:
+                    hit = black[_at(n, {0: t})] == lost
+                else:
+                    hit = blackChunk[_at(n, {axis: t})] == lost
+                target |= hit & mask
+    white = arrays.white[chunk]
+    new = found & arrays.legalWhite[chunk] & (white == DRAW)
+    white[new] = ply
+    return int(new.sum())
+
+
+def _blackStep(pieces, arrays, promotions, ply, chunk):
+    '''
+    Marks the black to move positions (white king in chunk) whose every move reaches a white win as lost
+    in ply plies. Returns how many were found.
+    '''
+    n = len(pieces)
+    white = arrays.white[chunk]
+    legalWhite = arrays.legalWhite[chunk]
+    escape = arrays.captureEscape[chunk].copy()
+    for sq in range(64):
+        target = escape[_at(n, {1: sq})]
+        for t in iterSquares(KING_ATTACKS[sq]):
+            to = _at(n, {1: t})
+            target |= legalWhite[to] & (white[to] <= DRAW)
+    black = arrays.black[chunk]
+    new = ~escape & arrays.canMove[chunk] & arrays.legalBlack[chunk] & (black == DRAW)
+    black[new] = -(ply + 1)
+    return int(new.sum())
+
+
+def _blackMoves(pieces, arrays):
+    '''
+    Fills canMove (black has a legal move) and captureEscape (black can take a piece, which only leaves
+    drawn material in these endgames) from the legality of the positions the black king moves to.
+    '''
+    n = len(pieces)
+    # legal positions with white to move once the piece on an axis is gone, the axes after it move up one
+    subLegal = {axis: _legality(tuple(p for i, p in enumerate(pieces[2:], 2) if i != axis))[0]
+                for axis in range(2, n)}
+    arrays.captureEscape[...] = False
+    arrays.canMove[...] = False
+    for sq in range(64):
+        escape = arrays.captureEscape[_at(n, {1: sq})]
+        canMove = arrays.canMove[_at(n, {1: sq})]
+        for t in iterSquares(KING_ATTACKS[sq]):
+            canMove |= arrays.legalWhite[_at(n, {1: t})]
+            for axis in range(2, n):
+                escape[_at(n - 1, {axis - 1: t})] |= subLegal[axis][_at(n - 1, {1: t})]
+        canMove |= escape
+
+
+def generate(name, directory, workers=None, log=print):
+    '''
+    Generates one table and writes it to directory/<name>.cetb. Tables a pawn promotes into
+    have to be in directory already. Returns the path.
+    '''
+    pieces = ENDGAMES[name]
+    allPieces = ('K', 'K') + pieces
+    n = len(allPieces)
+    start = time.perf_counter()
+    promotionPaths = [os.path.join(directory, table + EXTENSION) for table in PROMOTIONS.get(name, ())]
+    arrays = _Arrays(n)
+    try:
+        legalWhite, legalBlack, attacked = _legality(pieces)
+        arrays.legalWhite[...] = legalWhite
+        arrays.legalBlack[...] = legalBlack
+        _blackMoves(allPieces, arrays)
+        arrays.white[...] = np.where(legalWhite, DRAW, ILLEGAL)
+        arrays.black[...] = np.where(legalBlack, DRAW, ILLEGAL)
+        mated = legalBlack & attacked & ~arrays.canMove
+        arrays.black[mated] = -1
+        del legalWhite, legalBlack, attacked, mated
+        promotions = [_loadFullTable(path) for path in promotionPaths]
+        workers = workers or os.cpu_count()
+        bounds = np.linspace(0, 64, min(64, workers * 4) + 1).astype(int)
+        chunks = [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+        initargs = (pieces, arrays.blockNames(), promotions)
+        if workers == 1:
+            _initWorker(*initargs)
+            runPly = lambda tasks: map(_runStep, tasks)
+        else:
+            pool = Pool(workers, initializer=_initWorker, initargs=initargs)
+            runPly = lambda tasks: pool.map(_runStep, tasks)
+        try:
+            ply = 1
+            idle = 0
+            while idle < 2:  # stop once neither side found anything new
+                step = _whiteStep if ply % 2 else _blackStep
+                found = sum(runPly([(step, ply, lo, hi) for lo, hi in chunks]))
+                idle = idle + 1 if found == 0 else 0
+                ply += 1
+        finally:
+            if workers == 1:
+                _worker.pop('arrays').close()
+            else:
+                pool.close()
+                pool.join()
+        path = os.path.join(directory, name + EXTENSION)
+        _write(path, name, arrays.white, arrays.black, 'p' in pieces)
+        longest = int(arrays.white.max(where=arrays.white != ILLEGAL, initial=0))
+    finally:
+        arrays.close(unlink=True)
+    log(f"{name}: longest mate {longest} plies, {time.perf_counter() - start:.1f}s")
+    return path
+
+
+def _write(path, name, white, black, pawns):
+    region, _ = _canonicalTransforms(pawns)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, white.ndim, name.encode('ascii')))
+        f.write(np.ascontiguousarray(white[region]).tobytes())
+        f.write(np.ascontiguousarray(black[region]).tobytes())
+    os.replace(path + '.tmp', path)
+
+
+def _loadFullTable(path):
+    # the black to move values of a table file as a full array, for the positions a pawn promotes into
+    with TableFile(path) as table:
+        grids = np.meshgrid(*[np.arange(64)] * table.pieces, indexing='ij')
+        return table.values(True, [grid.ravel() for grid in grids]).reshape((64,) * table.pieces)
+
+
+class TableFile():
+    # one memory-mapped table file
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.pieces, name = HEADER.unpack_from(self.data)
+        self.name = name.rstrip(b'\0').decode('ascii', errors='replace')
+        if magic != MAGIC or version != VERSION or self.name not in ENDGAMES:
+            self.close()
+            raise ValueError(f"{path} isn't a version {VERSION} tablebase")
+        region, kingTransforms = _canonicalTransforms('p' in ENDGAMES[self.name])
+        self.transforms = np.array(kingTransforms)  # [white king square] -> square map
+        self.regionIndex = np.full(64, -1)
+        self.regionIndex[region] = np.arange(len(region))
+        self.slotSize = 64 ** (self.pieces - 1)
+        self.sideSize = len(region) * self.slotSize
+        if len(self.data) != HEADER.size + 2 * self.sideSize:
+            self.close()
+            raise ValueError(f"{path} is truncated")
+        self.table = np.frombuffer(self.data, dtype=np.int8, offset=HEADER.size)
+
+    def close(self):
+        self.table = None
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def value(self, blackToMove, squares):
+        # the stored value of one position, squares being the square of each piece in axis order
+        transform = self.transforms[squares[0]]
+        offset = blackToMove * self.sideSize + int(self.regionIndex[transform[squares[0]]]) * self.slotSize
+        index = 0
+        for sq in squares[1:]:
+            index = index * 64 + int(transform[sq])
+        return int(self.table[offset + index])
+
+    def values(self, blackToMove, squares):
+        # value for many positions at once, squares being an array of squares per axis
+        transforms = self.transforms[squares[0]]
+        rows = np.arange(len(squares[0]))
+        offsets = blackToMove * self.sideSize + self.regionIndex[transforms[rows, squares[0]]] * self.slotSize
+        index = np.zeros(len(squares[0]), dtype=np.int64)
+        for axisSquares in squares[1:]:
+            index = index * 64 + transforms[rows, axisSquares]
+        return self.table[offsets + index]
+
+
+class Tablebases():
+    '''
+    The tables of a directory, probed by GameState.probeTablebase. Each table is memory-mapped,
+    so processes probing the same files share them through the OS page cache.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        for fileName in sorted(os.listdir(directory)):
+            if fileName.endswith(EXTENSION):
+                table = TableFile(os.path.join(directory, fileName))
+                self.tables[_materialKey(ENDGAMES[table.name])] = table
+        # no table has more pieces than this, a position with more needn't be looked at
+        self.maxPieces = max([table.pieces for table in self.tables.values()], default=2)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def probe(self, gs):
+        '''
+        (wdl, dtm) of gs for the side to move, or None if no table covers it: wdl is WIN, DRAW or LOSS and
+        dtm the plies to mate with best play (0 for a draw). The fifty move rule isn't taken into account.
+        A position with castling rights isn't in any table.
+        '''
+        rights = gs.currentCastlingRight
+        if rights.wks or rights.wqs or rights.bks or rights.bqs:
+            return None
+        pieces = {'w': [], 'b': []}
+        for sq in iterSquares(gs.occupied):
+            piece = gs.board[sq >> 3][sq & 7]
+            if piece[1] != 'K':
+                pieces[piece[0]].append((piece[1], sq))
+        if pieces['w'] and pieces['b']:
+            return None
+        if not pieces['w'] and not pieces['b']:
+            return DRAW, 0
+        # the strong side plays white in the tables, with black pieces the board is turned around
+        strong = 'w' if pieces['w'] else 'b'
+        flip = (lambda sq: sq) if strong == 'w' else (lambda sq: sq ^ 56)
+        table = self.tables.get(_materialKey(piece for piece, _ in pieces[strong]))
+        if table is None:
+            return None
+        strongKing, weakKing = gs.whiteKingLocation, gs.blackKingLocation
+        if strong == 'b':
+            strongKing, weakKing = weakKing, strongKing
+        axes = ENDGAMES[table.name]
+        placed = sorted(pieces[strong], key=lambda piece: axes.index(piece[0]))
+        squares = [flip(strongKing[0] * 8 + strongKing[1]), flip(weakKing[0] * 8 + weakKing[1])] + \
+            [flip(sq) for _, sq in placed]
+        value = table.value(gs.whiteToMove != (strong == 'w'), squares)
+        if value == ILLEGAL:
+            return None
+        if value > 0:
+            return WIN, value
+        if value < 0:
+            return LOSS, -value - 1
+        return DRAW, 0
+
+
+def _materialKey(pieces):
+    return ''.join(sorted(pieces))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate or probe the endgame tablebases")
+    commands = parser.add_subparsers(dest='command', required=True)
+    generateCommand = commands.add_parser('generate', help="generate tables into a directory")
+    generateCommand.add_argument('--output', '-o', default='tablebases')
+    generateCommand.add_argument('--tables', nargs='+', choices=GENERATION_ORDER, default=list(GENERATION_ORDER),
+                                 help="tables to make (default all), the ones KPK promotes into are added")
+    generateCommand.add_argument('--workers', type=int, help="worker processes (default one per CPU)")
+    probeCommand = commands.add_parser('probe', help="look up a position")
+    probeCommand.add_argument('directory')
+    probeCommand.add_argument('--fen', required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        os.makedirs(args.output, exist_ok=True)
+        wanted = set(args.tables)
+        for name in args.tables:
+            wanted.update(table for table in PROMOTIONS.get(name, ())
+                          if not os.path.exists(os.path.join(args.output, table + EXTENSION)))
+        for name in GENERATION_ORDER:
+            if name in wanted:
+                generate(name, args.output, args.workers)
+        return 0
+    gs = GameState.from_fen(args.fen)
+    with Tablebases(args.directory) as tablebases:
+        found = tablebases.probe(gs)
+    if found is None:
+        print("not in the tablebases")
+        return 1
+    wdl, dtm = found
+    print({WIN: f"win, mate in {(dtm + 1) // 2}", DRAW: "draw", LOSS: f"loss, mated in {dtm // 2}"}[wdl] +
+          f" ({dtm} plies)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+Fixed size transposition table keyed by GameState.zobristKey.
+The table is a power of two number of buckets with two slots each. The first slot keeps the deepest result seen
+for its bucket (depth-preferred), the second takes whatever the first one turned down (always-replace), so deep
+results survive while the most recent shallow ones are still found.
+Each slot remembers the best move, the bound type, the depth and the score of a searched position.
+SharedTranspositionTable is the same table in a shared memory block, for searches running in several processes.
+"""
+from multiprocessing import shared_memory
+from Chess.ChessEngine import Move
+EXACT = 0        # the score is exact
+LOWER_BOUND = 1  # the search failed high, the real score is at least this
+UPPER_BOUND = 2  # the search failed low, the real score is at most this
+
+# rough number of bytes a filled slot costs in CPython (key int, entry tuple and the list pointers to them),
+# used to turn a memory budget into a number of slots
+SLOT_BYTES = 160
+SHARED_SLOT_BYTES = 16  # key ^ data and data, two 64-bit words
+SHARED_HEADER_WORDS = 2  # generation and bucket count
+
+# a shared slot's data word: move id, bound, depth, generation and score, and a bit telling it from an empty slot
+MOVE_MASK = 0xFFFF
+BOUND_SHIFT = 16
+DEPTH_SHIFT = 18
+GENERATION_SHIFT = 26
+SCORE_SHIFT = 34
+SCORE_OFFSET = 1 << 19  # scores are stored as score + SCORE_OFFSET in 20 bits
+USED_BIT = 1 << 54
+
+
+class TranspositionTable():
+    def __init__(self, sizeMB=16):
+        self.resize(sizeMB)
+
+    def resize(self, sizeMB):
+        # largest power of two bucket count that fits in the budget, this also clears the table
+        buckets = 1
+        while buckets * 2 * 2 * SLOT_BYTES <= sizeMB * 1024 * 1024:
+            buckets *= 2
+        self.sizeMB = sizeMB
+        self.mask = buckets - 1
+        self.keys = [0] * (2 * buckets)       # slot 2*i is depth-preferred, 2*i+1 is always-replace
+        self.entries = [None] * (2 * buckets) # (move, bound, depth, score, generation)
+        self.generation = 0
+        self.clearStats()
+
+    def clear(self):
+        self.resize(self.sizeMB)
+
+    def clearStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0  # probes that found the bucket holding other positions
+        self.stores = 0
+        self.overwrites = 0  # stores that threw away a different position
+
+    def newSearch(self):
+        # entries from earlier searches may be replaced even if they are deeper
+        self.generation = (self.generation + 1) & 0xFF
+
+    def probe(self, key, board=None):
+        '''
+        Returns the (move, bound, depth, score) stored for key, or None.
+        board is only needed by tables that keep the move as its id (SharedTranspositionTable).
+        '''
+        self.probes += 1
+        index = (key & self.mask) << 1
+        keys = self.keys
+        if keys[index] == key and self.entries[index] is not None:
+            self.hits += 1
+            return self.entries[index][:4]
+        if keys[index + 1] == key and self.entries[index + 1] is not None:
+            self.hits += 1
+            return self.entries[index + 1][:4]
+        self.misses += 1
+        if self.entries[index] is not None or self.entries[index + 1] is not None:
+            self.collisions += 1
+        return None
+
+    def store(self, key, move, bound, depth, score):
+        self.stores += 1
+        index = (key & self.mask) << 1
+        deepEntry = self.entries[index]
+        if deepEntry is None or self.keys[index] == key or depth >= deepEntry[2] or deepEntry[4] != self.generation:
+            if self.keys[index] == key and move is None and deepEntry is not None:
+                move = deepEntry[0]  # keep the old best move rather than forget it
+        else:
+            index += 1
+            if self.keys[index] == key and move is None and self.entries[index] is not None:
+                move = self.entries[index][0]
+        if self.entries[index] is not None and self.keys[index] != key:
+            self.overwrites += 1
+        self.keys[index] = key
+        self.entries[index] = (move, bound, depth, score, self.generation)
+
+    def hashfull(self):
+        # permille of the first 1000 slots in use by the current search, as UCI reports it
+        sample = self.entries[:1000]
+        return sum(1 for entry in sample if entry is not None and entry[4] == self.generation) * 1000 // len(sample)
+
+    def getStats(self):
+        return {'sizeMB': self.sizeMB, 'slots': len(self.keys), 'probes': self.probes, 'hits': self.hits,
+                'misses': self.misses, 'collisions': self.collisions, 'stores': self.stores,
+                'overwrites': self.overwrites, 'hitRate': self.hits / self.probes if self.probes else 0.0,
+                'hashfull': self.hashfull()}
+
+
+class SharedTranspositionTable():
+    '''
+    TranspositionTable kept in a multiprocessing.shared_memory block, so searches in several processes see each
+    other's results. One process creates it and the others attach to it by name.
+    Slots and replacement work like TranspositionTable's, but a slot is two 64-bit words: the data packed into
+    one integer and the key xored with it. Processes read and write slots without locking. A reader that gets
+    the two words of two different stores (or a key collision) finds a key that doesn't match and treats the
+    slot as empty, so a torn slot costs a probe but never returns the wrong entry.
+    Moves are stored by their id, so probe needs the board to turn one back into a Move.
+    '''
+    def __init__(self, sizeMB=16, name=None):
+        if name is None:
+            buckets = 1
+            while buckets * 2 * 2 * SHARED_SLOT_BYTES <= sizeMB * 1024 * 1024:
+                buckets *= 2
+            self.block = shared_memory.SharedMemory(create=True, size=(SHARED_HEADER_WORDS + 4 * buckets) * 8)
+            self.owner = True
+        else:
+            self.block = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.words = self.block.buf.cast('Q')
+        if self.owner:
+            self.words[1] = buckets
+        buckets = self.words[1]
+        self.sizeMB = buckets * 2 * SHARED_SLOT_BYTES >> 20
+        self.mask = buckets - 1
+        self.generation = self.words[0]
+        self.clearStats()
+
+    @property
+    def name(self):
+        # what another process passes to SharedTranspositionTable(name=...) to attach
+        return self.block.name
+
+    def close(self):
+        # detaches this process, the process that created the table also frees it
+        self.words.release()
+        self.block.close()
+        if self.owner:
+            self.block.unlink()
+
+    def resize(self, sizeMB):
+        raise ValueError("a shared transposition table can't be resized, make a new one")
+
+    def clear(self):
+        # only the creating process clears, while no other process is searching
+        if self.owner:
+            self.block.buf[SHARED_HEADER_WORDS * 8:] = bytes(len(self.block.buf) - SHARED_HEADER_WORDS * 8)
+        self.clearStats()
+
+    clearStats = TranspositionTable.clearStats
+
+    def newSearch(self):
+        # the creating process ages the entries, the others pick up its generation
+        if self.owner:
+            self.words[0] = (self.words[0] + 1) & 0xFF
+        self.generation = self.words[0]
+
+    def probe(self, key, board=None):
+        '''
+        Returns the (move, bound, depth, score) stored for key, or None. The move is rebuilt on board,
+        without a board only its id is returned.
+        '''
+        self.probes += 1
+        words = self.words
+        index = SHARED_HEADER_WORDS + ((key & self.mask) << 2)
+        for slot in (index, index + 2):
+            data = words[slot + 1]
+            if data and words[slot] ^ data == key:
+                self.hits += 1
+                return self.unpack(data, board)[:4]
+        self.misses += 1
+        if words[index + 1] or words[index + 3]:
+            self.collisions += 1
+        return None
+
+    def unpack(self, data, board):
+        # (move, bound, depth, score, generation) of a data word
+        moveID = data & MOVE_MASK
+        move = None
+        if moveID:
+            move = Move.fromID(moveID, board) if board is not None else moveID
+        return (move, (data >> BOUND_SHIFT) & 3, (data >> DEPTH_SHIFT) & 0xFF,
+                ((data >> SCORE_SHIFT) & 0xFFFFF) - SCORE_OFFSET, (data >> GENERATION_SHIFT) & 0xFF)
+
+    def store(self, key, move, bound, depth, score):
+        self.stores += 1
+        words = self.words
+        index = SHARED_HEADER_WORDS + ((key & self.mask) << 2)
+        moveID = move.moveID if move is not None else 0
+        deepData = words[index + 1]
+        deepKey = words[index] ^ deepData
+        if not deepData or deepKey == key or depth >= (deepData >> DEPTH_SHIFT) & 0xFF or \
+                (deepData >> GENERATION_SHIFT) & 0xFF != self.generation:
+            if deepKey == key and not moveID:
+                moveID = deepData & MOVE_MASK  # keep the old best move rather than forget it
+        else:
+            index += 2
+            if words[index] ^ words[index + 1] == key and not moveID:
+                moveID = words[index + 1] & MOVE_MASK
+        if words[index + 1] and words[index] ^ words[index + 1] != key:
+            self.overwrites += 1
+        data = USED_BIT | moveID | bound << BOUND_SHIFT | min(depth, 0xFF) << DEPTH_SHIFT | \
+            self.generation << GENERATION_SHIFT | (score + SCORE_OFFSET) << SCORE_SHIFT
+        words[index] = key ^ data
+        words[index + 1] = data
+
+    def hashfull(self):
+        # permille of the first 1000 slots in use by the current search, as UCI reports it
+        words = self.words
+        slots = min(1000, (len(words) - SHARED_HEADER_WORDS) // 2)
+        used = 0
+        for i in range(slots):
+            data = words[SHARED_HEADER_WORDS + 2 * i + 1]
+            if data and (data >> GENERATION_SHIFT) & 0xFF == self.generation:
+                used += 1
+        return used * 1000 // slots
+
+    def getStats(self):
+        # this process's probes and stores, the table itself is shared
+        return {'sizeMB': self.sizeMB, 'slots': (len(self.words) - SHARED_HEADER_WORDS) // 2, 'probes': self.probes,
+                'hits': self.hits, 'misses': self.misses, 'collisions': self.collisions, 'stores': self.stores,
+                'overwrites': self.overwrites, 'hitRate': self.hits / self.probes if self.probes else 0.0,
+                'hashfull': self.hashfull()}
@@ -0,0 +1,287 @@
+"""
+Headless UCI (Universal Chess Interface) engine, for GUIs and match runners that drive engines over stdin/stdout.
+Commands are read by an asyncio loop while the search runs in a worker thread, so isready, stop and ponderhit
+are answered at once even in the middle of a search. Every completed iteration is sent as an info line
+(depth, score, nodes, nps, time, hashfull, pv). pygame is never imported, the engine starts in a fraction
+of a second.
+
+Usage from the Chess folder:
+    python Uci.py
+Options: Hash (MB), Threads (processes searching in parallel), Backend (bitboard or string), BookFile (Polyglot book), TablebasePath, Move Overhead (ms).
+"""
+import argparse
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Chess.Perft import BACKENDS
+from Chess.Search import Searcher, MAX_PLY
+
+ENGINE_NAME = "Chess-Engine"
+ENGINE_AUTHOR = "NischaySinghPanwar"
+DEFAULT_MOVES_TO_GO = 30  # moves the remaining time is spread over when the GUI doesn't say
+# name: (UCI type, default, extra option fields)
+OPTIONS = {
+    'Hash': ('spin', 16, 'min 1 max 4096'),
+    'Threads': ('spin', 1, 'min 1 max 256'),
+    'Backend': ('combo', 'bitboard', ' '.join(f'var {name}' for name in sorted(BACKENDS))),
+    'BookFile': ('string', '', ''),
+    'TablebasePath': ('string', '', ''),
+    'Move Overhead': ('spin', 30, 'min 0 max 5000'),
+}
+
+
+def parseUciMove(gs, text):
+    # the valid move in gs written in UCI long algebraic notation (e2e4, e7e8q), or None
+    if len(text) not in (4, 5) or text[0] not in 'abcdefgh' or text[2] not in 'abcdefgh' or \
+            text[1] not in '12345678' or text[3] not in '12345678':
+        return None
+    endRow, endCol = 8 - int(text[3]), 'abcdefgh'.index(text[2])
+    return next((move for move in gs.getValidMovesTo(endRow, endCol) if move.getChessNotation() == text), None)
+
+
+def infoLine(result, hashfull=None):
+    # a SearchResult as a UCI info line
+    mate = result.mateIn()
+    score = f"mate {mate}" if mate is not None else f"cp {result.score}"
+    line = f"info depth {result.depth} score {score} nodes {result.nodes} nps {result.nps} " \
+           f"time {int(result.seconds * 1000)}"
+    if hashfull is not None:
+        line += f" hashfull {hashfull}"
+    if result.pv:
+        line += " pv " + ' '.join(move.getChessNotation() for move in result.pv)
+    return line
+
+
+def timeForMove(timeLeft, increment=0, movesToGo=None, overhead=0):
+    # seconds to spend on this move, clock times in milliseconds: an even share of what's left plus most of the increment
+    share = timeLeft / (movesToGo or DEFAULT_MOVES_TO_GO) + increment * 0.8
+    return max(10, min(share, timeLeft / 2) - overhead) / 1000
+
+
+class UciEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.options = {name: default for name, (_, default, _) in OPTIONS.items()}
+        self.searcher = Searcher(self.options['Hash'])
+        self.gs = BACKENDS[self.options['Backend']]()
+        self.worker = ThreadPoolExecutor(1)  # the search thread
+        self.searchTask = None
+        self.stopRequested = False
+        self.pondering = False
+        self.ponderTimeLimit = None  # the time limit a ponder search gets on ponderhit
+        self.released = None  # set when an infinite or ponder search may send its bestmove
+
+    def send(self, line):
+        self.output.write(line + '\n')
+        self.output.flush()
+
+    async def run(self, input=sys.stdin):
+        '''
+        Reads and executes commands until quit or the end of the input. Lines are read in a thread of
+        their own so reading works the same for pipes, terminals and files on every platform.
+        '''
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(1) as reader:
+            while True:
+                line = await loop.run_in_executor(reader, input.readline)
+                if not line or not await self.execute(line.strip()):
+                    break
+        await self.stopSearch()
+        self.worker.shutdown()
+        if hasattr(self.searcher, 'close'):
+            self.searcher.close()
+
+    async def execute(self, line):
+        # runs one command, False once the engine should quit
+        command, _, arguments = line.partition(' ')
+        arguments = arguments.strip()
+        if command == 'uci':
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            for name, (kind, default, extra) in OPTIONS.items():
+                self.send(f"option name {name} type {kind} default {default if default != '' else '<empty>'}"
+                          + (f" {extra}" if extra else ''))
+            self.send("uciok")
+        elif command == 'isready':
+            self.send("readyok")
+        elif command == 'setoption':
+            await self.setOption(arguments)
+        elif command == 'ucinewgame':
+            await self.stopSearch()
+            self.searcher.tt.clear()
+            self.gs = BACKENDS[self.options['Backend']]()
+        elif command == 'position':
+            await self.stopSearch()
+            self.setPosition(arguments)
+        elif command == 'go':
+            await self.stopSearch()
+            self.go(arguments)
+        elif command == 'stop':
+            await self.stopSearch()
+        elif command == 'ponderhit':
+            self.ponderHit()
+        elif command == 'quit':
+            return False
+        elif command and command not in ('debug', 'register'):
+            self.send(f"info string unknown command {command}")
+        return True
+
+    async def setOption(self, arguments):
+        # "name <name> value <value>", both parts may contain spaces
+        words = arguments.split()
+        if 'name' not in words:
+            return
+        valueAt = words.index('value') if 'value' in words else len(words)
+        name = ' '.join(words[words.index('name') + 1:valueAt])
+        value = ' '.join(words[valueAt + 1:])
+        if name not in OPTIONS:
+            self.send(f"info string unknown option {name}")
+            return
+        await self.stopSearch()
+        try:
+            if OPTIONS[name][0] == 'spin':
+                value = int(value)
+            if name == 'Hash' and self.options['Threads'] == 1:
+                self.searcher.tt.resize(value)
+            elif name in ('Hash', 'Threads'):
+                if value < 1:
+                    raise ValueError(f"{name} must be at least 1")
+                self.setSearcher(value if name == 'Hash' else self.options['Hash'],
+                                 value if name == 'Threads' else self.options['Threads'])
+            elif name == 'Backend':
+                if value not in BACKENDS:
+                    raise ValueError(f"no backend {value}")
+                self.gs = BACKENDS[value].from_fen(self.gs.to_fen())
+            elif name == 'BookFile':
+                from Chess.Polyglot import PolyglotBook  # only loaded when asked for
+                if self.searcher.book is not None:
+                    self.searcher.book.close()
+                self.searcher.book = PolyglotBook(value) if value and value != '<empty>' else None
+            elif name == 'TablebasePath':
+                from Chess.Tablebase import Tablebases  # numpy is only loaded when asked for
+                if self.searcher.tablebases is not None:
+                    self.searcher.tablebases.close()
+                self.searcher.tablebases = Tablebases(value) if value and value != '<empty>' else None
+        except (OSError, ValueError) as e:
+            self.send(f"info string option {name} not set: {e}")
+            return
+        self.options[name] = value
+
+    def setSearcher(self, hashMB, threads):
+        # a new searcher with the book and tablebases of the old one, several threads search in processes
+        old = self.searcher
+        if threads > 1:
+            from Chess.ParallelSearch import ParallelSearcher  # helper processes are only started when asked for
+            self.searcher = ParallelSearcher(threads, hashMB, book=old.book, tablebases=old.tablebases)
+        else:
+            self.searcher = Searcher(hashMB, book=old.book, tablebases=old.tablebases)
+        if hasattr(old, 'close'):
+            old.close()
+
+    def setPosition(self, arguments):
+        # "startpos [moves ...]" or "fen <fen> [moves ...]"
+        position, _, moves = arguments.partition('moves')
+        position = position.split()
+        gameStateClass = BACKENDS[self.options['Backend']]
+        try:
+            if position[:1] == ['startpos']:
+                gs = gameStateClass()
+            elif position[:1] == ['fen']:
+                gs = gameStateClass.from_fen(' '.join(position[1:]))
+            else:
+                raise ValueError(f"bad position command {arguments!r}")
+            for text in moves.split():
+                move = parseUciMove(gs, text)
+                if move is None:
+                    raise ValueError(f"illegal move {text} in {gs.to_fen()}")
+                gs.makeMove(move)
+        except (ValueError, IndexError) as e:
+            self.send(f"info string {e}")
+            return
+        self.gs = gs
+
+    def go(self, arguments):
+        limits = {}
+        words = arguments.split()
+        for i, word in enumerate(words):
+            if word in ('wtime', 'btime', 'winc', 'binc', 'movestogo', 'depth', 'nodes', 'movetime'):
+                try:
+                    limits[word] = int(words[i + 1])
+                except (IndexError, ValueError):
+                    pass
+        infinite = 'infinite' in words
+        white = self.gs.whiteToMove
+        overhead = self.options['Move Overhead']
+        timeLimit = None
+        if 'movetime' in limits:
+            timeLimit = max(0.01, (limits['movetime'] - overhead) / 1000)
+        elif ('wtime' if white else 'btime') in limits:
+            timeLimit = timeForMove(limits['wtime' if white else 'btime'], limits.get('winc' if white else 'binc', 0),
+                                    limits.get('movestogo'), overhead)
+        self.pondering = 'ponder' in words
+        self.ponderTimeLimit = timeLimit
+        if self.pondering or infinite:
+            timeLimit = None  # searched until stop, or until ponderhit starts the clock
+        self.stopRequested = False
+        self.released = asyncio.Event()
+        if not (self.pondering or infinite):
+            self.released.set()
+        self.searchTask = asyncio.ensure_future(
+            self.search(self.gs, min(limits.get('depth', MAX_PLY), MAX_PLY), timeLimit, limits.get('nodes')))
+
+    async def search(self, gs, maxDepth, timeLimit, nodeLimit):
+        loop = asyncio.get_running_loop()
+        searcher = self.searcher
+
+        def report(result):  # called on the search thread
+            # a stop or ponderhit that came before the search had started would have been undone by it
+            if self.stopRequested:
+                searcher.stop()
+            elif not self.pondering and self.ponderTimeLimit is not None and searcher.deadline is None:
+                searcher.setTimeLimit(self.ponderTimeLimit)
+            loop.call_soon_threadsafe(self.send, infoLine(result, searcher.tt.hashfull()))
+        result = await loop.run_in_executor(
+            self.worker, lambda: searcher.search(gs, maxDepth, timeLimit, nodeLimit, infoCallback=report))
+        await self.released.wait()  # UCI sends no bestmove for an infinite or ponder search before stop/ponderhit
+        if result.bestMove is None:
+            self.send("bestmove 0000")
+        elif len(result.pv) > 1:
+            self.send(f"bestmove {result.bestMove.getChessNotation()} ponder {result.pv[1].getChessNotation()}")
+        else:
+            self.send(f"bestmove {result.bestMove.getChessNotation()}")
+
+    async def stopSearch(self):
+        # stops a running search and waits for its bestmove to be sent
+        if self.searchTask is None:
+            return
+        self.stopRequested = True
+        self.searcher.stop()
+        self.released.set()
+        await self.searchTask
+        self.searchTask = None
+
+    def ponderHit(self):
+        # the opponent played the expected move, the ponder search goes on as a normal one
+        if self.searchTask is None or not self.pondering:
+            return
+        self.pondering = False
+        if self.ponderTimeLimit is not None:
+            self.searcher.setTimeLimit(self.ponderTimeLimit)
+        self.released.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UCI engine on stdin/stdout")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=OPTIONS['Backend'][1])
+    args = parser.parse_args(argv)
+    engine = UciEngine()
+    engine.options['Backend'] = args.backend
+    engine.gs = BACKENDS[args.backend]()
+    asyncio.run(engine.run())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+"""
+Zobrist hashing for GameState.
+Every (piece, square) pair, the side to move, each castling rights combination and each en passant file get a
+random 64-bit key. A position's key is the xor of the keys of everything in it, so makeMove can update it by
+xoring only what changed. The keys come from a fixed seed so they are the same in every process.
+"""
+import random
+
+_random = random.Random(20240611)
+
+PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+PIECE_KEYS = {piece: [_random.getrandbits(64) for _ in range(64)] for piece in PIECES}  # [piece][row * 8 + col]
+SIDE_KEY = _random.getrandbits(64)  # xored in when black is to move
+CASTLE_KEYS = [_random.getrandbits(64) for _ in range(16)]  # indexed by castleIndex
+ENPASSANT_KEYS = [_random.getrandbits(64) for _ in range(8)]  # indexed by the en passant column
+
+
+def castleIndex(castleRights):
+    # the four castling rights packed into 4 bits
+    return castleRights.wks | (castleRights.wqs << 1) | (castleRights.bks << 2) | (castleRights.bqs << 3)
+
+
+def computeKey(gs):
+    '''
+    Hashes a position from scratch. GameState only needs this once when a position is set up,
+    after that makeMove keeps the key up to date. Also handy to check the incremental key.
+    '''
+    key = 0
+    for r in range(8):
+        for c in range(8):
+            piece = gs.board[r][c]
+            if piece != "--":
+                key ^= PIECE_KEYS[piece][r * 8 + c]
+    if not gs.whiteToMove:
+        key ^= SIDE_KEY
+    key ^= CASTLE_KEYS[castleIndex(gs.currentCastlingRight)]
+    if gs.enpassantPossible:
+        key ^= ENPASSANT_KEYS[gs.enpassantPossible[1]]
+    return key
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+import pytest
+
+from Chess.AnalysisServer import AnalysisServer, AnalysisClient
+
+START = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+KIWIPETE = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+
+
+@pytest.fixture(scope='module')
+def socketPath(tmp_path_factory):
+    # a server with one worker on a temporary Unix socket, run by an event loop in a thread of its own
+    path = str(tmp_path_factory.mktemp('analysis') / 'server.sock')
+    server = AnalysisServer(workers=1, hashMB=1)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start(path))
+        started.set()
+        loop.run_forever()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert started.wait(30)
+    yield path
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(30)
+    server.close()
+    loop.close()
+
+
+def test_batch_streams_every_position_then_hits_the_cache(socketPath):
+    with AnalysisClient(socketPath=socketPath, timeout=60) as client:
+        results = list(client.analyse([START, KIWIPETE], depth=2))
+        assert sorted(result['index'] for result in results) == [0, 1]
+        for result in results:
+            assert result['depth'] == 2 and result['bestMove'] is not None and not result['cached']
+            assert result['fen'] == (START, KIWIPETE)[result['index']]
+        again = {result['index']: result for result in client.analyse([KIWIPETE, START], depth=2)}
+        assert again[0]['cached'] and again[1]['cached']
+        assert again[0]['bestMove'] == next(r['bestMove'] for r in results if r['index'] == 1)
+        assert client.stats()['cacheHits'] >= 2
+
+
+def test_node_limited_results_are_not_cached(socketPath):
+    fen = "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"
+    with AnalysisClient(socketPath=socketPath, timeout=60) as client:
+        [limited] = client.analyse([fen], nodes=2000)
+        [searched] = client.analyse([fen], depth=limited['depth'])
+        assert not limited['cached'] and not searched['cached']
+
+
+def test_bad_position_only_fails_itself(socketPath):
+    with AnalysisClient(socketPath=socketPath, timeout=60) as client:
+        results = {result['index']: result for result in client.analyse(["not a fen", START], depth=1)}
+        assert 'error' in results[0] and results[1]['bestMove'] is not None
+
+
+@pytest.mark.parametrize('message, error', [
+    ({'positions': [START], 'depth': 'deep'}, "depth, time and nodes must be numbers"),
+    ({'positions': [START]}, "give a depth, time or nodes budget"),
+    ({'positions': START, 'depth': 1}, "positions must be a list of FEN strings"),
+])
+def test_request_errors(socketPath, message, error):
+    with AnalysisClient(socketPath=socketPath, timeout=60) as client:
+        requestId = client.request(message)
+        assert client.readLine() == {'id': requestId, 'error': error}
+
+
+def test_client_raises_on_an_error_reply(socketPath):
+    with AnalysisClient(socketPath=socketPath, timeout=60) as client:
+        with pytest.raises(ValueError, match="give a depth, time or nodes budget"):
+            list(client.analyse([START]))
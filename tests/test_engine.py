@@ -0,0 +1,96 @@
+import math
+import random
+
+import pytest
+
+from Chess import Notation
+from Chess.ChessEngine import GameState
+from Chess.Match import MatchStats, formatElo
+from Chess.Perft import BACKENDS, REFERENCE_POSITIONS, perft
+from Chess.Polyglot import polyglotKey
+from Chess.TranspositionTable import SharedTranspositionTable, EXACT, LOWER_BOUND
+
+PERFT_DEPTH = 3
+
+
+@pytest.mark.parametrize('backend', sorted(BACKENDS))
+@pytest.mark.parametrize('position', REFERENCE_POSITIONS, ids=[position['name'] for position in REFERENCE_POSITIONS])
+def test_perft_matches_the_reference_counts(backend, position):
+    gs = BACKENDS[backend].from_fen(position['fen'])
+    for depth, nodes in enumerate(position['nodes'][:PERFT_DEPTH], 1):
+        assert perft(gs, depth) == nodes
+    assert gs.to_fen() == position['fen']
+
+
+def test_polyglot_keys():
+    # the keys of the Polyglot book format specification
+    gs = GameState()
+    assert polyglotKey(gs) == 0x463b96181691fc9c
+    gs.makeMove(Notation.parseSan(gs, 'e4'))
+    assert polyglotKey(gs) == 0x823c9b50fd114196
+    gs.makeMove(Notation.parseSan(gs, 'd5'))
+    assert polyglotKey(gs) == 0x0756b94461c50fb0
+
+
+@pytest.mark.parametrize('backend', sorted(BACKENDS))
+def test_san_round_trip(backend):
+    # every legal move of random games and the reference positions comes back from its SAN
+    rng = random.Random(1)
+    for position in REFERENCE_POSITIONS:
+        gs = BACKENDS[backend].from_fen(position['fen'])
+        for _ in range(40):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            for move in moves:
+                san = Notation.toSan(gs, move, moves)
+                assert Notation.parseSan(gs, san) == move, san
+            gs.makeMove(rng.choice(moves))
+
+
+def test_san_marks_checks_and_mates():
+    gs = GameState()
+    sans = []
+    for san in ('f3', 'e5', 'g4', 'Qh4'):
+        move = Notation.parseSan(gs, san)
+        sans.append(Notation.toSan(gs, move))
+        gs.makeMove(move)
+    assert sans == ['f3', 'e5', 'g4', 'Qh4#']
+
+
+@pytest.mark.parametrize('wins, losses, sign', [(10, 0, 1), (0, 10, -1)])
+def test_elo_without_draws_or_losses(wins, losses, sign):
+    stats = MatchStats()
+    stats.wins, stats.losses = wins, losses
+    elo, margin = stats.elo()
+    assert elo == sign * math.inf and margin is None
+    assert formatElo(elo, margin) == f"elo {'+' if sign > 0 else '-'}inf +/- ?"
+
+
+def test_elo_of_an_even_score():
+    stats = MatchStats()
+    stats.wins = stats.losses = stats.draws = 10
+    elo, margin = stats.elo()
+    assert elo == 0.0 and 0 < margin < math.inf
+
+
+def test_shared_transposition_table_store_and_probe():
+    gs = GameState()
+    move = Notation.parseSan(gs, 'Nf3')
+    table = SharedTranspositionTable(1)
+    try:
+        table.store(gs.zobristKey, move, EXACT, 5, -37)
+        assert table.probe(gs.zobristKey, gs.board) == (move, EXACT, 5, -37)
+        assert table.probe(gs.zobristKey) == (move.moveID, EXACT, 5, -37)
+        assert table.probe(gs.zobristKey ^ 1, gs.board) is None
+        # another handle attached by name, as a helper process would, sees the entry and can store its own
+        other = SharedTranspositionTable(name=table.name)
+        try:
+            assert other.probe(gs.zobristKey, gs.board) == (move, EXACT, 5, -37)
+            other.store(gs.zobristKey, None, LOWER_BOUND, 7, 120)
+        finally:
+            other.close()
+        # a store without a move keeps the best move the slot had
+        assert table.probe(gs.zobristKey, gs.board) == (move, LOWER_BOUND, 7, 120)
+    finally:
+        table.close()
@@ -0,0 +1,57 @@
+import time
+
+from Chess import Notation
+from Chess.ChessEngine import GameState
+from Chess.EngineWorker import EngineWorker, ENGINE_MOVE, ENGINE_ERROR
+from Chess.Search import Searcher
+
+
+def waitForResults(worker, count=1, timeout=30):
+    results = []
+    deadline = time.monotonic() + timeout
+    while len(results) < count and time.monotonic() < deadline:
+        results += worker.poll()
+        time.sleep(0.01)
+    return results
+
+
+class RecordingSearcher(Searcher):
+    # remembers the position it was asked to search
+    def search(self, gs, *args, **kwargs):
+        self.moveLog = list(gs.moveLog)
+        self.repetition = gs.isRepetition()
+        return super().search(gs, *args, **kwargs)
+
+
+class FailingSearcher(Searcher):
+    def search(self, gs, *args, **kwargs):
+        raise RuntimeError("broken engine")
+
+
+def test_worker_searches_the_game_with_its_history():
+    gs = GameState()
+    for san in ('Nf3', 'Nf6', 'Ng1', 'Ng8'):
+        gs.makeMove(Notation.parseSan(gs, san))
+    searcher = RecordingSearcher()
+    worker = EngineWorker(searcher=searcher)
+    try:
+        worker.requestMove(gs, timeLimit=0.2, maxDepth=2)
+        [result] = waitForResults(worker)
+    finally:
+        worker.close()
+    assert result.kind == ENGINE_MOVE and result.move is not None and result.fen == gs.to_fen()
+    assert [move.moveID for move in searcher.moveLog] == [move.moveID for move in gs.moveLog]
+    assert searcher.repetition
+    assert len(gs.moveLog) == 4  # the caller's game is left as it was
+
+
+def test_worker_posts_errors():
+    worker = EngineWorker(searcher=FailingSearcher())
+    try:
+        worker.requestMove(GameState(), timeLimit=0.2)
+        worker.requestValidMoves(GameState())  # the thread lives on after an error
+        first, second = waitForResults(worker, 2)
+    finally:
+        worker.close()
+    assert first.kind == ENGINE_ERROR and str(first.error) == "broken engine"
+    assert len(second.moves) == 20
@@ -0,0 +1,15 @@
+from Chess import Instrumentation
+from Chess.BitboardEngine import BitboardGameState
+from Chess.ChessEngine import GameState
+from Chess.Perft import perft
+
+
+def test_overridden_methods_are_counted_once():
+    with Instrumentation.Profiler() as profiler:
+        perft(BitboardGameState(), 3)
+        perft(GameState(), 2)
+    functions = profiler.snapshot()['functions']
+    assert functions['BitboardGameState.undoMove']['calls'] == 20 + 400
+    assert functions['GameState.undoMove']['calls'] == 20  # only the string backend's own undos
+    assert functions['GameState.makeMove']['calls'] == 20 + 400 + 20
+    assert GameState.undoMove.__name__ == 'undoMove' and not hasattr(GameState.undoMove, '__wrapped__')